@@ -9,8 +9,13 @@ Shows what's in the data folders and validates label files.
 
 from pathlib import Path
 import os
+import sys
 import json
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'scripts'))
+from annotation_store import AnnotationStore
+from file_index import FileIndex
+
 def check_data():
     """Check data processing results."""
     print("🔍 Checking Data Processing Results")
@@ -23,16 +28,26 @@ def check_data():
     total_raw_images = 0
     total_raw_annotations = 0
 
+    # One indexed pass per tree; directories unchanged since the last check are not re-listed
+    file_index = FileIndex()
+
     if raw_images_dir.exists():
-        for material_dir in raw_images_dir.iterdir():
-            if material_dir.is_dir():
-                images = list(material_dir.glob("*.jpg"))
-                jsons = list(material_dir.glob("*.json"))
+        images_per_dir = {}
+        for indexed in file_index.scan(raw_images_dir, ['.jpg']):
+            if indexed.path.parent != raw_images_dir:
+                images_per_dir[indexed.path.parent] = images_per_dir.get(indexed.path.parent, 0) + 1
+
+        with AnnotationStore() as store:
+            # Annotations are counted in the store; sidecars it has not seen are imported first
+            store.import_sidecars(raw_images_dir)
 
-                total_raw_images += len(images)
-                total_raw_annotations += len(jsons)
+            for material_dir, images in sorted(images_per_dir.items()):
+                annotations = sum(store.counts('material_type', material_dir).values())
 
-                print(f"  {material_dir.name}: {len(images)} images, {len(jsons)} annotations")
+                total_raw_images += images
+                total_raw_annotations += annotations
+
+                print(f"  {material_dir.name}: {images} images, {annotations} annotations")
 
     print(f"  Total: {total_raw_images} images, {total_raw_annotations} annotations")
 
@@ -42,8 +57,14 @@ def check_data():
 
     if not scrap_dataset_dir.exists():
         print("  ❌ data/scrap_dataset folder doesn't exist!")
+        file_index.close()
         return
 
+    split_files = {}
+    for indexed in file_index.scan(scrap_dataset_dir, ['.jpg', '.txt']):
+        split_files.setdefault(indexed.path.parent.name, []).append(indexed.path)
+    file_index.close()
+
     total_processed_images = 0
     total_processed_labels = 0
 
@@ -51,8 +72,9 @@ def check_data():
         split_dir = scrap_dataset_dir / split
 
         if split_dir.exists():
-            images = list(split_dir.glob("*.jpg"))
-            labels = list(split_dir.glob("*.txt"))
+            files = split_files.get(split, [])
+            images = [p for p in files if p.suffix.lower() == '.jpg' and p.parent == split_dir]
+            labels = [p for p in files if p.suffix.lower() == '.txt' and p.parent == split_dir]
 
             total_processed_images += len(images)
             total_processed_labels += len(labels)
@@ -113,14 +135,14 @@ def check_data():
     print(f"  Processed images: {total_processed_images}")
     print(f"  Processed labels: {total_processed_labels}")
 
-    if total_process_images == total_process_labels and total_process_labels > 0:
+    if total_processed_images == total_processed_labels and total_processed_labels > 0:
         print("  ✅ Data processing appears successful!")
     else:
         print("  ❌ Data processing incomplete - missing labels!")
 
         if total_raw_images == 0:
             print("    💡 Need to run data generation first")
-        elif total_process_labels == 0:
+        elif total_processed_labels == 0:
             print("    💡 Need to run data processing")
 
 if __name__ == "__main__":
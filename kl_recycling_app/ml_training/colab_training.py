@@ -81,11 +81,15 @@ def create_data_collection_interface():
 
     interface_code = '''
 from IPython.display import display, HTML, Javascript
-import base64, json, uuid
+import base64, json, sys, uuid
 from datetime import datetime
 from pathlib import Path
 import numpy as np
 
+sys.path.insert(0, 'scripts')
+from annotation_store import AnnotationStore
+annotation_store = AnnotationStore()
+
 # Create directories
 data_dir = Path('data/raw_images')
 for material in ['steel', 'aluminum', 'copper', 'brass']:
@@ -217,6 +221,8 @@ def colab_save_photo(material, data_url):
         annotation_path = filepath.with_suffix('.json')
         with open(annotation_path, 'w') as f:
             json.dump(annotation, f, indent=2)
+        annotation_store.put(filepath, annotation, source='colab')
+        annotation_store.commit()
 
         print(f"✅ {material}: {filename} ({weight:.1f} lbs)")
         return "Photo saved successfully"
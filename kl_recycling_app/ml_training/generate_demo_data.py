@@ -8,10 +8,12 @@ and testing of the ML training pipeline.
 
 Usage:
     python generate_demo_data.py --count 100 --materials steel aluminum copper brass
+    python generate_demo_data.py --count 100 --metrics-report data/metrics/generate_demo_run.json
 """
 
 import argparse
 import os
+import sys
 import cv2
 import numpy as np
 from pathlib import Path
@@ -20,14 +22,23 @@ from datetime import datetime
 import uuid
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'scripts'))
+from annotation_store import DEFAULT_ANNOTATION_STORE, AnnotationStore
+from file_index import scan_files
+from pipeline_metrics import NULL_METRICS, PipelineMetrics, save_run_metrics
+
 
 class ScrapMetalDemoGenerator:
     """Generate synthetic scrap metal images for training demonstration."""
 
-    def __init__(self, output_dir: str = "data/raw_images"):
+    def __init__(self, output_dir: str = "data/raw_images", annotation_store: str = DEFAULT_ANNOTATION_STORE):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
+        # Annotations are recorded in the annotation store as well as in sidecars
+        self.annotation_store_path = annotation_store
+        self.annotation_store = None
+
         # Material colors
         self.material_colors = {
             'steel': (128, 128, 128),      # Gray
@@ -44,6 +55,9 @@ class ScrapMetalDemoGenerator:
             'brass': (4, 25)
         }
 
+        # Stage timings and counters; replaced with a PipelineMetrics to enable
+        self.metrics = NULL_METRICS
+
     def generate_demo_dataset(self, count_per_material: int = 50,
                             materials: list = ['steel', 'aluminum', 'copper', 'brass']):
         """Generate complete demo dataset."""
@@ -53,12 +67,37 @@ class ScrapMetalDemoGenerator:
         print(f"Materials: {', '.join(materials)}")
 
         total_images = 0
+        self.annotation_store = AnnotationStore(self.annotation_store_path)
+
+        try:
+            total_images = self._generate_materials(count_per_material, materials)
+
+            print(f"\n✅ Generated {total_images} total images!")
+            print(f"📁 Located in: {self.output_dir}")
+
+            # Generate statistics
+            self._generate_dataset_summary()
+        finally:
+            self.annotation_store.close()
+            self.annotation_store = None
+
+        return total_images
+
+    def _generate_materials(self, count_per_material: int, materials: list) -> int:
+        """Render count_per_material images of each material; returns how many were written."""
+        total_images = 0
+
+        # Existing images per material from one indexed scan of the output tree
+        existing = {}
+        with self.metrics.stage('scan'):
+            for indexed in scan_files(self.output_dir, ['.jpg']):
+                existing[indexed.path.parent.name] = existing.get(indexed.path.parent.name, 0) + 1
 
         for material in materials:
             material_dir = self.output_dir / material
             material_dir.mkdir(exist_ok=True)
 
-            existing_images = len(list(material_dir.glob('*.jpg')))
+            existing_images = existing.get(material, 0)
             print(f"\n{material}: {existing_images} existing, generating {count_per_material} new images")
 
             # Generate new images
@@ -72,32 +111,31 @@ class ScrapMetalDemoGenerator:
                 self._generate_scrap_image(material, img_path, i)
 
                 total_images += 1
-
-        print(f"\n✅ Generated {total_images} total images!")
-        print(f"📁 Located in: {self.output_dir}")
-
-        # Generate statistics
-        self._generate_dataset_summary()
+                self.metrics.count('generated')
 
         return total_images
 
     def _generate_scrap_image(self, material: str, output_path: Path, variation: int):
         """Generate a single scrap metal image."""
 
-        # Create base image (640x480 - mobile photo dimensions)
-        img = np.full((480, 640, 3), 255, dtype=np.uint8)  # White background
+        with self.metrics.stage('render'):
+            # Create base image (640x480 - mobile photo dimensions)
+            img = np.full((480, 640, 3), 255, dtype=np.uint8)  # White background
 
-        # Add some background texture
-        self._add_background_texture(img)
+            # Add some background texture
+            self._add_background_texture(img)
 
-        # Add reference object (coin)
-        self._add_reference_coin(img, variation)
+            # Add reference object (coin)
+            self._add_reference_coin(img, variation)
 
-        # Add main scrap metal object
-        bbox, weight = self._add_scrap_object(img, material, variation)
+            # Add main scrap metal object
+            bbox, weight = self._add_scrap_object(img, material, variation)
 
         # Save image
-        cv2.imwrite(str(output_path), cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+        with self.metrics.stage('encode'):
+            cv2.imwrite(str(output_path), cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+        if self.metrics.enabled:
+            self.metrics.add_written('encode', output_path.stat().st_size)
 
         # Create annotation
         annotation = {
@@ -114,8 +152,13 @@ class ScrapMetalDemoGenerator:
 
         # Save annotation
         annotation_path = output_path.with_suffix('.json')
-        with open(annotation_path, 'w') as f:
-            json.dump(annotation, f, indent=2)
+        with self.metrics.stage('annotate'):
+            text = json.dumps(annotation, indent=2)
+            with open(annotation_path, 'w') as f:
+                f.write(text)
+            if self.annotation_store:
+                self.annotation_store.put(output_path, annotation, source='demo')
+        self.metrics.add_written('annotate', len(text))
 
     def _add_background_texture(self, img: np.ndarray):
         """Add realistic background texture."""
@@ -279,29 +322,21 @@ class ScrapMetalDemoGenerator:
             }
         }
 
-        # Count images per material
-        for material_dir in self.output_dir.iterdir():
-            if material_dir.is_dir() and not any(x in str(material_dir) for x in ['train', 'val', 'test']):
-                images = list(material_dir.glob('*.jpg'))
-                summary['materials'][material_dir.name] = len(images)
-                summary['total_images'] += len(images)
-
-        # Weight statistics
-        weights = []
-        for json_file in self.output_dir.rglob('*.json'):
-            try:
-                with open(json_file, 'r') as f:
-                    data = json.load(f)
-                    weights.append(data['weight_pounds'])
-            except:
-                pass
-
-        if weights:
+        # Images per material and weight statistics, aggregated by the annotation store;
+        # sidecars written before the store existed are imported first
+        store = self.annotation_store
+        store.import_sidecars(self.output_dir)
+        for material, count in sorted(store.counts('material_type', self.output_dir, recursive=True).items()):
+            summary['materials'][material] = count
+            summary['total_images'] += count
+
+        weights = store.weight_stats(self.output_dir, recursive=True)
+        if weights['count']:
             summary['weight_stats'] = {
-                'mean': round(np.mean(weights), 2),
-                'min': min(weights),
-                'max': max(weights),
-                'count': len(weights)
+                'mean': round(weights['mean'], 2),
+                'min': weights['min'],
+                'max': weights['max'],
+                'count': weights['count']
             }
 
         # Save summary
@@ -325,11 +360,19 @@ def main():
                        help='Materials to generate')
     parser.add_argument('--output', default='data/raw_images',
                        help='Output directory base')
+    parser.add_argument('--metrics-report', metavar='PATH',
+                       help='Record per-stage timings and counters and write a JSON run report to PATH')
+    parser.add_argument('--prometheus-textfile', metavar='PATH',
+                       help='Also write the run metrics as a Prometheus textfile (node exporter)')
 
     args = parser.parse_args()
 
     generator = ScrapMetalDemoGenerator(args.output)
+    if args.metrics_report or args.prometheus_textfile:
+        generator.metrics = PipelineMetrics(run='generate_demo_data')
+
     generator.generate_demo_dataset(args.count, args.materials)
+    save_run_metrics(generator.metrics, args.metrics_report, args.prometheus_textfile)
 
     print(f"\n🎉 Demo dataset generated successfully!")
     print(f"📁 Location: {args.output}")
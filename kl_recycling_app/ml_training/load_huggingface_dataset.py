@@ -18,6 +18,7 @@ This script:
 
 import argparse
 import os
+import sys
 import json
 from pathlib import Path
 from datetime import datetime
@@ -26,6 +27,10 @@ from tqdm import tqdm
 import shutil
 import numpy as np
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'scripts'))
+from annotation_store import DEFAULT_ANNOTATION_STORE, AnnotationStore
+from file_index import scan_files
+
 try:
     from datasets import load_dataset
     from PIL import Image
@@ -40,10 +45,14 @@ except ImportError:
 class HuggingFaceDatasetLoader:
     """Load and process scrap metal images from HuggingFace."""
 
-    def __init__(self, output_dir: str = "data/hf_scrap_images"):
+    def __init__(self, output_dir: str = "data/hf_scrap_images", annotation_store: str = DEFAULT_ANNOTATION_STORE):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
+        # Annotations are recorded in the annotation store as well as in sidecars
+        self.annotation_store_path = annotation_store
+        self.annotation_store = None
+
         # Metal categories from the dataset
         self.metal_classes = {
             'steel': 0,
@@ -92,6 +101,7 @@ class HuggingFaceDatasetLoader:
             # Process images
             processed_count = 0
             failed_count = 0
+            self.annotation_store = AnnotationStore(self.annotation_store_path)
 
             for idx, item in tqdm(enumerate(dataset), desc="Processing images", total=min(actual_samples, max_samples) if max_samples > 0 else len(dataset)):
                 if max_samples > 0 and processed_count >= max_samples:
@@ -107,6 +117,9 @@ class HuggingFaceDatasetLoader:
                     print(f"❌ Error processing image {idx}: {e}")
                     failed_count += 1
 
+            self.annotation_store.close()
+            self.annotation_store = None
+
             print(f"\\n✅ Successfully processed: {processed_count} images")
             if failed_count > 0:
                 print(f"⚠️  Failed: {failed_count} images")
@@ -179,11 +192,14 @@ class HuggingFaceDatasetLoader:
 
             # Create YOLO annotation
             annotation = self._create_yolo_annotation(material_type, pil_image.size, metadata)
+            annotation['filename'] = filename
 
             # Save annotation files
             json_path = image_path.with_suffix('.json')
             with open(json_path, 'w') as f:
                 json.dump(annotation, f, indent=2)
+            if self.annotation_store:
+                self.annotation_store.put(image_path, annotation, source='huggingface')
 
             txt_path = image_path.with_suffix('.txt')
             with open(txt_path, 'w') as f:
@@ -239,7 +255,7 @@ class HuggingFaceDatasetLoader:
         height = min(height_ratio, 1.0 - y_center + height_ratio/2, y_center + height_ratio/2)
 
         # YOLO format: class_id x_center y_center width height (normalized)
-        yolo_bbox = ".6f"
+        yolo_bbox = f"{class_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}"
 
         return {
             'filename': None,  # To be set by caller
@@ -298,11 +314,11 @@ class HuggingFaceDatasetLoader:
             }
         }
 
-        # Analyze the processed dataset
-        for material_dir in self.output_dir.iterdir():
-            if material_dir.is_dir() and not any(x in ['train', 'val', 'test'] for x in str(material_dir)):
+        # Analyze the processed dataset, listed in one indexed scan
+        images_per_dir = _images_by_directory(self.output_dir)
+        for material_dir, images in images_per_dir.items():
+            if not any(x in ['train', 'val', 'test'] for x in str(material_dir)):
                 material = material_dir.name
-                images = list(material_dir.glob('*.jpg'))
 
                 stats['dataset_info']['material_distribution'][material] = len(images)
                 stats['dataset_info']['total_images'] += len(images)
@@ -330,10 +346,19 @@ class HuggingFaceDatasetLoader:
         print(f"\\n🎯 Dataset Summary:")
         print(f"   Total Images: {total}")
         if distribution:
-            print("   By Material:"            for mat, count in distribution.items():
+            print("   By Material:")
+            for mat, count in distribution.items():
                 print(f"     {mat}: {count} ({count/total*100:.1f}%)")
 
 
+def _images_by_directory(root: Path) -> dict:
+    """JPEGs under root grouped by directory, from one indexed scan."""
+    images = {}
+    for indexed in scan_files(root, ['.jpg']):
+        images.setdefault(indexed.path.parent, []).append(indexed.path)
+    return images
+
+
 def combine_datasets(synthetic_dir: str = "data/raw_images",
                     huggingface_dir: str = "data/hf_scrap_images",
                     combined_dir: str = "data/combined_scrap_images"):
@@ -347,8 +372,8 @@ def combine_datasets(synthetic_dir: str = "data/raw_images",
 
     synthetic_path = Path(synthetic_dir)
     hf_path = Path(huggingface_dir)
-
-    combined_count = 0
+    synthetic_images = _images_by_directory(synthetic_path)
+    hf_images = _images_by_directory(hf_path)
 
     print("📁 Combining from:")
     print(f"   Synthetic: {synthetic_path}")
@@ -362,7 +387,7 @@ def combine_datasets(synthetic_dir: str = "data/raw_images",
         # Copy synthetic images
         synthetic_material_dir = synthetic_path / material
         if synthetic_material_dir.exists():
-            images = list(synthetic_material_dir.glob('*.jpg'))
+            images = synthetic_images.get(synthetic_material_dir, [])
             for img_path in images:
                 new_name = f"synthetic_{img_path.name}"
                 shutil.copy2(str(img_path), str(combined_material_dir / new_name))
@@ -379,7 +404,7 @@ def combine_datasets(synthetic_dir: str = "data/raw_images",
         # Copy HuggingFace images
         hf_material_dir = hf_path / material
         if hf_material_dir.exists():
-            images = list(hf_material_dir.glob('*.jpg'))
+            images = hf_images.get(hf_material_dir, [])
             for img_path in images:
                 new_name = f"real_{img_path.name}"
                 shutil.copy2(str(img_path), str(combined_material_dir / new_name))
@@ -393,8 +418,11 @@ def combine_datasets(synthetic_dir: str = "data/raw_images",
 
             print(f"   {material}: {len(images)} real images")
 
-        total_per_material = len(list(combined_material_dir.glob('*.jpg')))
-        combined_count += total_per_material
+    combined_count = sum(len(images) for images in _images_by_directory(combined_path).values())
+
+    # Register the renamed copies so loaders read the combined dataset from the annotation store
+    with AnnotationStore(DEFAULT_ANNOTATION_STORE) as store:
+        store.import_sidecars(combined_path, source='combined', replace=True)
 
     print(f"\\n✅ Combined Dataset Ready: {combined_count} total images")
     print(f"📁 Location: {combined_path}")
@@ -0,0 +1,294 @@
+"""
+KL Recycling Annotation Store
+=============================
+
+One SQLite database holding every image annotation, instead of reading one
+indented .json sidecar per image. Each row keeps the annotation exactly as
+it would appear in its sidecar, plus indexed columns for the queries the
+loaders make:
+
+- image_path:  resolved path of the image (primary key)
+- directory:   its parent directory, so a split or material folder is one range scan
+- material_type, split, source: indexed filters
+- content_hash, weight_pounds: copied out of the annotation for lookups and statistics
+
+Loaders read a whole directory with one query (load_annotations). Datasets
+that only have sidecars keep working: every load imports sidecars the store
+does not have yet, or that were modified after their row was last written,
+and export_sidecars writes them back out for tools that still expect files.
+Checking costs one directory listing plus a stat per sidecar; unchanged
+sidecars are never read.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ANNOTATION_STORE = "data/annotations/annotations.sqlite"
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+SPLIT_DIRECTORIES = ('train', 'val', 'test')
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class AnnotationStore:
+    """Indexed annotations keyed by image path, with sidecar import and export."""
+
+    def __init__(self, db_path: str = DEFAULT_ANNOTATION_STORE, commit_every: int = 256):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_every = commit_every
+
+        self._pending = 0
+
+        self._conn = sqlite3.connect(str(self.db_path))
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS annotations (
+                image_path TEXT PRIMARY KEY,
+                directory TEXT NOT NULL,
+                material_type TEXT,
+                split TEXT,
+                source TEXT NOT NULL,
+                content_hash TEXT,
+                weight_pounds REAL,
+                data TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS annotations_directory ON annotations (directory);
+            CREATE INDEX IF NOT EXISTS annotations_material ON annotations (material_type);
+            CREATE INDEX IF NOT EXISTS annotations_split ON annotations (split);
+            CREATE INDEX IF NOT EXISTS annotations_source ON annotations (source);
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @staticmethod
+    def _row(image_path: Path, annotation: Dict[str, Any], source: str,
+             split: Optional[str]) -> Tuple[Any, ...]:
+        image_path = Path(image_path).resolve()
+        if split is None and image_path.parent.name in SPLIT_DIRECTORIES:
+            split = image_path.parent.name
+
+        weight = annotation.get('weight_pounds')
+        return (str(image_path), str(image_path.parent), annotation.get('material_type'), split, source,
+                annotation.get('content_hash'), float(weight) if weight is not None else None,
+                json.dumps(annotation, default=str), time.time())
+
+    def put(self, image_path: Path, annotation: Dict[str, Any], source: str, split: Optional[str] = None):
+        """Insert or replace one image's annotation (split defaults to a train/val/test parent directory)."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO annotations (image_path, directory, material_type, split, source, "
+            "content_hash, weight_pounds, data, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            self._row(image_path, annotation, source, split)
+        )
+        self._tick()
+
+    def put_many(self, items: Iterable[Tuple[Path, Dict[str, Any]]], source: str,
+                 split: Optional[str] = None, replace: bool = True) -> int:
+        """Insert (image_path, annotation) pairs in one transaction; returns the number written."""
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        cursor = self._conn.executemany(
+            f"{verb} INTO annotations (image_path, directory, material_type, split, source, "
+            "content_hash, weight_pounds, data, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self._row(path, annotation, source, split) for path, annotation in items)
+        )
+        self.commit()
+        return cursor.rowcount
+
+    def get(self, image_path: Path) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT image_path, data FROM annotations WHERE image_path = ?", (str(Path(image_path).resolve()),)
+        ).fetchone()
+        return self._annotation(row) if row else None
+
+    def set_split(self, image_path: Path, split: str):
+        self._conn.execute("UPDATE annotations SET split = ? WHERE image_path = ?",
+                           (split, str(Path(image_path).resolve())))
+        self._tick()
+
+    def delete(self, image_paths: Iterable[Path]):
+        self._conn.executemany("DELETE FROM annotations WHERE image_path = ?",
+                               ((str(Path(p).resolve()),) for p in image_paths))
+        self._tick()
+
+    @staticmethod
+    def _annotation(row: sqlite3.Row) -> Dict[str, Any]:
+        annotation = json.loads(row['data'])
+        annotation['image_path'] = row['image_path']
+        return annotation
+
+    def _where(self, directory: Optional[Path], recursive: bool, material: Optional[str],
+               split: Optional[str], source: Optional[str]) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        if directory is not None:
+            directory = str(Path(directory).resolve())
+            if recursive:
+                clauses.append("(directory = ? OR directory LIKE ? ESCAPE '\\')")
+                params += [directory, _escape_like(directory.rstrip(os.sep) + os.sep) + '%']
+            else:
+                clauses.append("directory = ?")
+                params.append(directory)
+        for column, value in (('material_type', material), ('split', split), ('source', source)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, directory: Optional[Path] = None, recursive: bool = False, material: Optional[str] = None,
+              split: Optional[str] = None, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        All matching annotations in one read, ordered by image path. Each
+        dict is the stored annotation with image_path set to the image's
+        resolved path.
+        """
+        where, params = self._where(directory, recursive, material, split, source)
+        rows = self._conn.execute(f"SELECT image_path, data FROM annotations{where} ORDER BY image_path", params)
+        return [self._annotation(row) for row in rows]
+
+    def counts(self, by: str = 'material_type', directory: Optional[Path] = None, recursive: bool = False,
+               **filters: Optional[str]) -> Dict[str, int]:
+        """Number of annotations per material_type, split or source."""
+        if by not in ('material_type', 'split', 'source'):
+            raise ValueError(f"Cannot count annotations by {by}")
+        where, params = self._where(directory, recursive, filters.get('material'), filters.get('split'),
+                                    filters.get('source'))
+        rows = self._conn.execute(f"SELECT {by} AS key, COUNT(*) AS n FROM annotations{where} GROUP BY {by}",
+                                  params)
+        return {row['key']: row['n'] for row in rows}
+
+    def weight_stats(self, directory: Optional[Path] = None, recursive: bool = False,
+                     **filters: Optional[str]) -> Dict[str, float]:
+        """Count, mean, min and max of weight_pounds over matching annotations."""
+        where, params = self._where(directory, recursive, filters.get('material'), filters.get('split'),
+                                    filters.get('source'))
+        where += (" AND " if where else " WHERE ") + "weight_pounds IS NOT NULL"
+        row = self._conn.execute(
+            f"SELECT COUNT(*) AS count, AVG(weight_pounds) AS mean, MIN(weight_pounds) AS min, "
+            f"MAX(weight_pounds) AS max FROM annotations{where}", params
+        ).fetchone()
+        return dict(row) if row['count'] else {'count': 0}
+
+    def import_sidecars(self, root: Path, source: str = 'sidecar', recursive: bool = True,
+                        replace: bool = False) -> int:
+        """
+        Import <image>.json sidecars under root. Only JSON files next to an
+        image with the same stem are annotations; reports and summaries are
+        left alone. Images already in the store are skipped without reading
+        their sidecar unless the sidecar was modified after their row was
+        written, or replace=True. Sidecars newer than their row update its
+        annotation but keep its source and split.
+        """
+        root = Path(root).resolve()
+        if not root.is_dir():
+            return 0
+
+        # image_path -> time its row was last written
+        known: Dict[str, float] = {}
+        if not replace:
+            where, params = self._where(root, recursive, None, None, None)
+            known = dict(self._conn.execute(f"SELECT image_path, updated FROM annotations{where}", params))
+        updates = []
+
+        def sidecars(directory: str):
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+            images = {os.path.splitext(e.name)[0]: e.path for e in entries
+                      if e.is_file() and e.name.lower().endswith(IMAGE_SUFFIXES)}
+            for entry in entries:
+                if entry.is_dir() and recursive:
+                    yield from sidecars(entry.path)
+                elif entry.name.endswith('.json') and entry.name[:-5] in images:
+                    image_path = images[entry.name[:-5]]
+                    updated = known.get(image_path)
+                    try:
+                        if updated is not None and entry.stat().st_mtime <= updated:
+                            continue
+                        with open(entry.path) as f:
+                            annotation = json.load(f)
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"Skipping unreadable annotation {entry.path}: {e}")
+                        continue
+                    if updated is None:
+                        yield Path(image_path), annotation
+                    else:
+                        updates.append((image_path, annotation))
+
+        imported = self.put_many(sidecars(str(root)), source=source, replace=replace)
+        if updates:
+            rows = (self._row(Path(path), annotation, source, None) for path, annotation in updates)
+            self._conn.executemany(
+                "UPDATE annotations SET material_type = ?, content_hash = ?, weight_pounds = ?, data = ?, "
+                "updated = ? WHERE image_path = ?",
+                ((row[2], row[5], row[6], row[7], row[8], row[0]) for row in rows)
+            )
+            self.commit()
+        if imported or updates:
+            logger.info(f"Imported {imported} new and {len(updates)} modified annotation sidecars from {root}")
+        return imported + len(updates)
+
+    def export_sidecars(self, directory: Optional[Path] = None, recursive: bool = True, **filters) -> int:
+        """Write every matching annotation back out as an <image>.json sidecar."""
+        exported = 0
+        where, params = self._where(directory, recursive, filters.get('material'), filters.get('split'),
+                                    filters.get('source'))
+        for row in self._conn.execute(f"SELECT image_path, data FROM annotations{where}", params):
+            sidecar = Path(row['image_path']).with_suffix('.json')
+            if not sidecar.parent.is_dir():
+                continue
+            with open(sidecar, 'w') as f:
+                json.dump(json.loads(row['data']), f, indent=2)
+            exported += 1
+
+        logger.info(f"Exported {exported} annotation sidecars")
+        return exported
+
+    def _tick(self):
+        # Commit in batches; annotations are rewritten from their source if a run is interrupted
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self._conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+
+def load_annotations(directory: Path, store_path: str = DEFAULT_ANNOTATION_STORE, recursive: bool = False,
+                     **filters: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Bulk-read the annotations of one directory. Sidecars that are new or
+    modified since the store last saw them are imported first, so datasets
+    written before the store existed, and sidecars edited by hand, load as
+    they are on disk.
+    """
+    with AnnotationStore(store_path) as store:
+        store.import_sidecars(directory, recursive=recursive)
+        annotations = store.query(directory, recursive=recursive, **filters)
+    return annotations
+
+
+def annotation_store_from_config(dataset_config: Dict[str, Any]) -> Tuple[str, bool]:
+    """Store path and whether sidecars are still written, from dataset.annotation_store."""
+    settings = dataset_config.get('annotation_store', {})
+    return settings.get('path', DEFAULT_ANNOTATION_STORE), bool(settings.get('sidecars', True))
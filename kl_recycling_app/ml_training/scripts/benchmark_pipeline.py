@@ -0,0 +1,973 @@
+#!/usr/bin/env python3
+"""
+KL Recycling Pipeline Benchmarks
+================================
+
+Performance benchmarks for the data processing pipeline. Each benchmark is a
+subcommand and prints a results table; pass --report to also save the raw
+numbers as JSON under data/metrics/.
+
+Usage:
+    python scripts/benchmark_pipeline.py throughput --images data/raw_images/ --max-workers 16
+    python scripts/benchmark_pipeline.py throughput --synthetic 50000 --max-workers 16
+    python scripts/benchmark_pipeline.py decode-drift --images data/raw_images/ --sample 500
+    python scripts/benchmark_pipeline.py kernel --size 4096 --count 4 --strip-rows 256
+    python scripts/benchmark_pipeline.py reference --count 100 --budget-ms 5
+    python scripts/benchmark_pipeline.py imports --repeat 5
+    python scripts/benchmark_pipeline.py imports --entry-points data_processor train_model
+    python scripts/benchmark_pipeline.py scan --images /mnt/nfs/scrap_images/
+    python scripts/benchmark_pipeline.py scan --directories 2000 --files-per-directory 50
+    python scripts/benchmark_pipeline.py duplicates --sizes 5000 20000 100000 --max-distance 6
+    python scripts/benchmark_pipeline.py epoch --dataset data/scrap_dataset/ --epochs 3
+    python scripts/benchmark_pipeline.py epoch --synthetic 512 --epochs 3
+    python scripts/benchmark_pipeline.py dataset-memory --samples 500000 --workers 8
+    python scripts/benchmark_pipeline.py dataset-decode --dataset data/scrap_dataset/ --split train
+    python scripts/benchmark_pipeline.py dataset-decode --synthetic 64 --width 4032 --height 3024
+
+Benchmarks with a budget exit with status 1 when it is exceeded.
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from annotation_store import load_annotations
+from data_processor import IMAGE_EXTENSIONS, QUALITY_ACCEPT_THRESHOLD, ScrapMetalDataProcessor, logger
+from duplicate_index import DuplicateIndex, audit_near_duplicates
+from file_index import FileIndex, scan_files
+from quality_kernel import QualityKernel
+from reference_detector import ReferenceCoinDetector
+
+
+def _write_synthetic_images(root: Path, count: int, width: int = 1280, height: int = 960,
+                            materials: List[str] = None) -> List[Path]:
+    """Write a tree of synthetic JPEG photos spread over material subdirectories."""
+    materials = materials or ["steel", "aluminum", "copper", "brass"]
+    rng = np.random.default_rng(0)
+    paths = []
+
+    for material in materials:
+        (root / material).mkdir(parents=True, exist_ok=True)
+
+    for i in range(count):
+        # Low-frequency background plus a few hard edges so blur/contrast are non-trivial
+        base = rng.integers(0, 256, size=(height // 16, width // 16, 3), dtype=np.uint8)
+        image = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+        for _ in range(4):
+            x, y = int(rng.integers(0, width - 200)), int(rng.integers(0, height - 200))
+            color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+            cv2.rectangle(image, (x, y), (x + 200, y + 150), color, -1)
+
+        path = root / materials[i % len(materials)] / f"synthetic_{i:06d}.jpg"
+        cv2.imwrite(str(path), image)
+        paths.append(path)
+
+    return paths
+
+
+def _worker_counts(max_workers: int) -> List[int]:
+    """1, 2, 4, ... up to and including max_workers."""
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def benchmark_throughput(args) -> Dict[str, Any]:
+    """Images/sec of quality assessment as the worker count scales from 1 to N."""
+    # Measure real decoding work, not cache lookups
+    processor = ScrapMetalDataProcessor(args.config, use_cache=False)
+
+    temp_dir = None
+    if args.images:
+        image_files = [f.path for f in scan_files(args.images, IMAGE_EXTENSIONS)]
+    else:
+        temp_dir = Path(tempfile.mkdtemp(prefix="kl_bench_"))
+        logger.info(f"Writing {args.synthetic} synthetic images to {temp_dir}")
+        image_files = _write_synthetic_images(temp_dir, args.synthetic)
+
+    if args.limit:
+        image_files = image_files[:args.limit]
+
+    try:
+        results = []
+        baseline = None
+
+        for workers in _worker_counts(args.max_workers or os.cpu_count() or 1):
+            start = time.perf_counter()
+            count = sum(1 for _ in processor._iter_quality_metrics(image_files, workers, args.chunk_size))
+            elapsed = time.perf_counter() - start
+
+            images_per_sec = count / elapsed if elapsed > 0 else 0.0
+            baseline = baseline or images_per_sec
+            results.append({
+                'workers': workers,
+                'images': count,
+                'seconds': round(elapsed, 3),
+                'images_per_sec': round(images_per_sec, 2),
+                'speedup': round(images_per_sec / baseline, 2) if baseline else 0.0,
+            })
+            logger.info(f"{workers} workers: {images_per_sec:.1f} images/sec")
+
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        'benchmark': 'throughput',
+        'chunk_size': args.chunk_size,
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+
+def _sample_images(root: str, sample: int) -> List[Path]:
+    """Deterministic sample of the JPEGs under root."""
+    image_files = [f.path for f in scan_files(root, ('.jpg', '.jpeg'))]
+    if sample and len(image_files) > sample:
+        rng = np.random.default_rng(0)
+        image_files = [image_files[i] for i in sorted(rng.choice(len(image_files), sample, replace=False))]
+    return image_files
+
+
+def benchmark_decode_drift(args) -> Dict[str, Any]:
+    """Score drift and accept/reject disagreement of reduced-resolution decoding."""
+    image_files = _sample_images(args.images, args.sample)
+    if not image_files:
+        raise SystemExit(f"No JPEG images found under {args.images}")
+
+    image_bytes = [p.read_bytes() for p in image_files]
+
+    def score_all(scale: int):
+        processor = ScrapMetalDataProcessor(args.config, use_cache=False, decode_scale=scale)
+        start = time.perf_counter()
+        metrics = [processor._assess_image_quality(str(p), data) for p, data in zip(image_files, image_bytes)]
+        return metrics, time.perf_counter() - start
+
+    full, full_seconds = score_all(1)
+    full_accept = np.array([m.overall_score >= QUALITY_ACCEPT_THRESHOLD for m in full])
+    full_blur = np.array([m.blurriness for m in full])
+
+    results = [{
+        'scale': 1, 'ms_per_image': round(1000 * full_seconds / len(full), 2), 'speedup': 1.0,
+        'score_drift_mean': 0.0, 'score_drift_max': 0.0, 'disagreement_rate': 0.0,
+        'blur_ratio': 1.0,
+    }]
+
+    for scale in args.scales:
+        reduced, seconds = score_all(scale)
+
+        drift = np.abs(np.array([m.overall_score for m in reduced]) - np.array([m.overall_score for m in full]))
+        accept = np.array([m.overall_score >= QUALITY_ACCEPT_THRESHOLD for m in reduced])
+        blur = np.array([m.blurriness for m in reduced])
+
+        # Median Laplacian-variance ratio: the blur_threshold_scale that preserves blur decisions
+        valid = full_blur > 0
+        blur_ratio = float(np.median(blur[valid] / full_blur[valid])) if valid.any() else 0.0
+
+        results.append({
+            'scale': scale,
+            'ms_per_image': round(1000 * seconds / len(reduced), 2),
+            'speedup': round(full_seconds / seconds, 2) if seconds > 0 else 0.0,
+            'score_drift_mean': round(float(drift.mean()), 4),
+            'score_drift_max': round(float(drift.max()), 4),
+            'disagreement_rate': round(float(np.mean(accept != full_accept)), 4),
+            'blur_ratio': round(blur_ratio, 3),
+        })
+        logger.info(f"1/{scale} decode: mean score drift {drift.mean():.4f}, "
+                    f"accept/reject disagreement {np.mean(accept != full_accept):.2%}")
+
+    return {
+        'benchmark': 'decode-drift',
+        'images': len(image_files),
+        'accept_threshold': QUALITY_ACCEPT_THRESHOLD,
+        'results': results,
+    }
+
+
+def _reference_quality_stats(image: np.ndarray):
+    """Quality statistics as computed before the fused kernel (separate passes, float64)."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    brightness = np.mean(gray) / 255.0
+    contrast = gray.std() / 255.0
+    blurriness = cv2.Laplacian(gray, cv2.CV_64F).var()
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    saturation = np.mean(hsv[:, :, 1]) / 255.0
+    return brightness, contrast, blurriness, saturation
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20
+
+
+def _kernel_child(implementation: str, image_paths: List[str], iterations: int,
+                  strip_rows: int, queue):
+    """Run one implementation in a fresh process so its peak RSS is not polluted."""
+    cv2.setNumThreads(1)
+    images = [cv2.imread(p) for p in image_paths]
+    compute = {
+        'reference': _reference_quality_stats,
+        'fused': QualityKernel(strip_rows=0).compute,
+        'tiled': QualityKernel(strip_rows=strip_rows).compute,
+    }[implementation]
+
+    baseline = _peak_rss_mb()
+    stats = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        stats = [compute(image) for image in images]
+    elapsed = time.perf_counter() - start
+
+    queue.put({
+        'implementation': implementation,
+        'ms_per_image': round(1000 * elapsed / (iterations * len(images)), 2),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'transient_mb': round(_peak_rss_mb() - baseline, 1),
+        'stats': [[float(v) for v in s] for s in stats],
+    })
+
+
+def benchmark_kernel(args) -> Dict[str, Any]:
+    """Peak RSS and ms/image of the fused/tiled kernel vs the original multi-pass metrics."""
+    temp_dir = None
+    if args.images:
+        image_paths = [str(f.path) for f in scan_files(args.images, ['.jpg'])[:args.count]]
+    else:
+        temp_dir = Path(tempfile.mkdtemp(prefix="kl_bench_"))
+        image_paths = [str(p) for p in _write_synthetic_images(temp_dir, args.count, args.size, args.size)]
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    try:
+        for implementation in ('reference', 'fused', 'tiled'):
+            queue = context.Queue()
+            child = context.Process(target=_kernel_child,
+                                    args=(implementation, image_paths, args.iterations,
+                                          args.strip_rows, queue))
+            child.start()
+            results.append(queue.get())
+            child.join()
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # All implementations must agree before their speed means anything
+    reference, *kernels = (np.array(r.pop('stats')) for r in results)
+    max_relative_error = max(
+        float(np.max(np.abs(k - reference) / np.maximum(np.abs(reference), 1e-12))) for k in kernels
+    )
+    logger.info(f"Kernel max relative error vs reference: {max_relative_error:.2e}")
+
+    return {
+        'benchmark': 'kernel',
+        'images': len(image_paths),
+        'iterations': args.iterations,
+        'max_relative_error': max_relative_error,
+        'results': results,
+    }
+
+
+def _write_demo_images(root: Path, count: int, with_coin: bool) -> List[Path]:
+    """Render generate_demo_data.py images (coin at (50, h - 50), radius 25), optionally without the coin."""
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from generate_demo_data import ScrapMetalDemoGenerator
+
+    generator = ScrapMetalDemoGenerator(str(root))
+    if not with_coin:
+        generator._add_reference_coin = lambda img, variation: None
+
+    np.random.seed(0)
+    paths = []
+    for i in range(count):
+        material = list(generator.material_colors)[i % len(generator.material_colors)]
+        path = root / f"{material}_{i:05d}.jpg"
+        generator._generate_scrap_image(material, path, i)
+        paths.append(path)
+    return paths
+
+
+def _textured_images(count: int, with_coin: bool, width: int = 1280, height: int = 960):
+    """
+    Cluttered scrap-yard-like frames: multi-scale noise with random scratches,
+    elongated blobs and polygons, and optionally a coin at a random position.
+
+    Yields (image, coin center, coin radius); the coin fields are None without one.
+    """
+    rng = np.random.default_rng(1 if with_coin else 2)
+    for _ in range(count):
+        image = np.zeros((height, width, 3), dtype=np.float32)
+        for cell in (4, 16, 64):
+            noise = rng.normal(0, 1, (height // cell + 1, width // cell + 1, 3)).astype(np.float32)
+            image += cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC) * (40 / (1 + cell / 32))
+        image = np.clip(image + rng.uniform(60, 180, 3), 0, 255).astype(np.uint8)
+
+        for _ in range(rng.integers(20, 60)):
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            point = (int(rng.integers(width)), int(rng.integers(height)))
+            kind = rng.integers(3)
+            if kind == 0:
+                end = (int(rng.integers(width)), int(rng.integers(height)))
+                cv2.line(image, point, end, color, int(rng.integers(1, 6)))
+            elif kind == 1:
+                # Never round enough to count as a coin
+                axis = int(rng.integers(5, 50))
+                cv2.ellipse(image, point, (axis, int(axis * rng.uniform(1.6, 3))), float(rng.uniform(0, 180)),
+                            0, 360, color, -1)
+            else:
+                corners = rng.integers(0, [width, height], (int(rng.integers(3, 7)), 2)).astype(np.int32)
+                cv2.fillPoly(image, [corners], color)
+
+        center = radius = None
+        if with_coin:
+            radius = int(0.035 * height)
+            center = (int(rng.integers(radius + 5, width - radius - 5)),
+                      int(rng.integers(radius + 5, height - radius - 5)))
+            cv2.circle(image, center, radius, (51, 115, 184), -1)
+            cv2.circle(image, center, radius, (0, 0, 0), 2)
+        yield cv2.GaussianBlur(image, (3, 3), 0), center, radius
+
+
+def benchmark_reference(args) -> Dict[str, Any]:
+    """
+    Reference coin detection rate, localization error, precision and ms/image
+    on demo images and on textured 1280x960 frames, each with and without a coin.
+    """
+    processor = ScrapMetalDataProcessor(args.config, use_cache=False)
+    detector: ReferenceCoinDetector = processor.reference_detector
+
+    temp_dir = Path(tempfile.mkdtemp(prefix="kl_bench_"))
+    results = []
+
+    def demo(with_coin: bool):
+        root = temp_dir / ("coin" if with_coin else "no_coin")
+        for path in _write_demo_images(root, args.count, with_coin):
+            image = cv2.imread(str(path))
+            yield image, ((50, image.shape[0] - 50), 25) if with_coin else (None, None)
+
+    def textured(with_coin: bool):
+        for image, center, radius in _textured_images(args.count, with_coin):
+            yield image, (center, radius)
+
+    try:
+        for images, with_coin in ((demo, True), (demo, False), (textured, True), (textured, False)):
+            timings, center_errors, radius_errors, detected, located = [], [], [], 0, 0
+            for image, (center, coin_radius) in images(with_coin):
+                start = time.perf_counter()
+                detection = detector.detect(image)
+                timings.append((time.perf_counter() - start) * 1000)
+
+                if detection is None:
+                    continue
+                detected += 1
+                if center is not None:
+                    center_error = float(np.hypot(detection.center_x - center[0], detection.center_y - center[1]))
+                    center_errors.append(center_error)
+                    radius_errors.append(abs(detection.radius - coin_radius))
+                    # A detection more than a radius away from the drawn coin is a false positive
+                    located += center_error <= coin_radius
+
+            results.append({
+                'images': f"{images.__name__} {'with' if with_coin else 'without'} coin",
+                'count': len(timings),
+                'detected': detected,
+                'located': located,
+                'false_pos': detected - located,
+                'center_err_px': round(float(np.mean(center_errors)), 2) if center_errors else None,
+                'radius_err_px': round(float(np.mean(radius_errors)), 2) if radius_errors else None,
+                'ms_mean': round(float(np.mean(timings)), 3),
+                'ms_p95': round(float(np.percentile(timings, 95)), 3),
+            })
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    detections = sum(r['detected'] for r in results)
+    precision = sum(r['located'] for r in results) / detections if detections else None
+    logger.info(f"Reference detection precision {precision:.3f}" if precision is not None
+                else "Reference detection found no coins")
+
+    # The budget is for demo-sized images; textured frames have 4x the pixels and mostly pay for the downscale
+    p95 = max(r['ms_p95'] for r in results if r['images'].startswith('demo'))
+    within_budget = p95 <= args.budget_ms
+    logger.info(f"Reference detection p95 {p95:.2f} ms/image on demo images "
+                f"({'within' if within_budget else 'OVER'} {args.budget_ms} ms budget)")
+
+    return {
+        'benchmark': 'reference',
+        'detect_width': detector.detect_width,
+        'budget_ms': args.budget_ms,
+        'within_budget': within_budget,
+        'precision': round(precision, 4) if precision is not None else None,
+        'results': results,
+    }
+
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+# Entry point -> (module directory, cumulative import budget in ms, modules it must not load at import)
+IMPORT_BUDGETS = {
+    'data_processor': (SCRIPTS_DIR, 600, ['albumentations', 'matplotlib', 'seaborn', 'pandas', 'sklearn']),
+    'train_model': (SCRIPTS_DIR, 400, ['torch', 'torchvision', 'ultralytics', 'wandb', 'mlflow']),
+    'deploy_model': (SCRIPTS_DIR, 300, ['tensorflow', 'torch', 'onnx', 'onnx2tf', 'tflite_support']),
+    'benchmark_pipeline': (SCRIPTS_DIR, 700, ['albumentations', 'matplotlib', 'seaborn']),
+    'generate_demo_data': (SCRIPTS_DIR.parent, 400, []),
+}
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def _measure_import(module: str, directory: Path) -> Dict[str, Any]:
+    """Cumulative import time of one module in a fresh interpreter, from -X importtime."""
+    code = f"import sys; sys.path.insert(0, {str(directory)!r}); import {module}"
+
+    # Entry points configure file logging at import; keep their logs out of the tree
+    with tempfile.TemporaryDirectory(prefix="kl_bench_") as cwd:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                                cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    cumulative_us, loaded = None, set()
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        loaded.add(match.group(4).split('.')[0])
+        if match.group(4) == module and not match.group(3):
+            cumulative_us = int(match.group(2))
+
+    return {'ms': cumulative_us / 1000, 'loaded': loaded}
+
+
+def benchmark_imports(args) -> Dict[str, Any]:
+    """Import time of each entry point against its budget, best of --repeat fresh interpreters."""
+    results = []
+
+    for name in args.entry_points:
+        directory, budget_ms, forbidden = IMPORT_BUDGETS[name]
+        runs = [_measure_import(name, directory) for _ in range(args.repeat)]
+        best_ms = min(run['ms'] for run in runs)
+        heavy = sorted(set(forbidden) & set.union(*(run['loaded'] for run in runs)))
+
+        results.append({
+            'entry_point': name,
+            'best_ms': round(best_ms, 1),
+            'median_ms': round(float(np.median([run['ms'] for run in runs])), 1),
+            'budget_ms': budget_ms * args.budget_scale,
+            'heavy_loaded': ','.join(heavy) or '-',
+            'ok': best_ms <= budget_ms * args.budget_scale and not heavy,
+        })
+
+    within_budget = all(r['ok'] for r in results)
+    for r in results:
+        if not r['ok']:
+            logger.warning(f"Import regression in {r['entry_point']}: {r['best_ms']} ms "
+                           f"(budget {r['budget_ms']} ms), heavy modules loaded: {r['heavy_loaded']}")
+
+    return {
+        'benchmark': 'imports',
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+        'within_budget': within_budget,
+        'results': results,
+    }
+
+
+def benchmark_scan(args) -> Dict[str, Any]:
+    """Wall time of the per-extension rglob walks vs cold, warm and partially changed indexed scans."""
+    temp_dir = Path(tempfile.mkdtemp(prefix="kl_bench_"))
+    if args.images:
+        root = Path(args.images)
+    else:
+        root = temp_dir / "tree"
+        for d in range(args.directories):
+            directory = root / f"material_{d % 5}" / f"batch_{d:05d}"
+            directory.mkdir(parents=True)
+            for f in range(args.files_per_directory):
+                (directory / f"img_{f:04d}{'.jpg' if f % 4 else '.png'}").touch()
+
+    def timed(label: str, scan) -> Dict[str, Any]:
+        start = time.perf_counter()
+        files, listed = scan()
+        return {'method': label, 'seconds': round(time.perf_counter() - start, 4),
+                'files': files, 'dirs_listed': listed}
+
+    def rglob():
+        return len(list(root.rglob("*.jpg")) + list(root.rglob("*.png"))), '-'
+
+    def indexed(full: bool = False):
+        files = index.scan(root, IMAGE_EXTENSIONS, full=full)
+        return len(files), index.last_scan['directories_listed']
+
+    results = []
+    try:
+        results.append(timed("rglob x2", rglob))
+        with FileIndex(str(temp_dir / "file_index.sqlite"), workers=args.scan_workers) as index:
+            results.append(timed("index cold", lambda: indexed(full=True)))
+            # Let directory mtimes age past the racy window so the warm scan can trust them
+            time.sleep(2.1)
+            results.append(timed("index relist", lambda: indexed(full=True)))
+            results.append(timed("index warm", indexed))
+
+            changed = next((d for d in sorted(root.rglob("*")) if d.is_dir() and not any(
+                c.is_dir() for c in d.iterdir())), None) if not args.images else None
+            if changed is not None:
+                (changed / "new_image.jpg").touch()
+                results.append(timed("index 1 changed", indexed))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        'benchmark': 'scan',
+        'root': str(root),
+        'scan_workers': args.scan_workers or 'auto',
+        'results': results,
+    }
+
+
+def benchmark_duplicates(args) -> Dict[str, Any]:
+    """Near-duplicate search time vs dataset size: incremental index add+query and the batch audit."""
+    results = []
+    for size in args.sizes:
+        rng = np.random.default_rng(0)
+        values = rng.integers(0, 1 << 63, size, dtype=np.uint64) << np.uint64(1)
+        values |= rng.integers(0, 2, size, dtype=np.uint64)
+        # Every 50th image gets a copy a few bits away in another split
+        planted = {f"dup_{i}": f"img_{i}" for i in range(0, size, 50)}
+        items = [(f"img_{i}", int(v), f"img_{i}.jpg", "train") for i, v in enumerate(values)]
+        items += [(key, int(values[int(key[4:])]) ^ 0b100101, f"{key}.jpg", "val") for key in planted]
+
+        start = time.perf_counter()
+        index = DuplicateIndex()
+        found = 0
+        for key, value, _, _ in items:
+            matches = index.query(value, args.max_distance)
+            found += key in planted and any(match == planted[key] for match, _ in matches)
+            index.add(key, value)
+        index_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        audit = audit_near_duplicates(items, args.max_distance)
+        audit_seconds = time.perf_counter() - start
+        audited = {(pair['image'], pair['duplicate_of']) for pair in audit['pairs']}
+
+        results.append({
+            'images': len(items),
+            'index_s': round(index_seconds, 3),
+            'index_us_per_image': round(index_seconds / len(items) * 1e6, 1),
+            'audit_s': round(audit_seconds, 3),
+            'planted': len(planted),
+            'index_found': found,
+            'audit_found': sum(1 for key, original in planted.items()
+                               if (f"{key}.jpg", f"{original}.jpg") in audited),
+        })
+
+    return {
+        'benchmark': 'duplicates',
+        'max_distance': args.max_distance,
+        'results': results,
+    }
+
+
+def benchmark_epoch(args) -> Dict[str, Any]:
+    """
+    Data-loading epoch time of weight prediction training: decoding every
+    image each epoch vs reading the tensor cache, including the per-batch
+    move to the device and normalization. The thumbnail cache is off so the
+    uncached rows pay for full decodes, as a first run on new data would.
+    """
+    from annotation_store import AnnotationStore
+    from tensor_cache import TensorCache
+    from train_model import ModelTrainer
+
+    temp_dir = Path(tempfile.mkdtemp(prefix="kl_bench_"))
+    trainer = ModelTrainer(args.config)
+    trainer.thumbnail_cache = None
+    trainer.tensor_cache = None
+
+    if args.dataset:
+        dataset_root = Path(args.dataset)
+    else:
+        dataset_root = temp_dir / "dataset"
+        logger.info(f"Writing {args.synthetic} synthetic {args.width}x{args.height} images to {dataset_root}")
+        paths = _write_synthetic_images(dataset_root, args.synthetic, args.width, args.height, materials=[args.split])
+        trainer.annotation_store = str(temp_dir / "annotations.sqlite")
+        rng = np.random.default_rng(0)
+        with AnnotationStore(trainer.annotation_store) as store:
+            store.put_many(((p, {'material_type': 'steel', 'weight_pounds': float(rng.uniform(1, 50)),
+                                 'filename': p.name}) for p in paths), source='benchmark')
+
+    def run_epochs(mode: str, dataset) -> List[Dict[str, Any]]:
+        loader = trainer._weight_loader(dataset, shuffle=True)
+        rows = []
+        for epoch in range(1, args.epochs + 1):
+            start = time.perf_counter()
+            samples = 0
+            for images, targets in loader:
+                images, targets = trainer._batch_to_device(images, targets)
+                samples += len(targets)
+            if trainer.device.type == 'cuda':
+                import torch
+                torch.cuda.synchronize()
+            seconds = time.perf_counter() - start
+            rows.append({'mode': mode, 'epoch': epoch, 'samples': samples, 'seconds': round(seconds, 3),
+                         'samples_per_sec': round(samples / seconds, 1) if seconds > 0 else 0.0})
+            logger.info(f"{mode} epoch {epoch}: {seconds:.2f}s, {samples / seconds:.0f} samples/sec")
+        return rows
+
+    try:
+        results = run_epochs("uncached", trainer._create_weight_dataset(str(dataset_root), args.split))
+
+        trainer.tensor_cache = TensorCache(str(temp_dir / "tensors"), workers=args.cache_workers)
+        start = time.perf_counter()
+        cached = trainer._create_weight_dataset(str(dataset_root), args.split)
+        build_seconds = time.perf_counter() - start
+        results.append({'mode': 'cache build', 'epoch': '-', 'samples': len(cached),
+                        'seconds': round(build_seconds, 3),
+                        'samples_per_sec': round(len(cached) / build_seconds, 1) if build_seconds > 0 else 0.0})
+
+        results += run_epochs("cached", cached)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    uncached = float(np.median([r['seconds'] for r in results if r['mode'] == 'uncached']))
+    cached_epoch = float(np.median([r['seconds'] for r in results if r['mode'] == 'cached']))
+
+    return {
+        'benchmark': 'epoch',
+        'dataset': str(dataset_root),
+        'split': args.split,
+        'device': str(trainer.device),
+        'cache_mb': round(np.prod(cached.shape) / (1 << 20), 1),
+        'median_speedup': round(uncached / cached_epoch, 2) if cached_epoch > 0 else 0.0,
+        # Epochs after which the one-off build has paid for itself
+        'break_even_epochs': round(build_seconds / (uncached - cached_epoch), 2) if uncached > cached_epoch else None,
+        'results': results,
+    }
+
+
+def _memory_mb() -> Dict[str, float]:
+    """RSS, PSS and USS (private pages) of this process in MB, from /proc/self/smaps_rollup."""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {'rss': fields['Rss'], 'pss': fields['Pss'],
+            'uss': fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0)}
+
+
+# Read by forked workers; set in the parent just before they start
+_touch_target = None
+
+
+def _touch_child(storage: str, worker: int, workers: int, queue):
+    """
+    One forked loader worker: read every workers-th sample's metadata as
+    __getitem__ would, then collect garbage as a long-running worker
+    eventually does, and report how much memory became private to it.
+    """
+    before = _memory_mb()
+    if storage == 'dicts':
+        for annotation in _touch_target[worker::workers]:
+            annotation['image_path'], annotation['weight_pounds'], annotation['content_hash']
+    else:
+        records = _touch_target.records
+        for i in range(worker, len(_touch_target), workers):
+            _touch_target.image_path(i), float(records['weight'][i]), records['content_hash'][i]
+    gc.collect()
+    after = _memory_mb()
+    queue.put({'rss_mb': after['rss'], 'uss_mb': after['uss'], 'growth_mb': after['uss'] - before['uss']})
+
+
+def benchmark_dataset_memory(args) -> Dict[str, Any]:
+    """
+    Per-worker private memory of forked DataLoader-style workers reading the
+    annotation index as a list of dicts (before) vs ScrapMetalDataset's
+    structured arrays. Copy-on-write copies show up as USS growth.
+    """
+    global _touch_target
+    from annotation_store import AnnotationStore
+    from train_model import ScrapMetalDataset
+
+    if not Path("/proc/self/smaps_rollup").exists():
+        raise SystemExit("dataset-memory needs Linux /proc/<pid>/smaps_rollup")
+
+    temp_dir = Path(tempfile.mkdtemp(prefix="kl_bench_"))
+    split_dir = temp_dir / "dataset" / "train"
+    split_dir.mkdir(parents=True)
+    store_path = str(temp_dir / "annotations.sqlite")
+    materials = ["steel", "aluminum", "copper", "brass", "mixed_scrap"]
+
+    logger.info(f"Writing {args.samples} synthetic annotations")
+    rng = np.random.default_rng(0)
+    weights = rng.uniform(1, 50, size=args.samples)
+    with AnnotationStore(store_path) as store:
+        store.put_many(((split_dir / f"{materials[i % 5]}_{i:08d}.jpg",
+                         {'material_type': materials[i % 5], 'weight_pounds': float(weights[i]),
+                          'bounding_box': [50, 50, 200, 200], 'content_hash': f"{i:032x}",
+                          'filename': f"{materials[i % 5]}_{i:08d}.jpg"})
+                        for i in range(args.samples)), source='benchmark')
+
+    context = multiprocessing.get_context('fork')
+    results = []
+    try:
+        for storage in ('dicts', 'arrays'):
+            gc.collect()
+            baseline = _memory_mb()['uss']
+            if storage == 'dicts':
+                _touch_target = load_annotations(split_dir, store_path)
+            else:
+                _touch_target = ScrapMetalDataset(split_dir, task="weight_prediction", annotation_store=store_path)
+            gc.collect()
+            index_mb = _memory_mb()['uss'] - baseline
+
+            queue = context.Queue()
+            children = [context.Process(target=_touch_child, args=(storage, w, args.workers, queue))
+                        for w in range(args.workers)]
+            for child in children:
+                child.start()
+            workers = [queue.get() for _ in children]
+            for child in children:
+                child.join()
+
+            growth = [w['growth_mb'] for w in workers]
+            results.append({
+                'storage': storage,
+                'index_mb': round(index_mb, 1),
+                'worker_rss_mb': round(max(w['rss_mb'] for w in workers), 1),
+                'worker_growth_mb': round(float(np.mean(growth)), 1),
+                'worker_growth_max': round(max(growth), 1),
+                'all_workers_mb': round(sum(growth), 1),
+            })
+            logger.info(f"{storage}: index {index_mb:.1f} MB, each worker copied {np.mean(growth):.1f} MB")
+            _touch_target = None
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        'benchmark': 'dataset-memory',
+        'samples': args.samples,
+        'workers': args.workers,
+        'results': results,
+    }
+
+
+def benchmark_dataset_decode(args) -> Dict[str, Any]:
+    """
+    Samples/sec of one loader worker decoding and resizing weight-prediction
+    samples at full resolution vs with the JPEG decoder's reduced-scale
+    draft mode, and how far the resized pixels differ. Single-process, so
+    the rate is per DataLoader worker; the thumbnail cache is off.
+    """
+    import yaml
+    from PIL import Image
+
+    from annotation_store import AnnotationStore
+    from tensor_cache import resize_and_crop
+    from train_model import ScrapMetalDataset
+
+    with open(args.config) as f:
+        input_size = yaml.safe_load(f)['models']['weight_prediction']['cnn_regressor']['input_size']
+    min_side = max(input_size) if isinstance(input_size, (list, tuple)) else input_size
+
+    temp_dir = Path(tempfile.mkdtemp(prefix="kl_bench_"))
+    store_path = None
+    if args.dataset:
+        split_dir = Path(args.dataset) / args.split
+    else:
+        split_dir = temp_dir / "dataset" / args.split
+        logger.info(f"Writing {args.synthetic} synthetic {args.width}x{args.height} images to {split_dir}")
+        paths = _write_synthetic_images(split_dir.parent, args.synthetic, args.width, args.height,
+                                        materials=[args.split])
+        store_path = str(temp_dir / "annotations.sqlite")
+        with AnnotationStore(store_path) as store:
+            store.put_many(((p, {'material_type': 'steel', 'weight_pounds': 1.0, 'filename': p.name})
+                            for p in paths), source='benchmark')
+
+    results, outputs = [], {}
+    try:
+        for label, reduced in (("full decode", False), ("reduced decode", True)):
+            kwargs = {'annotation_store': store_path} if store_path else {}
+            dataset = ScrapMetalDataset(split_dir, task="weight_prediction", min_side=min_side,
+                                        reduced_decode=reduced, **kwargs)
+            count = min(len(dataset), args.limit) if args.limit else len(dataset)
+            if not count:
+                raise SystemExit(f"No annotated images in {split_dir}")
+
+            decoded_pixels = 0
+            pixels = []
+            start = time.perf_counter()
+            for i in range(count):
+                image: Image.Image = dataset.image_at(i)
+                decoded_pixels += image.size[0] * image.size[1]
+                pixels.append(resize_and_crop(image, input_size))
+            seconds = time.perf_counter() - start
+            outputs[label] = pixels
+
+            results.append({
+                'mode': label,
+                'samples': count,
+                'decoded_mpixels': round(decoded_pixels / count / 1e6, 2),
+                'seconds': round(seconds, 3),
+                'samples_per_sec': round(count / seconds, 1) if seconds > 0 else 0.0,
+                'speedup': round(results[0]['seconds'] / seconds, 2) if results and seconds > 0 else 1.0,
+            })
+            logger.info(f"{label}: {count / seconds:.1f} samples/sec per worker")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # Difference after Resize + CenterCrop, in 0-255 pixel levels
+    difference = [np.abs(a.astype(np.int16) - b.astype(np.int16))
+                  for a, b in zip(outputs["full decode"], outputs["reduced decode"])]
+    return {
+        'benchmark': 'dataset-decode',
+        'dataset': str(split_dir),
+        'input_size': input_size,
+        'pixel_diff_mean': round(float(np.mean([d.mean() for d in difference])), 3),
+        'pixel_diff_p99': round(float(np.percentile(np.concatenate([d.ravel() for d in difference]), 99)), 1),
+        'results': results,
+    }
+
+
+def _print_results(report: Dict[str, Any]):
+    """Print benchmark rows as a table."""
+    rows = report['results']
+    columns = list(rows[0].keys()) if rows else []
+
+    print("\n" + "=" * 60)
+    print(f"BENCHMARK: {report['benchmark']}")
+    print("=" * 60)
+    print("  ".join(f"{c:>14}" for c in columns))
+    for row in rows:
+        print("  ".join(f"{str(row[c]):>14}" for c in columns))
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KL Recycling Pipeline Benchmarks")
+    parser.add_argument("--config", default="config/training_config.yaml",
+                        help="Path to training configuration file")
+    parser.add_argument("--report", help="Write results as JSON to this path")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    throughput = subparsers.add_parser("throughput", help="Quality-assessment images/sec vs worker count")
+    source = throughput.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="Directory tree of images to score")
+    source.add_argument("--synthetic", type=int, help="Generate this many synthetic images")
+    throughput.add_argument("--max-workers", type=int, default=0, help="Largest worker count (0 = all cores)")
+    throughput.add_argument("--chunk-size", type=int, default=16, help="Images per pool task")
+    throughput.add_argument("--limit", type=int, default=0, help="Only score the first N images")
+    throughput.set_defaults(func=benchmark_throughput)
+
+    drift = subparsers.add_parser("decode-drift", help="Reduced-resolution decode accuracy vs full resolution")
+    drift.add_argument("--images", required=True, help="Directory tree of JPEG images to sample")
+    drift.add_argument("--sample", type=int, default=500, help="Number of images to sample (0 = all)")
+    drift.add_argument("--scales", type=int, nargs="+", default=[2, 4, 8], choices=[2, 4, 8],
+                       help="Decode reduction factors to compare")
+    drift.set_defaults(func=benchmark_decode_drift)
+
+    kernel = subparsers.add_parser("kernel", help="Fused quality kernel vs original metrics (RSS, ms/image)")
+    kernel.add_argument("--images", help="Directory of JPEG images (default: synthetic)")
+    kernel.add_argument("--size", type=int, default=4096, help="Synthetic image width and height")
+    kernel.add_argument("--count", type=int, default=4, help="Number of images")
+    kernel.add_argument("--iterations", type=int, default=5, help="Passes over the images")
+    kernel.add_argument("--strip-rows", type=int, default=256, help="Rows per strip for the tiled kernel")
+    kernel.set_defaults(func=benchmark_kernel)
+
+    reference = subparsers.add_parser("reference", help="Reference coin detection accuracy, precision and ms/image")
+    reference.add_argument("--count", type=int, default=100,
+                           help="Images per set (demo and textured, with/without coin)")
+    reference.add_argument("--budget-ms", type=float, default=5.0, help="p95 ms/image budget")
+    reference.set_defaults(func=benchmark_reference)
+
+    imports = subparsers.add_parser("imports", help="Entry point import time (-X importtime) vs budget")
+    imports.add_argument("--entry-points", nargs="+", default=list(IMPORT_BUDGETS), choices=list(IMPORT_BUDGETS),
+                         help="Entry points to import")
+    imports.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per entry point")
+    imports.add_argument("--budget-scale", type=float, default=1.0,
+                         help="Multiply every budget, e.g. 2 on slow CI machines")
+    imports.set_defaults(func=benchmark_imports)
+
+    scan = subparsers.add_parser("scan", help="Indexed parallel scanner vs rglob (cold, warm, one dir changed)")
+    scan.add_argument("--images", help="Directory tree to scan (default: synthetic tree of empty files)")
+    scan.add_argument("--directories", type=int, default=500, help="Synthetic leaf directories")
+    scan.add_argument("--files-per-directory", type=int, default=40, help="Synthetic files per directory")
+    scan.add_argument("--scan-workers", type=int, default=0, help="Listing threads (0 = auto)")
+    scan.set_defaults(func=benchmark_scan)
+
+    duplicates = subparsers.add_parser("duplicates", help="Near-duplicate index and audit time vs dataset size")
+    duplicates.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000, 100000],
+                            help="Synthetic hash counts to time")
+    duplicates.add_argument("--max-distance", type=int, default=6, help="Hamming distance threshold")
+    duplicates.set_defaults(func=benchmark_duplicates)
+
+    epoch = subparsers.add_parser("epoch", help="Weight training epoch time, decoded per epoch vs tensor cache")
+    data = epoch.add_mutually_exclusive_group(required=True)
+    data.add_argument("--dataset", help="Dataset root with a split directory (e.g. data/scrap_dataset/)")
+    data.add_argument("--synthetic", type=int, help="Generate this many synthetic annotated images")
+    epoch.add_argument("--split", default="train", help="Split directory to load")
+    epoch.add_argument("--epochs", type=int, default=3, help="Epochs per mode")
+    epoch.add_argument("--width", type=int, default=2016, help="Synthetic image width")
+    epoch.add_argument("--height", type=int, default=1512, help="Synthetic image height")
+    epoch.add_argument("--cache-workers", type=int, default=0, help="Cache build processes (0 = all cores)")
+    epoch.set_defaults(func=benchmark_epoch)
+
+    memory = subparsers.add_parser("dataset-memory",
+                                   help="Copy-on-write growth of forked loader workers: dict list vs arrays")
+    memory.add_argument("--samples", type=int, default=500000, help="Synthetic annotations in the index")
+    memory.add_argument("--workers", type=int, default=8, help="Forked workers reading the index")
+    memory.set_defaults(func=benchmark_dataset_memory)
+
+    decode = subparsers.add_parser("dataset-decode",
+                                   help="Training samples/sec per worker, full vs reduced-scale JPEG decode")
+    images = decode.add_mutually_exclusive_group(required=True)
+    images.add_argument("--dataset", help="Dataset root with a split directory (e.g. data/scrap_dataset/)")
+    images.add_argument("--synthetic", type=int, help="Generate this many synthetic phone-sized images")
+    decode.add_argument("--split", default="train", help="Split directory to load")
+    decode.add_argument("--width", type=int, default=4032, help="Synthetic image width")
+    decode.add_argument("--height", type=int, default=3024, help="Synthetic image height")
+    decode.add_argument("--limit", type=int, default=0, help="Only decode the first N samples")
+    decode.set_defaults(func=benchmark_dataset_decode)
+
+    args = parser.parse_args()
+    report = args.func(args)
+
+    _print_results(report)
+
+    if args.report:
+        Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Benchmark report saved to {args.report}")
+
+    if report.get('within_budget') is False:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+KL Recycling Capture Pipeline
+=============================
+
+Concurrent image collection: a capture thread reads frames from a FrameSource
+into a bounded queue, quality-gate workers score them with the processor's
+quality metrics, and a writer thread saves accepted frames, stopping the
+source as soon as the target count is reached. The bounded queue makes a fast
+camera wait for the gate instead of buffering without limit.
+
+Frame sources:
+
+- CameraSource: an OpenCV VideoCapture device
+- DirectoryReplaySource: replays images from <root>/<material>/ (or <root>/)
+  at an optional frame rate, a local stand-in for a camera
+- SyntheticSource: generated scrap-and-coin frames, some deliberately blurred
+  or dark so the gate has something to reject
+
+The gate workers are threads: OpenCV releases the GIL while decoding and
+filtering, and frames never need to be pickled. Each worker owns its own
+QualityKernel because kernel scratch buffers are not shared safely.
+"""
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from online_stats import P2Quantile, RunningStats
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+FRAME_SOURCES = ('camera', 'replay', 'synthetic')
+
+# Placed on a queue once per consumer when its producer is finished
+_END = object()
+
+
+@dataclass
+class Frame:
+    """One captured frame (BGR) and when it was captured."""
+    index: int
+    image: np.ndarray
+    captured_at: float = field(default_factory=time.perf_counter)
+
+
+class FrameSource:
+    """Produces frames for one material at a time."""
+
+    name = "source"
+
+    def frames(self, material: str) -> Iterator[np.ndarray]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    """Frames from an OpenCV capture device."""
+
+    name = "camera"
+
+    def __init__(self, device: int = 0, width: Optional[int] = None, height: Optional[int] = None):
+        self.capture = cv2.VideoCapture(device)
+        if not self.capture.isOpened():
+            raise RuntimeError(f"Could not open camera {device}")
+        if width and height:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+    def frames(self, material: str) -> Iterator[np.ndarray]:
+        while True:
+            ok, image = self.capture.read()
+            if not ok:
+                logger.warning("Camera returned no frame; stopping capture")
+                return
+            yield image
+
+    def close(self):
+        self.capture.release()
+
+
+class DirectoryReplaySource(FrameSource):
+    """Replays image files as if they came from a camera."""
+
+    name = "replay"
+
+    def __init__(self, root: str, fps: float = 0.0, loop: bool = False):
+        self.root = Path(root)
+        self.fps = fps
+        self.loop = loop
+
+    def _paths(self, material: str) -> List[Path]:
+        directory = self.root / material if (self.root / material).is_dir() else self.root
+        return sorted(p for p in directory.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+
+    def frames(self, material: str) -> Iterator[np.ndarray]:
+        paths = self._paths(material)
+        if not paths:
+            logger.warning(f"No images to replay for {material} under {self.root}")
+            return
+
+        interval = 1.0 / self.fps if self.fps > 0 else 0.0
+        next_frame = time.perf_counter()
+        while True:
+            for path in paths:
+                if interval:
+                    time.sleep(max(0.0, next_frame - time.perf_counter()))
+                    next_frame += interval
+                image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+                if image is not None:
+                    yield image
+            if not self.loop:
+                return
+
+
+class SyntheticSource(FrameSource):
+    """Generated frames: a metal-colored object and a reference coin on a textured background."""
+
+    name = "synthetic"
+
+    COLORS = {'steel': (128, 128, 128), 'aluminum': (192, 192, 192), 'copper': (51, 115, 184),
+              'brass': (66, 166, 181), 'mixed_scrap': (90, 110, 130)}
+
+    def __init__(self, width: int = 1280, height: int = 960, seed: int = 0, reject_fraction: float = 0.3,
+                 limit: int = 0):
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(seed)
+        self.reject_fraction = reject_fraction
+        self.limit = limit
+
+    def frames(self, material: str) -> Iterator[np.ndarray]:
+        produced = 0
+        while not self.limit or produced < self.limit:
+            produced += 1
+            yield self._frame(material)
+
+    def _frame(self, material: str) -> np.ndarray:
+        rng, width, height = self.rng, self.width, self.height
+
+        base = rng.integers(150, 256, size=(height // 32, width // 32, 3), dtype=np.uint8)
+        image = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+
+        x, y = int(rng.integers(width // 4, width // 2)), int(rng.integers(height // 4, height // 2))
+        w, h = int(rng.integers(width // 6, width // 3)), int(rng.integers(height // 6, height // 3))
+        color = self.COLORS.get(material, (128, 128, 128))
+        cv2.rectangle(image, (x, y), (x + w, y + h), color, -1)
+        cv2.rectangle(image, (x, y), (x + w, y + h), (0, 0, 0), 3)
+
+        radius = max(6, int(0.03 * min(width, height)))
+        center = (radius * 3, height - radius * 3)
+        cv2.circle(image, center, radius, (51, 115, 184), -1)
+        cv2.circle(image, center, radius, (0, 0, 0), 2)
+
+        if rng.random() < self.reject_fraction:
+            # A frame the operator would retake: motion blur or underexposure
+            if rng.random() < 0.5:
+                image = cv2.GaussianBlur(image, (0, 0), 12)
+            else:
+                image = (image * 0.15).astype(np.uint8)
+        return image
+
+
+class CaptureStats:
+    """Frame counts, rates and gate latency of one material's capture run."""
+
+    def __init__(self):
+        self.captured = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.gate_ms = RunningStats()
+        self.latency_ms = RunningStats()
+        self.gate_quantiles = [P2Quantile(0.5), P2Quantile(0.95)]
+        self.latency_quantiles = [P2Quantile(0.5), P2Quantile(0.95)]
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def gated(self, gate_ms: float, latency_ms: float, accepted: bool):
+        with self._lock:
+            self.gate_ms.add(gate_ms)
+            self.latency_ms.add(latency_ms)
+            for q in self.gate_quantiles:
+                q.add(gate_ms)
+            for q in self.latency_quantiles:
+                q.add(latency_ms)
+            if accepted:
+                self.accepted += 1
+            else:
+                self.rejected += 1
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = self.elapsed or (time.perf_counter() - self.started)
+        return {
+            'frames_captured': self.captured,
+            'frames_accepted': self.accepted,
+            'frames_rejected': self.rejected,
+            'frames_written': self.written,
+            'elapsed_seconds': round(elapsed, 3),
+            'capture_fps': round(self.captured / elapsed, 2) if elapsed else 0.0,
+            'written_fps': round(self.written / elapsed, 2) if elapsed else 0.0,
+            'gate_ms_mean': round(self.gate_ms.mean, 2),
+            'gate_ms_p50': round(self.gate_quantiles[0].value, 2),
+            'gate_ms_p95': round(self.gate_quantiles[1].value, 2),
+            # Capture to gate decision, including time spent queued
+            'latency_ms_p50': round(self.latency_quantiles[0].value, 2),
+            'latency_ms_p95': round(self.latency_quantiles[1].value, 2),
+        }
+
+
+class CapturePipeline:
+    """
+    capture thread -> bounded queue -> gate workers -> writer thread.
+
+    `gate(image, worker_index)` returns (accepted, score); `write(image, n)`
+    saves the n-th accepted frame and returns its path.
+    """
+
+    def __init__(self, source: FrameSource, gate: Callable[[np.ndarray, int], Tuple[bool, float]],
+                 write: Callable[[np.ndarray, int], Path], gate_workers: int = 2, queue_size: int = 8):
+        self.source = source
+        self.gate = gate
+        self.write = write
+        self.gate_workers = max(1, gate_workers)
+        self.queue_size = max(1, queue_size)
+
+    def run(self, material: str, target: int, max_frames: int = 0) -> CaptureStats:
+        """Capture until `target` frames are written, the source ends, or max_frames were captured."""
+        stats = CaptureStats()
+        stop = threading.Event()
+        frames: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        accepted: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        errors: List[BaseException] = []
+
+        def put(q: "queue.Queue", item) -> bool:
+            # Blocks while the consumer is behind, but gives up once stopped
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def put_end(q: "queue.Queue", count: int, consumers: List[threading.Thread]):
+            # Sentinels go through even after stop, but only while a consumer
+            # is left to take them; a full queue nobody drains must not hang us
+            for _ in range(count):
+                while True:
+                    try:
+                        q.put(_END, timeout=0.1)
+                        break
+                    except queue.Full:
+                        if not any(thread.is_alive() for thread in consumers):
+                            return
+
+        def capture():
+            try:
+                for index, image in enumerate(self.source.frames(material)):
+                    if stop.is_set() or (max_frames and index >= max_frames):
+                        break
+                    stats.captured += 1
+                    if not put(frames, Frame(index, image)):
+                        break
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                put_end(frames, self.gate_workers, gates)
+
+        def gate_worker(worker_index: int):
+            try:
+                while True:
+                    frame = frames.get()
+                    if frame is _END:
+                        break
+                    if stop.is_set():
+                        continue        # Target met; drain without scoring
+
+                    start = time.perf_counter()
+                    ok, score = self.gate(frame.image, worker_index)
+                    done = time.perf_counter()
+                    stats.gated((done - start) * 1000, (done - frame.captured_at) * 1000, ok)
+
+                    if ok:
+                        put(accepted, frame)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                put_end(accepted, 1, [writer_thread])
+
+        def writer():
+            finished = 0
+            try:
+                while finished < self.gate_workers:
+                    frame = accepted.get()
+                    if frame is _END:
+                        finished += 1
+                        continue
+                    if stats.written >= target:
+                        continue
+                    path = self.write(frame.image, stats.written)
+                    stats.written += 1
+                    logger.info(f"Collected {stats.written}/{target} for {material}: {path.name}")
+                    if stats.written >= target:
+                        stop.set()
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                # Keep draining so gate workers blocked on a full queue can finish
+                while finished < self.gate_workers:
+                    if accepted.get() is _END:
+                        finished += 1
+
+        gates = [threading.Thread(target=gate_worker, args=(i,), name=f"gate-{i}", daemon=True)
+                 for i in range(self.gate_workers)]
+        writer_thread = threading.Thread(target=writer, name="writer", daemon=True)
+        threads = [threading.Thread(target=capture, name="capture", daemon=True), writer_thread] + gates
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats.elapsed = time.perf_counter() - stats.started
+        if errors:
+            raise errors[0]
+        return stats
+
+
+def open_frame_source(kind: str, replay_dir: Optional[str] = None, camera_index: int = 0,
+                      fps: float = 0.0, seed: int = 0) -> FrameSource:
+    """FrameSource for the --source command line option."""
+    if kind == 'camera':
+        return CameraSource(camera_index)
+    if kind == 'replay':
+        if not replay_dir:
+            raise ValueError("--source replay needs --replay-dir")
+        return DirectoryReplaySource(replay_dir, fps=fps)
+    if kind == 'synthetic':
+        return SyntheticSource(seed=seed)
+    raise ValueError(f"Unknown frame source: {kind}")
@@ -1,583 +1,1682 @@
-#!/usr/bin/env python3
-"""
-KL Recycling ML Data Processor
-===============================
-
-Comprehensive data collection, processing, and validation pipeline for scrap metal
-weight prediction training. Handles image collection, quality assessment, labeling
-support, and dataset preparation.
-
-Usage:
-    python data_processor.py --collect --materials steel aluminum copper brass
-    python data_processor.py --process --input data/raw_images/ --output data/scrap_dataset/
-    python data_processor.py --validate --dataset data/scrap_dataset/
-"""
-
-import argparse
-import json
-import os
-import shutil
-import sys
-from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any
-import logging
-from dataclasses import dataclass
-from datetime import datetime
-
-import cv2
-import numpy as np
-import pandas as pd
-from PIL import Image
-import yaml
-from tqdm import tqdm
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.model_selection import train_test_split
-import albumentations as A
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('data_processing.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-logger = logging.getLogger(__name__)
-
-
-@dataclass
-class ImageQualityMetrics:
-    """Quality assessment metrics for training images."""
-    brightness: float
-    contrast: float
-    blurriness: float
-    saturation: float
-    resolution_width: int
-    resolution_height: int
-    aspect_ratio: float
-    has_reference_object: bool
-    overall_score: float
-
-
-@dataclass
-class ScrapMetalAnnotation:
-    """Annotation data structure for scrap metal objects."""
-    material_type: str
-    bounding_box: Tuple[int, int, int, int]  # x, y, w, h
-    weight_pounds: float
-    confidence: float
-    reference_object: Optional[Dict[str, Any]] = None
-
-
-class ScrapMetalDataProcessor:
-    """
-    Main data processing engine for KL Recycling scrap metal dataset.
-    """
-
-    def __init__(self, config_path: str = "config/training_config.yaml"):
-        self.config = self._load_config(config_path)
-        self.quality_thresholds = self.config['quality_control']
-        self.materials = self.config['dataset']['materials']
-
-        # Initialize data directories
-        self._setup_directories()
-
-        # Data augmentation pipeline
-        self.augmentor = self._setup_augmentation()
-
-        logger.info("ScrapMetalDataProcessor initialized")
-
-    def _load_config(self, config_path: str) -> Dict[str, Any]:
-        """Load training configuration."""
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-        logger.info(f"Configuration loaded from {config_path}")
-        return config
-
-    def _setup_directories(self):
-        """Create necessary directory structure."""
-        directories = [
-            "data/raw_images",
-            "data/processed_images",
-            "data/augmented_images",
-            "data/annotations",
-            "data/metrics",
-            "data/scrap_dataset/train",
-            "data/scrap_dataset/val",
-            "data/scrap_dataset/test",
-            "models/checkpoints",
-            "logs"
-        ]
-
-        for dir_path in directories:
-            Path(dir_path).mkdir(parents=True, exist_ok=True)
-
-        logger.info("Directory structure created")
-
-    def _setup_augmentation(self) -> A.Compose:
-        """Setup data augmentation pipeline."""
-        aug_config = self.config['dataset']['augmentation']
-
-        transforms = [
-            A.HorizontalFlip(p=0.5) if aug_config['flip_horizontal'] else None,
-            A.VerticalFlip(p=0.5) if aug_config['flip_vertical'] else None,
-            A.Rotate(limit=tuple(aug_config['rotation_range']), p=0.7),
-            A.RandomBrightnessContrast(
-                brightness_limit=tuple(aug_config['brightness_range']),
-                contrast_limit=tuple(aug_config['contrast_range']),
-                p=0.8
-            ),
-            A.HueSaturationValue(
-                hue_shift_limit=tuple(aug_config['hue_range']),
-                sat_shift_limit=tuple(aug_config['saturation_range']),
-                val_shift_limit=[-10, 10],
-                p=0.7
-            ),
-            A.Blur(blur_limit=3, p=aug_config['blur_prob']),
-            A.GaussNoise(var_limit=(10, 50), p=aug_config['noise_prob']),
-        ]
-
-        # Filter out None values
-        transforms = [t for t in transforms if t is not None]
-
-        return A.Compose(transforms, bbox_params=A.BboxParams(format='pascal_voc'))
-
-    def collect_images(self, materials: List[str], count_per_material: int = 100):
-        """
-        Collect images for specified materials using camera input.
-        This creates a interface for photographing scrap metal samples.
-        """
-        logger.info(f"Starting image collection for materials: {materials}")
-
-        collection_stats = {}
-
-        for material in materials:
-            if material not in self.materials:
-                logger.warning(f"Material {material} not in configured materials")
-                continue
-
-            logger.info(f"Collecting {count_per_material} images for {material}")
-
-            material_dir = Path(f"data/raw_images/{material}")
-            material_dir.mkdir(parents=True, exist_ok=True)
-
-            collected = 0
-            skipped = 0
-
-            # In a real implementation, this would interface with camera SDK
-            # For now, we'll create placeholder logic
-            for i in range(count_per_material * 2):  # Collect extra for filtering
-                image_path = self._capture_image(material, i)
-
-                if image_path and self._validate_image_quality(image_path):
-                    collected += 1
-                    logger.info(f"Collected {collected}/{count_per_material} for {material}")
-                else:
-                    skipped += 1
-
-                if collected >= count_per_material:
-                    break
-
-            collection_stats[material] = {
-                'collected': collected,
-                'skipped': skipped,
-                'target': count_per_material
-            }
-
-        self._save_collection_report(collection_stats)
-        logger.info("Image collection completed")
-
-    def _capture_image(self, material: str, index: int) -> Optional[str]:
-        """Simulate image capture - would interface with actual camera hardware."""
-        # Placeholder implementation
-        # In real usage, this would:
-        # 1. Open camera stream
-        # 2. Show live preview with guidelines
-        # 3. Capture image on user input
-        # 4. Save to appropriate directory
-        return f"data/raw_images/{material}/sample_{index}.jpg"
-
-    def process_dataset(self, input_dir: str, output_dir: str, generate_labels: bool = True):
-        """
-        Process raw images into training-ready dataset.
-        """
-        logger.info("Processing dataset...")
-
-        input_path = Path(input_dir)
-        output_path = Path(output_dir)
-
-        image_files = list(input_path.rglob("*.jpg")) + list(input_path.rglob("*.png"))
-
-        processed_data = []
-        quality_stats = []
-
-        for image_file in tqdm(image_files, desc="Processing images"):
-            try:
-                # Assess image quality
-                quality_metrics = self._assess_image_quality(str(image_file))
-
-                if quality_metrics.overall_score >= 0.7:  # Quality threshold
-                    # Copy to processed directory
-                    processed_path = self._copy_to_processed(image_file, output_path)
-
-                    # Generate or validate annotations
-                    if generate_labels:
-                        annotation = self._generate_annotation(str(image_file), quality_metrics)
-                        self._save_annotation(processed_path, annotation)
-
-                    processed_data.append({
-                        'original_path': str(image_file),
-                        'processed_path': str(processed_path),
-                        'quality_score': quality_metrics.overall_score,
-                        'material_type': self._detect_material_type(str(image_file))
-                    })
-
-                quality_stats.append(quality_metrics)
-
-            except Exception as e:
-                logger.error(f"Error processing {image_file}: {e}")
-                continue
-
-        # Generate dataset splits
-        self._create_dataset_splits(processed_data)
-
-        # Save processing report
-        self._save_processing_report(processed_data, quality_stats)
-
-        logger.info(f"Dataset processing completed. Processed {len(processed_data)} images")
-
-    def _assess_image_quality(self, image_path: str) -> ImageQualityMetrics:
-        """Assess comprehensive image quality metrics."""
-        try:
-            # Load image
-            image = cv2.imread(image_path)
-            if image is None:
-                raise ValueError("Could not load image")
-
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-            # Brightness assessment
-            brightness = np.mean(gray) / 255.0
-
-            # Contrast assessment
-            contrast = gray.std() / 255.0
-
-            # Blurriness using Laplacian variance
-            blurriness = cv2.Laplacian(gray, cv2.CV_64F).var()
-
-            # Saturation assessment
-            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-            saturation = np.mean(hsv[:, :, 1]) / 255.0
-
-            # Basic reference object detection (placeholder)
-            has_reference = self._detect_reference_object(image)
-
-            # Calculate overall quality score
-            quality_score = self._calculate_quality_score(
-                brightness, contrast, blurriness, saturation, has_reference
-            )
-
-            return ImageQualityMetrics(
-                brightness=brightness,
-                contrast=contrast,
-                blurriness=blurriness,
-                saturation=saturation,
-                resolution_width=image.shape[1],
-                resolution_height=image.shape[0],
-                aspect_ratio=image.shape[1] / image.shape[0],
-                has_reference_object=has_reference,
-                overall_score=quality_score
-            )
-
-        except Exception as e:
-            logger.error(f"Quality assessment failed for {image_path}: {e}")
-            return ImageQualityMetrics(
-                brightness=0.0, contrast=0.0, blurriness=0.0,
-                saturation=0.0, resolution_width=0, resolution_height=0,
-                aspect_ratio=0.0, has_reference_object=False, overall_score=0.0
-            )
-
-    def _calculate_quality_score(self, brightness: float, contrast: float,
-                               blurriness: float, saturation: float,
-                               has_reference: bool) -> float:
-        """Calculate overall quality score from individual metrics."""
-        thresholds = self.quality_thresholds['image_quality_checks']
-
-        # Normalize individual scores
-        brightness_score = min(brightness / thresholds['brightness_threshold'][1], 1.0)
-        contrast_score = min(contrast / thresholds['contrast_threshold'], 1.0)
-        blur_score = min(blurriness / thresholds['blur_threshold'], 1.0)
-        saturation_score = min(saturation / thresholds['saturation_threshold'], 1.0)
-        reference_score = 1.0 if has_reference else 0.5
-
-        # Weighted average
-        weights = [0.2, 0.2, 0.3, 0.2, 0.1]
-        scores = [brightness_score, contrast_score, blur_score,
-                 saturation_score, reference_score]
-
-        return np.average(scores, weights=weights)
-
-    def _detect_reference_object(self, image: np.ndarray) -> bool:
-        """Basic reference object detection (placeholder implementation)."""
-        # This would implement actual reference object detection
-        # For now, return True if image dimensions suggest potential reference object
-        return image.shape[1] > self.config['dataset']['min_resolution']
-
-    def _generate_annotation(self, image_path: str, quality_metrics: ImageQualityMetrics) -> ScrapMetalAnnotation:
-        """Generate annotation for image (semi-automated)."""
-        material_type = self._detect_material_type(image_path)
-
-        # Placeholder bounding box - would be manually labeled or ML-assisted
-        bounding_box = (50, 50, 200, 200)  # x, y, w, h
-
-        # Placeholder weight estimation
-        weight = self._estimate_weight_from_material(material_type)
-
-        return ScrapMetalAnnotation(
-            material_type=material_type,
-            bounding_box=bounding_box,
-            weight_pounds=weight,
-            confidence=quality_metrics.overall_score
-        )
-
-    def _detect_material_type(self, image_path: str) -> str:
-        """Detect material type from filename or directory structure."""
-        path_parts = Path(image_path).parts
-
-        for part in reversed(path_parts):
-            if part in self.materials:
-                return part
-
-        return "unknown"
-
-    def _estimate_weight_from_material(self, material_type: str) -> float:
-        """Basic weight estimation based on material properties."""
-        material_props = self.config['materials'].get(material_type, {})
-        base_density = material_props.get('density_kg_m3', 7800)  # Default steel density
-
-        # Convert to typical scrap weight range
-        weight_kg = base_density * 0.0001  # Rough volumetric estimate
-        return weight_kg * 2.20462  # Convert to pounds
-
-    def _copy_to_processed(self, source_path: Path, output_dir: Path) -> Path:
-        """Copy image to processed directory with new filename."""
-        material = self._detect_material_type(str(source_path))
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-        output_name = f"{material}_{timestamp}_{source_path.name}"
-        output_path = output_dir / output_name
-
-        shutil.copy2(source_path, output_path)
-        return output_path
-
-    def _save_annotation(self, image_path: Path, annotation: ScrapMetalAnnotation):
-        """Save annotation to file."""
-        annotation_file = image_path.with_suffix('.json')
-
-        annotation_data = {
-            'image_path': str(image_path),
-            'material_type': annotation.material_type,
-            'bounding_box': annotation.bounding_box,
-            'weight_pounds': annotation.weight_pounds,
-            'confidence': annotation.confidence,
-            'timestamp': datetime.now().isoformat()
-        }
-
-        with open(annotation_file, 'w') as f:
-            json.dump(annotation_data, f, indent=2)
-
-    def _create_dataset_splits(self, processed_data: List[Dict[str, Any]]):
-        """Create train/val/test splits."""
-        df = pd.DataFrame(processed_data)
-
-        # Stratified split by material type
-        train_df, temp_df = train_test_split(
-            df, train_size=self.config['dataset']['train_split'],
-            stratify=df['material_type'], random_state=42
-        )
-
-        val_df, test_df = train_test_split(
-            temp_df,
-            train_size=self.config['dataset']['val_split'] /
-            (self.config['dataset']['val_split'] + self.config['dataset']['test_split']),
-            stratify=temp_df['material_type'], random_state=42
-        )
-
-        # Move files to respective directories
-        self._move_files_to_splits(train_df, 'train')
-        self._move_files_to_splits(val_df, 'val')
-        self._move_files_to_splits(test_df, 'test')
-
-        logger.info("Dataset splits created")
-
-    def _move_files_to_splits(self, df: pd.DataFrame, split_name: str):
-        """Move files to split directories."""
-        split_dir = Path(f"data/scrap_dataset/{split_name}")
-        split_dir.mkdir(exist_ok=True)
-
-        for _, row in df.iterrows():
-            src_path = Path(row['processed_path'])
-            annotation_path = src_path.with_suffix('.json')
-
-            # Move image
-            dst_image = split_dir / src_path.name
-            shutil.copy2(src_path, dst_image)
-
-            # Move annotation if exists
-            if annotation_path.exists():
-                dst_annotation = split_dir / annotation_path.name
-                shutil.copy2(annotation_path, dst_annotation)
-
-    def validate_dataset(self, dataset_path: str):
-        """Validate dataset quality and completeness."""
-        logger.info(f"Validating dataset at {dataset_path}")
-
-        dataset_path = Path(dataset_path)
-        validation_results = {
-            'total_images': 0,
-            'valid_images': 0,
-            'invalid_images': 0,
-            'quality_scores': [],
-            'material_distribution': {},
-            'issues': []
-        }
-
-        image_files = list(dataset_path.rglob("*.jpg")) + list(dataset_path.rglob("*.png"))
-
-        for image_file in tqdm(image_files, desc="Validating images"):
-            validation_results['total_images'] += 1
-
-            try:
-                # Re-assess quality
-                quality_metrics = self._assess_image_quality(str(image_file))
-
-                # Check annotation exists
-                annotation_file = image_file.with_suffix('.json')
-                has_annotation = annotation_file.exists()
-
-                if quality_metrics.overall_score >= 0.7 and has_annotation:
-                    validation_results['valid_images'] += 1
-                    validation_results['quality_scores'].append(quality_metrics.overall_score)
-
-                    # Update material distribution
-                    material = self._detect_material_type(str(image_file))
-                    validation_results['material_distribution'][material] = \
-                        validation_results['material_distribution'].get(material, 0) + 1
-                else:
-                    validation_results['invalid_images'] += 1
-                    if quality_metrics.overall_score < 0.7:
-                        validation_results['issues'].append({
-                            'file': str(image_file),
-                            'issue': 'poor_quality',
-                            'score': quality_metrics.overall_score
-                        })
-                    elif not has_annotation:
-                        validation_results['issues'].append({
-                            'file': str(image_file),
-                            'issue': 'missing_annotation'
-                        })
-
-            except Exception as e:
-                validation_results['invalid_images'] += 1
-                validation_results['issues'].append({
-                    'file': str(image_file),
-                    'issue': str(e)
-                })
-
-        # Generate validation report
-        self._save_validation_report(validation_results)
-
-        logger.info(f"Validation completed: {validation_results['valid_images']}/{validation_results['total_images']} valid images")
-
-        return validation_results
-
-    def _save_collection_report(self, stats: Dict[str, Dict[str, int]]):
-        """Save image collection statistics."""
-        report_path = Path("data/metrics/collection_report.json")
-
-        report = {
-            'collection_date': datetime.now().isoformat(),
-            'statistics': stats,
-            'total_collected': sum(s['collected'] for s in stats.values()),
-            'total_target': sum(s['target'] for s in stats.values()),
-            'success_rate': sum(s['collected'] for s in stats.values()) /
-                          max(1, sum(s['target'] for s in stats.values()))
-        }
-
-        with open(report_path, 'w') as f:
-            json.dump(report, f, indent=2, default=str)
-
-        logger.info(f"Collection report saved to {report_path}")
-
-    def _save_processing_report(self, processed_data: List[Dict[str, Any]], quality_stats: List[ImageQualityMetrics]):
-        """Save data processing report."""
-        report_path = Path("data/metrics/processing_report.json")
-
-        report = {
-            'processing_date': datetime.now().isoformat(),
-            'total_processed': len(processed_data),
-            'quality_stats': {
-                'mean_score': np.mean([q.overall_score for q in quality_stats]),
-                'min_score': min([q.overall_score for q in quality_stats] or [0]),
-                'max_score': max([q.overall_score for q in quality_stats] or [0]),
-                'std_score': np.std([q.overall_score for q in quality_stats] or [0])
-            }
-        }
-
-        with open(report_path, 'w') as f:
-            json.dump(report, f, indent=2, default=str)
-
-        logger.info(f"Processing report saved to {report_path}")
-
-    def _save_validation_report(self, results: Dict[str, Any]):
-        """Save dataset validation report."""
-        report_path = Path("data/metrics/validation_report.json")
-
-        with open(report_path, 'w') as f:
-            json.dump(results, f, indent=2, default=str)
-
-        logger.info(f"Validation report saved to {report_path}")
-
-
-def main():
-    parser = argparse.ArgumentParser(description="KL Recycling ML Data Processor")
-    parser.add_argument("--collect", action="store_true", help="Collect new training images")
-    parser.add_argument("--process", action="store_true", help="Process raw images into training dataset")
-    parser.add_argument("--validate", action="store_true", help="Validate existing dataset")
-    parser.add_argument("--materials", nargs="+", help="Materials to collect/process")
-    parser.add_argument("--input", help="Input directory for processing")
-    parser.add_argument("--output", help="Output directory for processed data")
-    parser.add_argument("--dataset", help="Dataset directory for validation")
-    parser.add_argument("--count", type=int, default=100, help="Number of images per material")
-
-    args = parser.parse_args()
-
-    # Initialize processor
-    processor = ScrapMetalDataProcessor()
-
-    if args.collect:
-        materials = args.materials or ["steel", "aluminum", "copper", "brass"]
-        processor.collect_images(materials, args.count)
-
-    elif args.process:
-        if not args.input or not args.output:
-            logger.error("Must specify --input and --output directories for processing")
-            sys.exit(1)
-        processor.process_dataset(args.input, args.output)
-
-    elif args.validate:
-        if not args.dataset:
-            logger.error("Must specify --dataset directory for validation")
-            sys.exit(1)
-        processor.validate_dataset(args.dataset)
-
-    else:
-        logger.error("Must specify one of --collect, --process, or --validate")
-        parser.print_help()
-        sys.exit(1)
-
-
-if __name__ == "__main__":
-    main()
+#!/usr/bin/env python3
+"""
+KL Recycling ML Data Processor
+===============================
+
+Comprehensive data collection, processing, and validation pipeline for scrap metal
+weight prediction training. Handles image collection, quality assessment, labeling
+support, and dataset preparation.
+
+Usage:
+    python data_processor.py --collect --materials steel aluminum copper brass
+    python data_processor.py --collect --materials steel --source replay --replay-dir data/raw_images/ --gate-workers 4
+    python data_processor.py --process --input data/raw_images/ --output data/scrap_dataset/
+    python data_processor.py --process --input data/raw_images/ --output data/scrap_dataset/ --workers 16
+    python data_processor.py --process --input data/raw_images/ --output data/scrap_dataset/ --decode-scale 4
+    python data_processor.py --process --input data/raw_images/ --output data/scrap_dataset/ --stream
+    python data_processor.py --process --input data/raw_images/ --output data/scrap_dataset/ --full
+    python data_processor.py --process --input data/raw_images/ --output data/scrap_dataset/ --materialize hardlink
+    python data_processor.py --process --input data/raw_images/ --output data/scrap_dataset/ --dedupe
+    python data_processor.py --process --input data/raw_images/ --output data/scrap_dataset/ --metrics-report data/metrics/run_report.json --prometheus-textfile /var/lib/node_exporter/textfile/kl_pipeline.prom
+    python data_processor.py --validate --dataset data/scrap_dataset/ --no-cache
+    python data_processor.py --validate --dataset data/scrap_dataset/ --dedupe
+    python data_processor.py --validate --dataset data/scrap_dataset/ --resume
+    python data_processor.py --augment 4 --workers 8
+    python data_processor.py --rescore
+    python data_processor.py --import-annotations data/raw_images/
+    python data_processor.py --export-annotations data/scrap_dataset/
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Any
+import logging
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime
+
+import cv2
+import numpy as np
+from PIL import Image
+import yaml
+from tqdm import tqdm
+
+from annotation_store import AnnotationStore, annotation_store_from_config
+from capture_pipeline import FRAME_SOURCES, CapturePipeline, FrameSource, open_frame_source
+from dataset_splits import SPLIT_NAMES, HashSplitAssigner, SplitTally
+from duplicate_index import NearDuplicateFilter, PerceptualHashStore, audit_near_duplicates
+from file_index import DEFAULT_FILE_INDEX, FileIndex, IndexedFile
+from materialize import MATERIALIZE_MODES, materialize
+from online_stats import RunningStats
+from pipeline_metrics import NULL_METRICS, PipelineMetrics, save_run_metrics
+from processing_manifest import ProcessingManifest
+from quality_cache import QualityMetricsCache, config_fingerprint, content_hash
+from quality_kernel import QualityKernel
+from quality_table import QualityTable, QualityTableWriter
+from reference_detector import DEFAULT_COIN_DIAMETER_INCHES, ReferenceCoinDetector
+from thumbnail_cache import ThumbnailCache, thumbnail_cache_from_config
+from validation_log import IssueLog, ValidationSummary, write_json_atomic
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('data_processing.log'),
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# Bump whenever _assess_image_quality changes so cached metrics are recomputed
+QUALITY_METRICS_VERSION = 2
+
+# Minimum overall quality score for an image to be accepted
+QUALITY_ACCEPT_THRESHOLD = 0.7
+
+# Image extensions picked up when scanning input trees
+IMAGE_EXTENSIONS = ('.jpg', '.png')
+
+# Rows buffered before the quality table is flushed to Parquet
+QUALITY_TABLE_FLUSH_ROWS = 4096
+
+# Images validated between resumable checkpoints
+VALIDATION_CHECKPOINT_EVERY = 1000
+
+# Weights of the brightness, contrast, blur, saturation and reference sub-scores
+QUALITY_SCORE_WEIGHTS = np.array([0.2, 0.2, 0.3, 0.2, 0.1])
+
+# JPEG DCT-domain downscaling: libjpeg decodes directly at 1/2, 1/4 or 1/8 size
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+@dataclass
+class ImageQualityMetrics:
+    """Quality assessment metrics for training images."""
+    brightness: float
+    contrast: float
+    blurriness: float
+    saturation: float
+    resolution_width: int
+    resolution_height: int
+    aspect_ratio: float
+    has_reference_object: bool
+    reference_x: float          # Reference coin center/radius in full-resolution pixels (0 if none)
+    reference_y: float
+    reference_radius: float
+    pixels_per_inch: float      # Scale implied by the coin diameter (0 if none)
+    overall_score: float
+
+
+# Column dtypes for the columnar quality table, derived from the dataclass
+QUALITY_COLUMN_DTYPES = {
+    f.name: {float: np.float64, int: np.int64, bool: np.bool_}[f.type]
+    for f in fields(ImageQualityMetrics)
+}
+
+
+@dataclass
+class ScrapMetalAnnotation:
+    """Annotation data structure for scrap metal objects."""
+    material_type: str
+    bounding_box: Tuple[int, int, int, int]  # x, y, w, h
+    weight_pounds: float
+    confidence: float
+    reference_object: Optional[Dict[str, Any]] = None
+
+
+# Processor instance owned by each quality-assessment pool worker
+_worker_processor: Optional["ScrapMetalDataProcessor"] = None
+
+
+def _init_quality_worker(processor: "ScrapMetalDataProcessor"):
+    """Install the processor used by this pool worker."""
+    global _worker_processor
+    _worker_processor = processor
+
+    # Report only this worker's measurements; forked workers inherit the parent's
+    processor.metrics = processor.metrics.fresh()
+
+    # One OpenCV thread per worker; the pool already provides the parallelism
+    cv2.setNumThreads(1)
+
+
+def _assess_image_file_worker(image_path: str) -> Tuple[Tuple[str, "ImageQualityMetrics"], Optional[Dict[str, Any]]]:
+    """Hash and measure a single image inside a pool worker, returning the worker's metrics with it."""
+    return _worker_processor._assess_image_file(image_path), _worker_processor.metrics.drain()
+
+
+def _augment_image_worker(task: Tuple[str, Dict[str, Any], List[Tuple[int, np.random.SeedSequence, str]]]
+                          ) -> List[Tuple[str, Dict[str, Any]]]:
+    """Write the requested augmented variants of one image inside a pool worker."""
+    return _worker_processor._augment_image(*task)
+
+
+class ScrapMetalDataProcessor:
+    """
+    Main data processing engine for KL Recycling scrap metal dataset.
+    """
+
+    def __init__(self, config_path: str = "config/training_config.yaml", use_cache: bool = True,
+                 decode_scale: Optional[int] = None):
+        self.config = self._load_config(config_path)
+        self.quality_thresholds = self.config['quality_control']
+        self.materials = self.config['dataset']['materials']
+
+        # Reduced-resolution decode for quality scoring (1 = full resolution)
+        self.decode_scale, self.blur_threshold_factor = self._setup_decode_scale(decode_scale)
+
+        # Reusable, strip-tiled scratch buffers for quality statistics
+        self.quality_kernel = QualityKernel(strip_rows=self.quality_thresholds.get('strip_rows', 256))
+        self.reference_detector = self._setup_reference_detector()
+
+        # Initialize data directories
+        self._setup_directories()
+
+        # Fingerprint of every setting that influences quality scores
+        self.quality_fingerprint = config_fingerprint({
+            'version': QUALITY_METRICS_VERSION,
+            'quality_control': self.quality_thresholds,
+            'min_resolution': self.config['dataset']['min_resolution'],
+            'decode_scale': self.decode_scale,
+        })
+
+        # Quality metrics cache shared by processing and validation
+        self.quality_cache = self._setup_quality_cache() if use_cache else None
+
+        # Decoded thumbnails shared with dedupe and training (dataset.thumbnail_cache)
+        self.thumbnail_cache: Optional[ThumbnailCache] = thumbnail_cache_from_config(self.config['dataset'])
+
+        # Deterministic split assignment keyed by content hash and material
+        self.split_assigner = HashSplitAssigner(self.config['dataset'])
+
+        # Persistent directory listings shared by every scan (see file_index.py)
+        self.file_index_path = DEFAULT_FILE_INDEX
+
+        # Processing manifest, open only while process_dataset runs
+        self.manifest: Optional[ProcessingManifest] = None
+
+        # Annotation store (dataset.annotation_store), open only while process_dataset runs
+        self.annotation_store_path, self.write_sidecars = annotation_store_from_config(self.config['dataset'])
+        self.annotation_store: Optional[AnnotationStore] = None
+
+        # Near-duplicate filter, open only while process_dataset runs with dedupe
+        self.duplicate_filter: Optional[NearDuplicateFilter] = None
+        self.duplicate_max_distance = int(
+            self.quality_thresholds.get('label_quality_checks', {}).get('duplicate_max_distance', 6))
+
+        # How processed and split images are placed on disk (see _resolve_materialize_mode)
+        self.materialize_mode = self._resolve_materialize_mode(self.config['dataset'].get('materialize', 'copy'))
+        self._split_lists: Dict[str, List[str]] = {}
+
+        # Stage timings and counters; replaced with a PipelineMetrics to enable
+        self.metrics = NULL_METRICS
+
+        # Data augmentation pipeline, built on first use (albumentations is slow to import)
+        self._augmentor = None
+
+        logger.info("ScrapMetalDataProcessor initialized")
+
+    def _load_config(self, config_path: str) -> Dict[str, Any]:
+        """Load training configuration."""
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f)
+        logger.info(f"Configuration loaded from {config_path}")
+        return config
+
+    def _setup_directories(self):
+        """Create necessary directory structure."""
+        directories = [
+            "data/raw_images",
+            "data/processed_images",
+            "data/augmented_images",
+            "data/annotations",
+            "data/metrics",
+            "data/scrap_dataset/train",
+            "data/scrap_dataset/val",
+            "data/scrap_dataset/test",
+            "models/checkpoints",
+            "logs"
+        ]
+
+        for dir_path in directories:
+            Path(dir_path).mkdir(parents=True, exist_ok=True)
+
+        logger.info("Directory structure created")
+
+    def _setup_quality_cache(self) -> QualityMetricsCache:
+        """Open the on-disk quality metrics cache for the current quality settings."""
+        return QualityMetricsCache("data/metrics/quality_cache.sqlite", self.quality_fingerprint)
+
+    def _resolve_materialize_mode(self, mode: str) -> str:
+        """
+        Validate a materialization mode: copy, hardlink, reflink, symlink or
+        manifest. In manifest mode processed images are not placed in split
+        directories at all; data/scrap_dataset/<split>.txt lists their paths.
+        """
+        if mode != 'manifest' and mode not in MATERIALIZE_MODES:
+            raise ValueError(f"Unknown materialization mode: {mode}")
+        return mode
+
+    def _setup_reference_detector(self) -> ReferenceCoinDetector:
+        """Reference coin detector configured from quality_control.reference_object."""
+        reference_config = self.quality_thresholds.get('reference_object', {})
+        return ReferenceCoinDetector(
+            diameter_inches=reference_config.get('diameter_inches', DEFAULT_COIN_DIAMETER_INCHES),
+            detect_width=reference_config.get('detect_width', 320),
+            min_radius_fraction=reference_config.get('min_radius_fraction', 0.015),
+            max_radius_fraction=reference_config.get('max_radius_fraction', 0.06),
+            accumulator_threshold=reference_config.get('accumulator_threshold', 20),
+            rim_contrast=reference_config.get('rim_contrast', 12.0),
+            rim_support=reference_config.get('rim_support', 0.7),
+        )
+
+    def _setup_decode_scale(self, decode_scale: Optional[int]) -> Tuple[int, float]:
+        """Resolve the decode reduction factor and the matching blur threshold factor."""
+        fast_decode = self.quality_thresholds.get('fast_decode', {})
+        scale = int(decode_scale or fast_decode.get('scale', 1))
+
+        if scale not in REDUCED_DECODE_FLAGS:
+            raise ValueError(f"Unsupported decode scale: {scale} (choose from 1, 2, 4, 8)")
+
+        # Laplacian variance is resolution dependent, so the blur threshold moves with the scale
+        factors = fast_decode.get('blur_threshold_scale', {})
+        blur_factor = float(factors.get(scale, 1.0)) if scale > 1 else 1.0
+
+        if scale > 1:
+            logger.info(f"Reduced-resolution quality scoring: 1/{scale} decode, "
+                        f"blur threshold x{blur_factor}")
+
+        return scale, blur_factor
+
+    def __getstate__(self):
+        # Pool workers only assess images; the SQLite cache and manifest stay with the parent
+        state = self.__dict__.copy()
+        state['quality_cache'] = None
+        state['manifest'] = None
+        state['annotation_store'] = None
+        state['duplicate_filter'] = None
+        return state
+
+    @property
+    def augmentor(self) -> "albumentations.Compose":
+        if self._augmentor is None:
+            self._augmentor = self._setup_augmentation()
+        return self._augmentor
+
+    def _setup_augmentation(self) -> "albumentations.Compose":
+        """Setup data augmentation pipeline."""
+        import albumentations as A
+
+        aug_config = self.config['dataset']['augmentation']
+
+        transforms = [
+            A.HorizontalFlip(p=0.5) if aug_config['flip_horizontal'] else None,
+            A.VerticalFlip(p=0.5) if aug_config['flip_vertical'] else None,
+            A.Rotate(limit=tuple(aug_config['rotation_range']), p=0.7),
+            A.RandomBrightnessContrast(
+                brightness_limit=tuple(aug_config['brightness_range']),
+                contrast_limit=tuple(aug_config['contrast_range']),
+                p=0.8
+            ),
+            A.HueSaturationValue(
+                hue_shift_limit=tuple(aug_config['hue_range']),
+                sat_shift_limit=tuple(aug_config['saturation_range']),
+                val_shift_limit=[-10, 10],
+                p=0.7
+            ),
+            A.Blur(blur_limit=3, p=aug_config['blur_prob']),
+            A.GaussNoise(var_limit=(10, 50), p=aug_config['noise_prob']),
+        ]
+
+        # Filter out None values
+        transforms = [t for t in transforms if t is not None]
+
+        return A.Compose(transforms, bbox_params=A.BboxParams(format='pascal_voc'))
+
+    def augment_dataset(self, variants: int, split_name: str = 'train', workers: int = 1,
+                        chunksize: int = 4, seed: int = 42) -> Dict[str, int]:
+        """
+        Write `variants` augmented copies of every image in a split to
+        data/augmented_images, transforming its bounding box along with it.
+
+        Each image's random stream is a SeedSequence spawned from the run seed
+        and the image's name, with one child per variant, so results do not
+        depend on worker count or scheduling. Variants that already exist are
+        skipped, and with workers > 1 (0 = all cores) images are augmented in a
+        process pool.
+
+        Source annotations are read from the annotation store, and variant
+        annotations are written to it in one batch at the end; sidecars are
+        only written when dataset.annotation_store.sidecars is on.
+        """
+        output_dir = Path("data/augmented_images")
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        root_seed = np.random.SeedSequence(seed)
+
+        annotation_store = AnnotationStore(self.annotation_store_path)
+        try:
+            # Sidecars the store has not seen yet (hand edits, variants from before the store) count too
+            annotation_store.import_sidecars(Path(f"data/scrap_dataset/{split_name}"))
+            annotation_store.import_sidecars(output_dir)
+
+            tasks, skipped = self._augment_tasks(annotation_store, split_name, variants, root_seed, output_dir)
+
+            logger.info(f"Augmenting {len(tasks)} {split_name} images x{variants} "
+                        f"({skipped} variants already exist)")
+
+            if workers == 0:
+                workers = os.cpu_count() or 1
+
+            if workers > 1 and len(tasks) > 1:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_quality_worker,
+                                         initargs=(self,)) as executor:
+                    results = list(tqdm(executor.map(_augment_image_worker, tasks, chunksize=chunksize),
+                                        total=len(tasks), desc="Augmenting images"))
+            else:
+                results = [self._augment_image(*task) for task in tqdm(tasks, desc="Augmenting images")]
+
+            # Stored after the sidecars, so the rows are newer and the sidecars are not imported again
+            written = annotation_store.put_many(
+                ((Path(path), annotation) for result in results for path, annotation in result),
+                source='augmentation'
+            )
+        finally:
+            annotation_store.close()
+
+        stats = {'images': len(tasks), 'written': written, 'skipped_existing': skipped}
+        logger.info(f"Augmentation completed: {stats['written']} variants written to {output_dir}")
+        return stats
+
+    def _augment_tasks(self, annotation_store: AnnotationStore, split_name: str, variants: int,
+                       root_seed: np.random.SeedSequence, output_dir: Path
+                       ) -> Tuple[List[Tuple[str, Dict[str, Any], List[Tuple[int, np.random.SeedSequence, str]]]], int]:
+        """(image, annotation, pending variants) per annotated split image, and the number of variants skipped."""
+        tasks = []
+        skipped = 0
+
+        for image_path in self._split_images(split_name):
+            annotation = annotation_store.get(image_path)
+            if annotation is None:
+                continue
+
+            # Keyed by name rather than position so adding images leaves other seeds alone
+            name_key = int.from_bytes(hashlib.blake2b(image_path.stem.encode(), digest_size=8).digest(), 'big')
+            image_seeds = np.random.SeedSequence(root_seed.entropy, spawn_key=(name_key,)).spawn(variants)
+
+            pending = []
+            for index, variant_seed in enumerate(image_seeds):
+                output_path = output_dir / f"{image_path.stem}_aug{index}{image_path.suffix}"
+                if output_path.exists() and annotation_store.get(output_path) is not None:
+                    skipped += 1
+                else:
+                    pending.append((index, variant_seed, str(output_path)))
+
+            if pending:
+                tasks.append((str(image_path), annotation, pending))
+
+        return tasks, skipped
+
+    def _split_images(self, split_name: str) -> Iterator[Path]:
+        """Images of a split, from its directory or (manifest materialization) its list file."""
+        split_dir = Path(f"data/scrap_dataset/{split_name}")
+        yield from self._scan_images(split_dir)
+
+        list_path = Path(f"data/scrap_dataset/{split_name}.txt")
+        if list_path.exists():
+            with open(list_path) as f:
+                for line in f:
+                    if line.strip():
+                        yield Path(line.strip())
+
+    def _augment_image(self, image_path: str, annotation: Dict[str, Any],
+                       variants: List[Tuple[int, np.random.SeedSequence, str]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Apply the augmentation pipeline once per variant; returns (variant path, annotation) of those written."""
+        image = cv2.imread(image_path)
+        if image is None:
+            logger.error(f"Could not read {image_path}")
+            return []
+
+        height, width = image.shape[:2]
+        x, y, w, h = annotation['bounding_box']
+        box = [max(0, x), max(0, y), min(width, x + w), min(height, y + h), annotation['material_type']]
+
+        written = []
+        for index, variant_seed, output_path in variants:
+            # albumentations draws from the global random and numpy.random streams
+            state = variant_seed.generate_state(1)[0]
+            random.seed(int(state))
+            np.random.seed(state)
+
+            augmented = self.augmentor(image=image, bboxes=[box])
+            if not augmented['bboxes']:
+                logger.warning(f"Bounding box lost in variant {index} of {image_path}")
+                continue
+
+            x_min, y_min, x_max, y_max = augmented['bboxes'][0][:4]
+            output_path = Path(output_path)
+            cv2.imwrite(str(output_path), augmented['image'])
+
+            variant_annotation = {
+                **annotation,
+                'image_path': str(output_path),
+                'bounding_box': [round(x_min), round(y_min), round(x_max - x_min), round(y_max - y_min)],
+                'augmented_from': image_path,
+                'augmentation_seed': int(state),
+                'timestamp': datetime.now().isoformat()
+            }
+            if self.write_sidecars:
+                with open(output_path.with_suffix('.json'), 'w') as f:
+                    json.dump(variant_annotation, f, indent=2)
+
+            written.append((str(output_path), variant_annotation))
+
+        return written
+
+    def collect_images(self, materials: List[str], count_per_material: int = 100,
+                       source: Optional[FrameSource] = None, gate_workers: int = 2,
+                       queue_size: int = 8) -> Dict[str, Dict[str, Any]]:
+        """
+        Collect images for specified materials from a frame source (camera by default).
+
+        Frames flow through a CapturePipeline: a capture thread fills a bounded
+        queue, `gate_workers` threads score each frame with the usual quality
+        metrics, and a writer saves accepted frames to data/raw_images/<material>/.
+        Capture stops as soon as count_per_material frames are saved, or after
+        twice that many frames have been captured.
+        """
+        logger.info(f"Starting image collection for materials: {materials}")
+
+        source = source or open_frame_source('camera')
+        # QualityKernel scratch buffers are not thread safe, so each gate worker gets its own
+        kernels = [QualityKernel(strip_rows=self.quality_kernel.strip_rows) for _ in range(max(1, gate_workers))]
+        worker_metrics = [self.metrics.fresh() for _ in kernels]
+
+        def gate(image: np.ndarray, worker_index: int) -> Tuple[bool, float]:
+            quality_metrics = self._gate_frame(image, kernels[worker_index], worker_metrics[worker_index])
+            return quality_metrics.overall_score >= QUALITY_ACCEPT_THRESHOLD, quality_metrics.overall_score
+
+        collection_stats = {}
+        gate_wall = gate_busy = 0.0
+
+        try:
+            for material in materials:
+                if material not in self.materials:
+                    logger.warning(f"Material {material} not in configured materials")
+                    continue
+
+                logger.info(f"Collecting {count_per_material} images for {material} from {source.name}")
+
+                material_dir = Path(f"data/raw_images/{material}")
+                material_dir.mkdir(parents=True, exist_ok=True)
+
+                pipeline = CapturePipeline(
+                    source, gate, lambda image, index, material=material: self._capture_image(material, image),
+                    gate_workers=len(kernels), queue_size=queue_size)
+                # Capture extra frames for filtering, but not forever
+                stats = pipeline.run(material, count_per_material, max_frames=count_per_material * 2)
+
+                for metrics in worker_metrics:
+                    self.metrics.merge(metrics.drain())
+                self.metrics.count('captured', stats.captured)
+                self.metrics.count('accepted', stats.written)
+                self.metrics.count('rejected_quality', stats.rejected)
+                gate_wall += stats.elapsed
+                gate_busy += stats.gate_ms.mean * stats.gate_ms.count / 1000
+
+                report = stats.report()
+                logger.info(f"{material}: {stats.written}/{count_per_material} collected from "
+                            f"{stats.captured} frames at {report['capture_fps']} fps "
+                            f"(gate p50 {report['gate_ms_p50']} ms, p95 {report['gate_ms_p95']} ms)")
+
+                collection_stats[material] = {
+                    'collected': stats.written,
+                    'skipped': stats.rejected,
+                    'target': count_per_material,
+                    **report,
+                }
+        finally:
+            source.close()
+
+        self.metrics.record_pool('gate', len(kernels), gate_wall, gate_busy)
+        self._save_collection_report(collection_stats)
+        logger.info("Image collection completed")
+        return collection_stats
+
+    def _gate_frame(self, frame: np.ndarray, kernel: QualityKernel,
+                    metrics: PipelineMetrics) -> ImageQualityMetrics:
+        """Score a captured frame exactly as its saved file would be scored at the current decode scale."""
+        height, width = frame.shape[:2]
+        image = frame
+        if self.decode_scale > 1:
+            image = cv2.resize(frame, (width // self.decode_scale, height // self.decode_scale),
+                               interpolation=cv2.INTER_AREA)
+
+        quality_metrics = self._measure_decoded(image, width, height, kernel=kernel, metrics=metrics)
+        self._score_metrics([quality_metrics])
+        return quality_metrics
+
+    def _capture_image(self, material: str, image: np.ndarray) -> Path:
+        """Save an accepted frame to data/raw_images/<material>/ under a unique name."""
+        with self.metrics.stage('write'):
+            ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+            if not ok:
+                raise ValueError(f"Could not encode frame for {material}")
+
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            image_path = Path(f"data/raw_images/{material}/{material}_{timestamp}.jpg")
+            with open(image_path, 'wb') as f:
+                f.write(encoded.tobytes())
+
+        self.metrics.add_written('write', encoded.nbytes)
+        return image_path
+
+    def process_dataset(self, input_dir: str, output_dir: str, generate_labels: bool = True,
+                        workers: int = 1, chunksize: int = 16, stream: bool = False,
+                        incremental: bool = True, materialize_mode: Optional[str] = None,
+                        dedupe: bool = False):
+        """
+        Process raw images into training-ready dataset.
+
+        The pipeline is a chain of generator stages: scan -> assess -> copy ->
+        annotate, followed by split assignment. Quality statistics are kept
+        online and the per-image quality table is flushed to Parquet in chunks.
+
+        With workers > 1 (0 = all cores) image quality is assessed in a process
+        pool; results come back in input order so copying and labeling stay
+        deterministic.
+
+        With stream=True every accepted image is assigned a split and written to
+        its split directory as soon as it passes, so memory stays flat no matter
+        how many images are ingested. Otherwise records are collected and split
+        once at the end.
+
+        With incremental=True (the default) progress is recorded in the
+        processing manifest (data/metrics/processing_manifest.sqlite): sources
+        already handled under the current quality and dedupe settings are
+        skipped, changed sources replace their old outputs, and an interrupted
+        run resumes where it stopped. Splits are a pure function of content
+        hash and material, so adding images never moves existing ones between
+        splits.
+
+        materialize_mode overrides dataset.materialize for this run: images can
+        be hardlinked, reflinked or symlinked instead of copied, or listed in
+        split files (mode 'manifest') instead of being placed at all.
+
+        With dedupe=True accepted images are checked against a perceptual-hash
+        index of every image kept so far (including earlier runs); those within
+        label_quality_checks.duplicate_max_distance bits of a kept image are
+        rejected as near-duplicates.
+        """
+        logger.info("Processing dataset...")
+
+        thumbnails_before = self.thumbnail_cache.stats() if self.thumbnail_cache else None
+
+        if materialize_mode:
+            self.materialize_mode = self._resolve_materialize_mode(materialize_mode)
+        self._split_lists = {}
+
+        input_path = Path(input_dir)
+        output_path = Path(output_dir)
+
+        if incremental:
+            # Dedupe rejections are recorded as complete, so the dedupe settings are part of the fingerprint
+            manifest_fingerprint = config_fingerprint({
+                'quality': self.quality_fingerprint,
+                'duplicate_max_distance': self.duplicate_max_distance if dedupe else None,
+            })
+            self.manifest = ProcessingManifest("data/metrics/processing_manifest.sqlite", manifest_fingerprint)
+
+        self.annotation_store = AnnotationStore(self.annotation_store_path)
+
+        if dedupe:
+            self.duplicate_filter = NearDuplicateFilter(self._open_phash_store(), self.duplicate_max_distance)
+
+        # The file index only discovers files: a file rewritten in place leaves its
+        # directory's mtime alone, so the size and mtime it lists can be stale
+        image_files = (f.path for f in self._scan_indexed(input_path, full=not incremental))
+        if self.manifest:
+            # is_complete stats each candidate itself, so in-place rewrites are seen
+            image_files = (path for path in image_files if not self.manifest.is_complete(path))
+
+        total = None
+        if not stream:
+            image_files = list(image_files)
+            total = len(image_files)
+
+        score_stats = RunningStats()
+        # Skipped sources keep their rows from earlier runs
+        table_writer = QualityTableWriter("data/metrics/quality.parquet", merge=incremental)
+
+        records = self._stream_annotate(
+            self._stream_copy(
+                self._stream_assess(
+                    tqdm(image_files, total=total, desc="Processing images"),
+                    workers, chunksize, score_stats, table_writer),
+                output_path),
+            generate_labels)
+
+        try:
+            if stream:
+                split_tally = SplitTally(self.split_assigner.ratios)
+                processed_count = sum(1 for _ in self._stream_assign_split(records, split_tally))
+            else:
+                processed_data = list(records)
+                processed_count = len(processed_data)
+
+                # Generate dataset splits
+                split_tally = self._create_dataset_splits(processed_data)
+
+            if self.manifest:
+                # Report on the whole dataset, including earlier runs
+                split_tally = SplitTally(self.split_assigner.ratios, self.manifest.split_counts())
+
+            if self.materialize_mode == 'manifest':
+                self._write_split_lists()
+        finally:
+            table_writer.close()
+            if self.manifest:
+                self.manifest.close()
+                self.manifest = None
+
+            self.annotation_store.close()
+            self.annotation_store = None
+
+            duplicates = 0
+            if self.duplicate_filter:
+                duplicates = self.duplicate_filter.duplicates
+                self.duplicate_filter.store.close()
+                self.duplicate_filter = None
+
+        # Save processing report
+        self._save_processing_report(processed_count, score_stats, split_tally, duplicates,
+                                     self._thumbnail_stats(thumbnails_before))
+
+        if self.quality_cache:
+            self.quality_cache.commit()
+
+        logger.info(f"Dataset processing completed. Processed {processed_count} images")
+
+    def _scan_images(self, root: Path) -> Iterator[Path]:
+        """Scan stage: images under root in a stable (os.walk) order."""
+        for indexed in self._scan_indexed(root):
+            yield indexed.path
+
+    def _scan_indexed(self, root: Path, full: bool = False) -> List[IndexedFile]:
+        """
+        Images under root with their size, mtime and inode, from one pass of
+        the shared file index: only directories changed since the last scan
+        are listed again.
+        """
+        with self.metrics.stage('scan'):
+            with FileIndex(self.file_index_path) as index:
+                files = index.scan(root, IMAGE_EXTENSIONS, full=full)
+                scan_stats = index.last_scan
+
+        self.metrics.count('scanned', len(files))
+        self.metrics.count('scan_directories_listed', scan_stats['directories_listed'])
+        self.metrics.count('scan_directories_reused', scan_stats['directories_reused'])
+        return files
+
+    def _stream_assess(self, image_files: Iterable[Path], workers: int, chunksize: int,
+                       score_stats: RunningStats,
+                       table_writer: QualityTableWriter) -> Iterator[Tuple[Path, str, ImageQualityMetrics]]:
+        """Assess stage: score every image, record it, and pass on those that meet the threshold."""
+        quality_table = QualityTable(QUALITY_COLUMN_DTYPES, capacity=QUALITY_TABLE_FLUSH_ROWS)
+
+        try:
+            for image_file, file_hash, quality_metrics in self._iter_quality_metrics(image_files, workers, chunksize):
+                score_stats.add(quality_metrics.overall_score)
+                quality_table.append(image_file, file_hash, asdict(quality_metrics))
+
+                if len(quality_table) >= QUALITY_TABLE_FLUSH_ROWS:
+                    with self.metrics.stage('quality_table'):
+                        table_writer.write(quality_table)
+                    quality_table.clear()
+
+                accepted = quality_metrics.overall_score >= QUALITY_ACCEPT_THRESHOLD
+                if not accepted:
+                    self.metrics.count('rejected_quality')
+
+                if accepted and self.duplicate_filter and file_hash:
+                    with self.metrics.stage('dedupe'):
+                        accepted = not self._is_near_duplicate(image_file, file_hash)
+                    if not accepted:
+                        self.metrics.count('rejected_duplicate')
+
+                if self.manifest and file_hash:
+                    with self.metrics.stage('manifest'):
+                        recorded = self._record_in_manifest(image_file, file_hash, quality_metrics, accepted)
+                    if not recorded:
+                        self.metrics.count('skipped_identical')
+                        continue
+
+                if accepted:
+                    self.metrics.count('accepted')
+                    yield image_file, file_hash, quality_metrics
+        finally:
+            with self.metrics.stage('quality_table'):
+                table_writer.write(quality_table)
+
+    def _open_phash_store(self) -> PerceptualHashStore:
+        return PerceptualHashStore("data/metrics/duplicate_index.sqlite", thumbnails=self.thumbnail_cache)
+
+    def _is_near_duplicate(self, image_file: Path, file_hash: str) -> bool:
+        """Check an accepted image against the near-duplicate index, registering it if new."""
+        try:
+            duplicate_of = self.duplicate_filter.check(file_hash, image_file)
+        except Exception as e:
+            logger.error(f"Could not hash {image_file}: {e}")
+            return False
+
+        if duplicate_of:
+            logger.debug(f"Near-duplicate rejected: {image_file} (matches {duplicate_of})")
+        return duplicate_of is not None
+
+    def _record_in_manifest(self, image_file: Path, file_hash: str,
+                            quality_metrics: ImageQualityMetrics, accepted: bool) -> bool:
+        """Register an assessed source; False if its content is already fully processed."""
+        previous_hash = self.manifest.record_source(image_file, file_hash)
+        if previous_hash:
+            stale = self.manifest.retire(previous_hash)
+            if stale:
+                self._remove_outputs(stale)
+
+        # Byte-identical copy of an image handled under another path
+        if self.manifest.is_complete_hash(file_hash):
+            return False
+
+        self.manifest.record_assessed(image_file, file_hash, self._detect_material_type(str(image_file)),
+                                      quality_metrics.overall_score, accepted)
+        return True
+
+    def _remove_outputs(self, entry: Dict[str, Any]):
+        """Delete the processed copy, annotation and split copies of a retired image."""
+        paths = [entry.get('processed_path'), entry.get('annotation_path')]
+        images = [entry['processed_path']] if entry.get('processed_path') else []
+        if entry.get('split') and entry.get('processed_path'):
+            split_dir = Path(f"data/scrap_dataset/{entry['split']}")
+            processed_path = Path(entry['processed_path'])
+            paths += [split_dir / processed_path.name, split_dir / processed_path.with_suffix('.json').name]
+            images.append(split_dir / processed_path.name)
+
+        for path in filter(None, paths):
+            Path(path).unlink(missing_ok=True)
+
+        if self.annotation_store:
+            self.annotation_store.delete(images)
+
+        logger.info(f"Removed outputs of changed source {entry['source_path']}")
+
+    def _stream_copy(self, assessed: Iterable[Tuple[Path, str, ImageQualityMetrics]],
+                     output_path: Path) -> Iterator[Dict[str, Any]]:
+        """Copy stage: place accepted images in the processed directory."""
+        for image_file, file_hash, quality_metrics in assessed:
+            try:
+                with self.metrics.stage('copy'):
+                    processed_path = self._copy_to_processed(image_file, output_path, file_hash)
+                    self._link_cached_copy(processed_path, file_hash)
+            except Exception as e:
+                logger.error(f"Error processing {image_file}: {e}")
+                self.metrics.count('errors')
+                continue
+
+            yield {
+                'original_path': str(image_file),
+                'processed_path': str(processed_path),
+                'quality_score': quality_metrics.overall_score,
+                'material_type': self._detect_material_type(str(image_file)),
+                'content_hash': file_hash,
+                'quality_metrics': quality_metrics
+            }
+
+    def _stream_annotate(self, records: Iterable[Dict[str, Any]],
+                         generate_labels: bool) -> Iterator[Dict[str, Any]]:
+        """Annotate stage: generate and save labels next to each processed image."""
+        for record in records:
+            quality_metrics = record.pop('quality_metrics')
+
+            annotation_path = None
+            if generate_labels:
+                try:
+                    with self.metrics.stage('annotate'):
+                        annotation = self._generate_annotation(record['original_path'], quality_metrics)
+                        annotation_path = self._save_annotation(Path(record['processed_path']), annotation,
+                                                                record['content_hash'])
+                except Exception as e:
+                    logger.error(f"Error processing {record['original_path']}: {e}")
+                    self.metrics.count('errors')
+                    continue
+
+            if self.manifest:
+                self.manifest.record_processed(record['content_hash'], record['processed_path'],
+                                               annotation_path and str(annotation_path))
+
+            yield record
+
+    def _stream_assign_split(self, records: Iterable[Dict[str, Any]],
+                             split_tally: SplitTally) -> Iterator[Dict[str, Any]]:
+        """Split stage: assign each record a split and write it there immediately."""
+        for record in records:
+            self._assign_split(record, split_tally)
+            yield record
+
+    def _iter_quality_metrics(self, image_files: Iterable[Path], workers: int = 1,
+                              chunksize: int = 16) -> Iterator[Tuple[Path, str, ImageQualityMetrics]]:
+        """
+        Yield (image_file, content_hash, metrics) in input order.
+
+        Cached metrics are served from the quality cache; only new or changed
+        files are decoded, optionally in a process pool.
+        """
+        workers = workers or os.cpu_count() or 1
+        executor = None
+
+        if workers > 1:
+            logger.info(f"Assessing image quality with {workers} workers (chunksize={chunksize})")
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           initializer=_init_quality_worker,
+                                           initargs=(self,))
+
+        batch_size = max(1, workers * chunksize * 4)
+        image_files = iter(image_files)
+
+        # Utilization: time workers spent assessing over the time the pool was up
+        busy_before = self.metrics.busy_seconds('assess')
+        pool_start = time.perf_counter()
+
+        try:
+            while True:
+                batch = list(islice(image_files, batch_size))
+                if not batch:
+                    break
+                yield from self._assess_batch(batch, executor, chunksize)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            self.metrics.record_pool('assess', workers if executor else 1, time.perf_counter() - pool_start,
+                                     self.metrics.busy_seconds('assess') - busy_before)
+
+    def _assess_batch(self, image_files: List[Path], executor: Optional[ProcessPoolExecutor],
+                      chunksize: int) -> Iterator[Tuple[Path, str, ImageQualityMetrics]]:
+        """
+        Assess one batch, consulting the cache before decoding anything.
+
+        Images are measured individually (in workers when pooled) and the whole
+        batch is then scored in a single vectorized pass.
+        """
+        with self.metrics.stage('cache_lookup'):
+            cached = [self._lookup_cached_metrics(f) for f in image_files]
+        misses = [str(f) for f, hit in zip(image_files, cached) if hit is None]
+        self.metrics.count('cache_hits', len(cached) - len(misses))
+        self.metrics.count('cache_misses', len(misses))
+
+        if executor is not None:
+            fresh = map(self._merge_worker_metrics,
+                        executor.map(_assess_image_file_worker, misses, chunksize=max(1, chunksize)))
+        else:
+            fresh = map(self._assess_image_file, misses)
+
+        assessed = [hit if hit is not None else next(fresh) for hit in cached]
+        with self.metrics.stage('score'):
+            self._score_metrics([quality_metrics for _, quality_metrics in assessed])
+        self.metrics.count('assessed', len(assessed))
+
+        for image_file, hit, (file_hash, quality_metrics) in zip(image_files, cached, assessed):
+            # Failed assessments are retried on the next run rather than cached
+            if hit is None and self.quality_cache and quality_metrics.resolution_width > 0:
+                self.quality_cache.store(image_file, file_hash, asdict(quality_metrics))
+
+            yield image_file, file_hash, quality_metrics
+
+        if self.quality_cache:
+            self.quality_cache.commit()
+
+    def _merge_worker_metrics(self, result: Tuple[Tuple[str, ImageQualityMetrics], Optional[Dict[str, Any]]]
+                              ) -> Tuple[str, ImageQualityMetrics]:
+        """Unwrap a pool result, folding the worker's measurements into the run's metrics."""
+        assessed, snapshot = result
+        self.metrics.merge(snapshot)
+        return assessed
+
+    def _lookup_cached_metrics(self, image_file: Path) -> Optional[Tuple[str, ImageQualityMetrics]]:
+        """Return cached (content_hash, metrics) for an unchanged file, if any."""
+        if not self.quality_cache:
+            return None
+
+        try:
+            hit = self.quality_cache.lookup(image_file)
+        except OSError:
+            return None
+
+        if hit is None:
+            return None
+
+        file_hash, metrics = hit
+        return file_hash, ImageQualityMetrics(**metrics)
+
+    def _link_cached_copy(self, copy_path: Path, file_hash: str):
+        """Let the cache resolve a byte-identical copy without rescoring it."""
+        if self.quality_cache and file_hash:
+            self.quality_cache.link(copy_path, file_hash)
+
+    def _assess_image_file(self, image_path: str) -> Tuple[str, ImageQualityMetrics]:
+        """Read an image once, returning its content hash and unscored quality metrics."""
+        with self.metrics.stage('assess'):
+            try:
+                with self.metrics.stage('read'):
+                    data = Path(image_path).read_bytes()
+            except OSError as e:
+                logger.error(f"Could not read {image_path}: {e}")
+                self.metrics.count('errors')
+                return "", self._measure_image_quality(image_path)
+
+            self.metrics.add_read('read', len(data))
+            with self.metrics.stage('hash'):
+                file_hash = content_hash(data)
+
+            return file_hash, self._measure_image_quality(image_path, data, file_hash)
+
+    def _assess_image_quality(self, image_path: str, data: Optional[bytes] = None) -> ImageQualityMetrics:
+        """Assess comprehensive image quality metrics, including the overall score."""
+        quality_metrics = self._measure_image_quality(image_path, data)
+        self._score_metrics([quality_metrics])
+        return quality_metrics
+
+    def _measure_image_quality(self, image_path: str, data: Optional[bytes] = None,
+                               file_hash: Optional[str] = None) -> ImageQualityMetrics:
+        """
+        Measure individual quality metrics; overall_score is filled in by _score_metrics.
+
+        Given the image's content hash, the decoded pixels are also saved to
+        the thumbnail cache so later stages need not decode the file again.
+        """
+        try:
+            with self.metrics.stage('decode'):
+                image, width, height = self._decode_for_quality(image_path, data)
+
+            if file_hash and self.thumbnail_cache:
+                self._store_thumbnails(file_hash, image, full_resolution=image.shape[1] == width)
+
+            return self._measure_decoded(image, width, height)
+
+        except Exception as e:
+            logger.error(f"Quality assessment failed for {image_path}: {e}")
+            self.metrics.count('decode_failures')
+            return ImageQualityMetrics(
+                brightness=0.0, contrast=0.0, blurriness=0.0,
+                saturation=0.0, resolution_width=0, resolution_height=0,
+                aspect_ratio=0.0, has_reference_object=False, reference_x=0.0, reference_y=0.0,
+                reference_radius=0.0, pixels_per_inch=0.0, overall_score=0.0
+            )
+
+    def _measure_decoded(self, image: np.ndarray, width: int, height: int,
+                         kernel: Optional[QualityKernel] = None,
+                         metrics: Optional[PipelineMetrics] = None) -> ImageQualityMetrics:
+        """
+        Quality metrics of decoded pixels; width and height are those of the
+        full-resolution image. Threads pass their own kernel and metrics.
+        """
+        kernel = kernel or self.quality_kernel
+        metrics = metrics or self.metrics
+
+        # Brightness, contrast, blurriness (Laplacian variance) and saturation
+        with metrics.stage('quality_metrics'):
+            brightness, contrast, blurriness, saturation = kernel.compute(image)
+
+        # Reference coin; cached with the other metrics under the image's content hash
+        with metrics.stage('reference'):
+            reference = self.reference_detector.detect(image, width)
+
+        return ImageQualityMetrics(
+            brightness=brightness,
+            contrast=contrast,
+            blurriness=blurriness,
+            saturation=saturation,
+            resolution_width=width,
+            resolution_height=height,
+            aspect_ratio=width / height,
+            has_reference_object=reference is not None,
+            reference_x=reference.center_x if reference else 0.0,
+            reference_y=reference.center_y if reference else 0.0,
+            reference_radius=reference.radius if reference else 0.0,
+            pixels_per_inch=reference.pixels_per_inch if reference else 0.0,
+            overall_score=0.0
+        )
+
+    def _store_thumbnails(self, file_hash: str, image: np.ndarray, full_resolution: bool):
+        """Save thumbnails of a decoded image; a cache failure never fails assessment."""
+        try:
+            with self.metrics.stage('thumbnail'):
+                self.thumbnail_cache.put(file_hash, image, full_resolution=full_resolution)
+        except Exception as e:
+            logger.warning(f"Could not cache thumbnails for {file_hash}: {e}")
+
+    def _thumbnail_stats(self, before: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Thumbnail cache hits, misses, stores and evictions since `before`, added to the run metrics."""
+        if not self.thumbnail_cache:
+            return None
+
+        delta = ThumbnailCache.delta(before, self.thumbnail_cache.stats())
+        for name in ('hits', 'misses', 'stores', 'evictions'):
+            self.metrics.count(f'thumbnail_{name}', delta[name])
+
+        logger.info(f"Thumbnail cache: {delta['hits']} hits, {delta['misses']} misses, "
+                    f"{delta['stores']} stored, {delta['evictions']} evicted "
+                    f"({delta['entries']}/{delta['capacity']} images)")
+        return delta
+
+    def _decode_for_quality(self, image_path: str,
+                            data: Optional[bytes] = None) -> Tuple[np.ndarray, int, int]:
+        """
+        Decode an image for quality scoring.
+
+        JPEGs are decoded at 1/decode_scale resolution; the returned width and
+        height are always those of the full-resolution image.
+        """
+        is_jpeg = (data[:2] == b'\xff\xd8') if data is not None else \
+            Path(image_path).suffix.lower() in ('.jpg', '.jpeg')
+        flags = REDUCED_DECODE_FLAGS[self.decode_scale] if is_jpeg else cv2.IMREAD_COLOR
+
+        if data is not None:
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        else:
+            image = cv2.imread(image_path, flags)
+        if image is None:
+            raise ValueError("Could not load image")
+
+        if flags == cv2.IMREAD_COLOR:
+            return image, image.shape[1], image.shape[0]
+
+        # Full-resolution size from the JPEG header, without decoding pixels
+        with Image.open(io.BytesIO(data) if data is not None else image_path) as header:
+            width, height = header.size
+
+        return image, width, height
+
+    def _calculate_quality_score(self, brightness: float, contrast: float,
+                               blurriness: float, saturation: float,
+                               has_reference: bool) -> float:
+        """Calculate overall quality score from individual metrics."""
+        columns = {
+            'brightness': np.array([brightness]),
+            'contrast': np.array([contrast]),
+            'blurriness': np.array([blurriness]),
+            'saturation': np.array([saturation]),
+            'has_reference_object': np.array([has_reference]),
+        }
+        return float(self._score_quality_columns(columns)[0])
+
+    def _score_metrics(self, metrics: List[ImageQualityMetrics]):
+        """Fill in overall_score for a batch of measured metrics in one vectorized pass."""
+        if not metrics:
+            return
+
+        columns = {
+            name: np.array([getattr(m, name) for m in metrics])
+            for name in ('brightness', 'contrast', 'blurriness', 'saturation',
+                         'has_reference_object', 'resolution_width')
+        }
+        scores = self._score_quality_columns(columns)
+
+        for quality_metrics, score in zip(metrics, scores):
+            quality_metrics.overall_score = float(score)
+
+    def _score_quality_columns(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Vectorized overall quality score over metric columns."""
+        thresholds = self.quality_thresholds['image_quality_checks']
+        blur_threshold = thresholds['blur_threshold'] * self.blur_threshold_factor
+
+        # Normalize individual scores
+        sub_scores = np.column_stack([
+            np.minimum(columns['brightness'] / thresholds['brightness_threshold'][1], 1.0),
+            np.minimum(columns['contrast'] / thresholds['contrast_threshold'], 1.0),
+            np.minimum(columns['blurriness'] / blur_threshold, 1.0),
+            np.minimum(columns['saturation'] / thresholds['saturation_threshold'], 1.0),
+            np.where(columns['has_reference_object'], 1.0, 0.5),
+        ])
+
+        # Weighted average
+        scores = sub_scores @ QUALITY_SCORE_WEIGHTS / QUALITY_SCORE_WEIGHTS.sum()
+
+        # Images that could not be decoded score zero
+        if 'resolution_width' in columns:
+            scores[columns['resolution_width'] <= 0] = 0.0
+
+        return scores
+
+    def rescore_quality_table(self, table_path: str = "data/metrics/quality.parquet") -> Dict[str, Any]:
+        """Re-score a persisted quality table under the current thresholds without decoding images."""
+        table = QualityTable.read_parquet(table_path, QUALITY_COLUMN_DTYPES)
+        scores = self._score_quality_columns(table.columns())
+        accepted = int(np.count_nonzero(scores >= QUALITY_ACCEPT_THRESHOLD))
+
+        summary = {
+            'total_images': len(table),
+            'accepted': accepted,
+            'rejected': len(table) - accepted,
+            'previously_accepted': int(np.count_nonzero(table.column('overall_score') >= QUALITY_ACCEPT_THRESHOLD)),
+            'mean_score': float(scores.mean()) if len(scores) else 0.0,
+        }
+
+        logger.info(f"Rescored {len(table)} images from {table_path}: {accepted} accepted "
+                    f"(previously {summary['previously_accepted']})")
+        return summary
+
+    def _generate_annotation(self, image_path: str, quality_metrics: ImageQualityMetrics) -> ScrapMetalAnnotation:
+        """Generate annotation for image (semi-automated)."""
+        material_type = self._detect_material_type(image_path)
+
+        # Placeholder bounding box - would be manually labeled or ML-assisted
+        bounding_box = (50, 50, 200, 200)  # x, y, w, h
+
+        # Placeholder weight estimation
+        weight = self._estimate_weight_from_material(material_type)
+
+        return ScrapMetalAnnotation(
+            material_type=material_type,
+            bounding_box=bounding_box,
+            weight_pounds=weight,
+            confidence=quality_metrics.overall_score
+        )
+
+    def _detect_material_type(self, image_path: str) -> str:
+        """Detect material type from filename or directory structure."""
+        path_parts = Path(image_path).parts
+
+        for part in reversed(path_parts):
+            if part in self.materials:
+                return part
+
+        return "unknown"
+
+    def _estimate_weight_from_material(self, material_type: str) -> float:
+        """Basic weight estimation based on material properties."""
+        material_props = self.config['materials'].get(material_type, {})
+        base_density = material_props.get('density_kg_m3', 7800)  # Default steel density
+
+        # Convert to typical scrap weight range
+        weight_kg = base_density * 0.0001  # Rough volumetric estimate
+        return weight_kg * 2.20462  # Convert to pounds
+
+    def _copy_to_processed(self, source_path: Path, output_dir: Path, file_hash: str) -> Path:
+        """Copy image to processed directory under a content-derived filename."""
+        material = self._detect_material_type(str(source_path))
+
+        # Stable across runs, so reprocessing overwrites instead of duplicating
+        output_name = f"{material}_{file_hash[:12]}_{source_path.name}"
+        output_path = output_dir / output_name
+
+        self._materialize(source_path, output_path)
+        if self.metrics.enabled and self.materialize_mode in ('copy', 'manifest'):
+            self.metrics.add_written('copy', output_path.stat().st_size)
+        return output_path
+
+    def _save_annotation(self, image_path: Path, annotation: ScrapMetalAnnotation,
+                         file_hash: Optional[str] = None) -> Optional[Path]:
+        """Save annotation to the annotation store and, unless disabled, its .json sidecar."""
+        annotation_data = {
+            'image_path': str(image_path),
+            'content_hash': file_hash,
+            'material_type': annotation.material_type,
+            'bounding_box': annotation.bounding_box,
+            'weight_pounds': annotation.weight_pounds,
+            'confidence': annotation.confidence,
+            'timestamp': datetime.now().isoformat()
+        }
+
+        annotation_file = None
+        if self.write_sidecars:
+            annotation_file = image_path.with_suffix('.json')
+            text = json.dumps(annotation_data, indent=2)
+            with open(annotation_file, 'w') as f:
+                f.write(text)
+            self.metrics.add_written('annotate', len(text))
+
+        # Stored after the sidecar, so the row is newer and the sidecar is not imported again
+        if self.annotation_store:
+            self.annotation_store.put(image_path, annotation_data, source='data_processor')
+
+        return annotation_file
+
+    def _create_dataset_splits(self, processed_data: List[Dict[str, Any]]) -> SplitTally:
+        """Create train/val/test splits, stratified by material."""
+        split_tally = SplitTally(self.split_assigner.ratios)
+        if not processed_data:
+            logger.warning("No processed images to split")
+            return split_tally
+
+        for record in processed_data:
+            self._assign_split(record, split_tally)
+
+        logger.info("Dataset splits created")
+
+        return split_tally
+
+    def _assign_split(self, record: Dict[str, Any], split_tally: SplitTally):
+        """Hash a record into its split and place it there."""
+        record['split'] = self.split_assigner.assign(record['content_hash'], record['material_type'])
+        self._place_in_split(record, record['split'])
+        split_tally.add(record['material_type'], record['split'])
+
+    def _place_in_split(self, record: Dict[str, Any], split_name: str):
+        """Materialize one processed image and its annotation in a split directory."""
+        with self.metrics.stage('split'):
+            self._place_in_split_dir(record, split_name)
+        self.metrics.count(f'split_{split_name}')
+
+        if self.manifest:
+            self.manifest.record_split(record['content_hash'], split_name)
+
+    def _place_in_split_dir(self, record: Dict[str, Any], split_name: str):
+        """Write the image and annotation into the split directory (or the split list)."""
+        src_path = Path(record['processed_path'])
+
+        if self.materialize_mode == 'manifest':
+            # Listed in <split>.txt at the end of the run instead
+            self._split_lists.setdefault(split_name, []).append(str(src_path.resolve()))
+            if self.annotation_store:
+                self.annotation_store.set_split(src_path, split_name)
+        else:
+            split_dir = Path(f"data/scrap_dataset/{split_name}")
+            split_dir.mkdir(exist_ok=True)
+            annotation_path = src_path.with_suffix('.json')
+
+            # Move image
+            dst_image = split_dir / src_path.name
+            self._materialize(src_path, dst_image)
+            self._link_cached_copy(dst_image, record.get('content_hash'))
+            if self.metrics.enabled and self.materialize_mode == 'copy':
+                self.metrics.add_written('split', dst_image.stat().st_size)
+
+            # Move annotation if exists (always a real copy: annotations get edited per split)
+            if annotation_path.exists():
+                dst_annotation = split_dir / annotation_path.name
+                shutil.copy2(annotation_path, dst_annotation)
+                if self.metrics.enabled:
+                    self.metrics.add_written('split', dst_annotation.stat().st_size)
+
+            if self.annotation_store:
+                annotation = self.annotation_store.get(src_path)
+                if annotation is not None:
+                    annotation['image_path'] = str(dst_image)
+                    self.annotation_store.put(dst_image, annotation, source='data_processor', split=split_name)
+
+    def _materialize(self, src_path: Path, dst_path: Path):
+        """Place src_path at dst_path using the run's materialization mode."""
+        mode = 'copy' if self.materialize_mode == 'manifest' else self.materialize_mode
+        materialize(src_path, dst_path, mode)
+
+    def _write_split_lists(self):
+        """Write data/scrap_dataset/<split>.txt with one image path per line."""
+        if self.manifest:
+            # Cover images placed by earlier runs, not just this one
+            self._split_lists = self.manifest.split_members()
+
+        for split_name in SPLIT_NAMES:
+            list_path = Path(f"data/scrap_dataset/{split_name}.txt")
+            temp_path = list_path.with_suffix('.txt.tmp')
+            paths = sorted(self._split_lists.get(split_name, []))
+
+            with open(temp_path, 'w') as f:
+                f.writelines(f"{path}\n" for path in paths)
+            os.replace(temp_path, list_path)
+
+            logger.info(f"{split_name}: {len(paths)} images listed in {list_path}")
+
+    def validate_dataset(self, dataset_path: str, workers: int = 1, chunksize: int = 16,
+                         audit_duplicates: bool = False, resume: bool = False) -> Dict[str, Any]:
+        """
+        Validate dataset quality and completeness.
+
+        Issues are streamed to data/metrics/validation_issues.jsonl as they are
+        found and quality scores are summarized online, so memory stays flat
+        and nothing already found is lost if the run dies. A checkpoint is
+        written every VALIDATION_CHECKPOINT_EVERY images; with resume=True a
+        run picks up after the last checkpoint for the same dataset. The final
+        report is a compact summary, written atomically.
+
+        With audit_duplicates=True every image is also perceptually hashed and
+        near-duplicate pairs and clusters, including those that straddle
+        splits, are written to data/metrics/duplicate_audit.json.
+        """
+        logger.info(f"Validating dataset at {dataset_path}")
+
+        thumbnails_before = self.thumbnail_cache.stats() if self.thumbnail_cache else None
+        dataset_path = Path(dataset_path)
+        checkpoint_path = Path("data/metrics/validation_checkpoint.json")
+
+        # Sorted, so a resumed run sees the same order
+        image_files = list(self._scan_images(dataset_path))
+
+        checkpoint = self._load_validation_checkpoint(checkpoint_path, dataset_path) if resume else None
+        if checkpoint:
+            summary = ValidationSummary.from_state(checkpoint['summary'])
+            done = checkpoint['images_done']
+            logger.info(f"Resuming validation after {done} images")
+        else:
+            summary = ValidationSummary()
+            done = 0
+
+        issue_log = IssueLog(Path("data/metrics/validation_issues.jsonl"),
+                             resume_offset=checkpoint['issues_offset'] if checkpoint else None)
+
+        phash_store = self._open_phash_store() if audit_duplicates else None
+        perceptual_hashes = []
+
+        # The duplicate audit needs every image, so validated ones are replayed (from the quality cache)
+        skip = done if phash_store else 0
+        if not phash_store:
+            image_files = image_files[done:]
+
+        assessed = self._iter_quality_metrics(image_files, workers, chunksize)
+
+        # Annotations are looked up in the store; sidecars not in it yet are imported first
+        annotation_store = AnnotationStore(self.annotation_store_path)
+        annotation_store.import_sidecars(dataset_path)
+
+        try:
+            for position, (image_file, file_hash, quality_metrics) in enumerate(
+                    tqdm(assessed, total=len(image_files), desc="Validating images")):
+                if phash_store and file_hash:
+                    try:
+                        split = image_file.parent.name if image_file.parent.name in SPLIT_NAMES else ""
+                        perceptual_hashes.append((file_hash, phash_store.hash_for(file_hash, image_file),
+                                                  str(image_file), split))
+                    except Exception as e:
+                        logger.error(f"Could not hash {image_file}: {e}")
+
+                if position < skip:
+                    continue
+
+                self._validate_image(image_file, quality_metrics, annotation_store, summary, issue_log)
+                done += 1
+
+                if done % VALIDATION_CHECKPOINT_EVERY == 0:
+                    self._save_validation_checkpoint(checkpoint_path, dataset_path, done, summary, issue_log)
+        finally:
+            issue_log.close()
+            annotation_store.close()
+
+        validation_results = summary.report()
+        validation_results['issues_log'] = str(issue_log.path)
+
+        if phash_store:
+            phash_store.close()
+            audit = audit_near_duplicates(perceptual_hashes, self.duplicate_max_distance)
+            validation_results['duplicate_pairs'] = audit['duplicate_pairs']
+            validation_results['cross_split_duplicate_pairs'] = audit['cross_split_pairs']
+            self._save_duplicate_audit(audit)
+
+        validation_results['thumbnail_cache'] = self._thumbnail_stats(thumbnails_before)
+
+        # Generate validation report
+        self._save_validation_report(validation_results)
+        checkpoint_path.unlink(missing_ok=True)
+
+        if self.quality_cache:
+            self.quality_cache.commit()
+
+        logger.info(f"Validation completed: {validation_results['valid_images']}/{validation_results['total_images']} valid images")
+
+        return validation_results
+
+    def _validate_image(self, image_file: Path, quality_metrics: ImageQualityMetrics,
+                        annotation_store: AnnotationStore, summary: ValidationSummary, issue_log: IssueLog):
+        """Check one image, updating the summary and logging any issue."""
+        summary.total_images += 1
+        summary.add_score(quality_metrics.overall_score)
+
+        try:
+            # Check annotation exists; the store holds it whether or not sidecars are written
+            has_annotation = annotation_store.get(image_file) is not None
+
+            if quality_metrics.overall_score >= QUALITY_ACCEPT_THRESHOLD and has_annotation:
+                summary.add_valid(self._detect_material_type(str(image_file)))
+            elif quality_metrics.overall_score < QUALITY_ACCEPT_THRESHOLD:
+                summary.add_issue('poor_quality')
+                issue_log.write({
+                    'file': str(image_file),
+                    'issue': 'poor_quality',
+                    'score': quality_metrics.overall_score
+                })
+            else:
+                summary.add_issue('missing_annotation')
+                issue_log.write({
+                    'file': str(image_file),
+                    'issue': 'missing_annotation'
+                })
+
+        except Exception as e:
+            summary.add_issue('error')
+            issue_log.write({
+                'file': str(image_file),
+                'issue': str(e)
+            })
+
+    def _load_validation_checkpoint(self, checkpoint_path: Path, dataset_path: Path) -> Optional[Dict[str, Any]]:
+        """Checkpoint of an unfinished run over the same dataset and quality settings, if any."""
+        if not checkpoint_path.exists():
+            logger.info("No validation checkpoint found; starting from the beginning")
+            return None
+
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+
+        if checkpoint.get('dataset') != str(dataset_path.resolve()) or \
+                checkpoint.get('quality_fingerprint') != self.quality_fingerprint:
+            logger.warning("Validation checkpoint is for another dataset or quality settings; ignoring it")
+            return None
+
+        return checkpoint
+
+    def _save_validation_checkpoint(self, checkpoint_path: Path, dataset_path: Path, images_done: int,
+                                    summary: ValidationSummary, issue_log: IssueLog):
+        """Persist progress: issues are synced first so the recorded offset is durable."""
+        write_json_atomic(checkpoint_path, {
+            'dataset': str(dataset_path.resolve()),
+            'quality_fingerprint': self.quality_fingerprint,
+            'images_done': images_done,
+            'issues_offset': issue_log.sync(),
+            'summary': summary.state(),
+        }, indent=None)
+
+    def _save_collection_report(self, stats: Dict[str, Dict[str, Any]]):
+        """Save image collection statistics, including capture frame rates and gate latency."""
+        report_path = Path("data/metrics/collection_report.json")
+
+        report = {
+            'collection_date': datetime.now().isoformat(),
+            'statistics': stats,
+            'total_collected': sum(s['collected'] for s in stats.values()),
+            'total_target': sum(s['target'] for s in stats.values()),
+            'success_rate': sum(s['collected'] for s in stats.values()) /
+                          max(1, sum(s['target'] for s in stats.values()))
+        }
+
+        write_json_atomic(report_path, report)
+
+        logger.info(f"Collection report saved to {report_path}")
+
+    def _save_processing_report(self, processed_count: int, score_stats: RunningStats,
+                                split_tally: SplitTally, duplicates: int = 0,
+                                thumbnail_stats: Optional[Dict[str, Any]] = None):
+        """Save data processing report."""
+        report_path = Path("data/metrics/processing_report.json")
+        summary = score_stats.summary()
+        split_ratios = split_tally.report()
+
+        for material, splits in split_ratios.items():
+            achieved = ", ".join(f"{name} {s['achieved']:.2f}/{s['target']:.2f}" for name, s in splits.items())
+            logger.info(f"Split ratios for {material} (achieved/target): {achieved}")
+
+        report = {
+            'processing_date': datetime.now().isoformat(),
+            'total_processed': processed_count,
+            'total_assessed': summary['count'],
+            'near_duplicates_rejected': duplicates,
+            'split_counts': split_tally.totals(),
+            'split_ratios': split_ratios,
+            'thumbnail_cache': thumbnail_stats,
+            'quality_stats': {
+                'mean_score': summary['mean'],
+                'min_score': summary['min'],
+                'max_score': summary['max'],
+                'std_score': summary['std']
+            }
+        }
+
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+        logger.info(f"Processing report saved to {report_path}")
+
+    def _save_duplicate_audit(self, audit: Dict[str, Any]):
+        """Save the near-duplicate audit."""
+        report_path = Path("data/metrics/duplicate_audit.json")
+
+        with open(report_path, 'w') as f:
+            json.dump(audit, f, indent=2)
+
+        logger.info(f"Duplicate audit: {audit['duplicate_pairs']} near-duplicate pairs "
+                    f"({audit['cross_split_pairs']} across splits) in {len(audit['clusters'])} clusters, "
+                    f"saved to {report_path}")
+
+    def _save_validation_report(self, results: Dict[str, Any]):
+        """Save dataset validation report."""
+        report_path = Path("data/metrics/validation_report.json")
+
+        write_json_atomic(report_path, {'validation_date': datetime.now().isoformat(), **results})
+
+        logger.info(f"Validation report saved to {report_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KL Recycling ML Data Processor")
+    parser.add_argument("--collect", action="store_true", help="Collect new training images")
+    parser.add_argument("--process", action="store_true", help="Process raw images into training dataset")
+    parser.add_argument("--validate", action="store_true", help="Validate existing dataset")
+    parser.add_argument("--rescore", action="store_true",
+                        help="Re-score data/metrics/quality.parquet under the current thresholds")
+    parser.add_argument("--augment", type=int, metavar="K",
+                        help="Write K augmented variants of every training image to data/augmented_images")
+    parser.add_argument("--import-annotations", metavar="DIR",
+                        help="Import the .json annotation sidecars under DIR into the annotation store")
+    parser.add_argument("--export-annotations", metavar="DIR",
+                        help="Write the annotation store's entries under DIR back out as .json sidecars")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for --augment and --source synthetic")
+    parser.add_argument("--materials", nargs="+", help="Materials to collect/process")
+    parser.add_argument("--input", help="Input directory for processing")
+    parser.add_argument("--output", help="Output directory for processed data")
+    parser.add_argument("--dataset", help="Dataset directory for validation")
+    parser.add_argument("--count", type=int, default=100, help="Number of images per material")
+    parser.add_argument("--source", choices=FRAME_SOURCES, default="camera",
+                        help="Frame source for --collect (replay/synthetic stand in for a camera)")
+    parser.add_argument("--replay-dir", help="Directory of images replayed by --source replay")
+    parser.add_argument("--camera-index", type=int, default=0, help="OpenCV camera device for --source camera")
+    parser.add_argument("--gate-workers", type=int, default=2,
+                        help="Quality-gate threads scoring captured frames during --collect")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Quality-assessment worker processes (0 = all cores)")
+    parser.add_argument("--chunk-size", type=int, default=16,
+                        help="Images sent to a worker per task when --workers > 1")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Ignore the quality metrics cache and rescore every image")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write each accepted image to its split as soon as it passes (flat memory)")
+    parser.add_argument("--full", action="store_true",
+                        help="Reprocess every image, ignoring the processing manifest")
+    parser.add_argument("--materialize", choices=list(MATERIALIZE_MODES) + ['manifest'], default=None,
+                        help="How images are placed in processed/split directories "
+                             "(overrides dataset.materialize; 'manifest' writes <split>.txt lists)")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Reject near-duplicate images when processing; audit them when validating")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted --validate run from its last checkpoint")
+    parser.add_argument("--decode-scale", type=int, choices=[1, 2, 4, 8], default=None,
+                        help="Score JPEGs decoded at 1/N resolution (overrides quality_control.fast_decode)")
+    parser.add_argument("--metrics-report", metavar="PATH",
+                        help="Record per-stage timings and counters and write a JSON run report to PATH")
+    parser.add_argument("--prometheus-textfile", metavar="PATH",
+                        help="Also write the run metrics as a Prometheus textfile (node exporter)")
+
+    args = parser.parse_args()
+
+    # Initialize processor
+    processor = ScrapMetalDataProcessor(use_cache=not args.no_cache, decode_scale=args.decode_scale)
+
+    if args.metrics_report or args.prometheus_textfile:
+        command = next((name for name in ('collect', 'process', 'validate', 'augment', 'rescore')
+                        if getattr(args, name)), 'data_processor')
+        processor.metrics = PipelineMetrics(run=command)
+
+    if args.collect:
+        materials = args.materials or ["steel", "aluminum", "copper", "brass"]
+        source = open_frame_source(args.source, replay_dir=args.replay_dir, camera_index=args.camera_index,
+                                   seed=args.seed)
+        processor.collect_images(materials, args.count, source=source, gate_workers=args.gate_workers)
+
+    elif args.process:
+        if not args.input or not args.output:
+            logger.error("Must specify --input and --output directories for processing")
+            sys.exit(1)
+        processor.process_dataset(args.input, args.output, workers=args.workers,
+                                  chunksize=args.chunk_size, stream=args.stream,
+                                  incremental=not args.full, materialize_mode=args.materialize,
+                                  dedupe=args.dedupe)
+
+    elif args.validate:
+        if not args.dataset:
+            logger.error("Must specify --dataset directory for validation")
+            sys.exit(1)
+        processor.validate_dataset(args.dataset, workers=args.workers, chunksize=args.chunk_size,
+                                   audit_duplicates=args.dedupe, resume=args.resume)
+
+    elif args.augment:
+        processor.augment_dataset(args.augment, workers=args.workers, seed=args.seed)
+
+    elif args.rescore:
+        summary = processor.rescore_quality_table()
+        print(json.dumps(summary, indent=2))
+
+    elif args.import_annotations or args.export_annotations:
+        with AnnotationStore(processor.annotation_store_path) as store:
+            if args.import_annotations:
+                count = store.import_sidecars(Path(args.import_annotations), replace=True)
+                logger.info(f"Imported {count} annotations into {processor.annotation_store_path}")
+            else:
+                store.export_sidecars(Path(args.export_annotations))
+
+    else:
+        logger.error("Must specify one of --collect, --process, --validate, --augment, --rescore, "
+                     "--import-annotations or --export-annotations")
+        parser.print_help()
+        sys.exit(1)
+
+    if processor.quality_cache:
+        processor.quality_cache.close()
+    if processor.thumbnail_cache:
+        processor.thumbnail_cache.close()
+
+    save_run_metrics(processor.metrics, args.metrics_report, args.prometheus_textfile)
+    if args.metrics_report:
+        logger.info(f"Run metrics saved to {args.metrics_report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+KL Recycling Dataset Splits
+===========================
+
+Deterministic train/val/test assignment. Every image's split is a pure
+function of a stable key (its content hash) and its material: the key is
+hashed into [0, 1) and mapped onto the cumulative train/val/test ratios.
+Assignment is O(1), needs no view of the rest of the dataset, and gives the
+same answer in batch, streaming and parallel runs; adding images never moves
+existing ones between splits.
+
+Ratios are met in expectation within each material stratum; SplitTally
+reports how close a given dataset came.
+"""
+
+import hashlib
+from typing import Any, Dict, Optional
+
+SPLIT_NAMES = ('train', 'val', 'test')
+
+
+def split_ratios(dataset_config: Dict[str, Any]) -> Dict[str, float]:
+    """Normalized train/val/test ratios from the dataset config's *_split keys."""
+    ratios = {name: float(dataset_config[f'{name}_split']) for name in SPLIT_NAMES}
+    total = sum(ratios.values())
+    return {name: ratio / total for name, ratio in ratios.items()}
+
+
+class HashSplitAssigner:
+    """Stratified split assignment by hashing (material, key) into [0, 1)."""
+
+    def __init__(self, dataset_config: Dict[str, Any], salt: str = ""):
+        self.ratios = split_ratios(dataset_config)
+        self.salt = salt
+
+        # Upper bound of each split's interval, e.g. train [0, .7), val [.7, .9), test [.9, 1)
+        self._bounds = []
+        upper = 0.0
+        for name in SPLIT_NAMES:
+            upper += self.ratios[name]
+            self._bounds.append((upper, name))
+
+    def unit_interval(self, key: str, material: str) -> float:
+        """Uniform position of an image in [0, 1)."""
+        digest = hashlib.blake2b(f"{self.salt}/{material}/{key}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') / 2.0 ** 64
+
+    def assign(self, key: str, material: str) -> str:
+        position = self.unit_interval(key, material)
+        for upper, name in self._bounds:
+            if position < upper:
+                return name
+        # Floating point rounding of the last bound
+        return SPLIT_NAMES[-1]
+
+
+class SplitTally:
+    """Per-material split counts, for reporting achieved against target ratios."""
+
+    def __init__(self, ratios: Dict[str, float], counts: Optional[Dict[str, Dict[str, int]]] = None):
+        self.ratios = ratios
+        self.counts: Dict[str, Dict[str, int]] = {}
+        for material, prior in (counts or {}).items():
+            for name, count in prior.items():
+                self.add(material, name, count)
+
+    def add(self, material: str, split: str, count: int = 1):
+        counts = self.counts.setdefault(material, {name: 0 for name in SPLIT_NAMES})
+        counts[split] += count
+
+    def totals(self) -> Dict[str, int]:
+        """Images in each split across all materials."""
+        return {name: sum(c[name] for c in self.counts.values()) for name in SPLIT_NAMES}
+
+    def report(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """material -> split -> count, achieved ratio and target ratio."""
+        report = {}
+        for material, counts in sorted(self.counts.items()):
+            total = sum(counts.values())
+            report[material] = {
+                name: {
+                    'count': counts[name],
+                    'achieved': counts[name] / total if total else 0.0,
+                    'target': self.ratios[name],
+                }
+                for name in SPLIT_NAMES
+            }
+        return report
@@ -22,13 +22,11 @@ import logging
 from datetime import datetime
 import hashlib
 
-import tensorflow as tf
-import torch
 import yaml
 from tqdm import tqdm
-import onnx
-from onnx2tf import convert
-import tflite_support
+
+# tensorflow, torch and onnx2tf are imported by the conversion steps that use
+# them; deploying a ready .tflite file or updating the app needs none of them.
 
 # Configure logging
 logging.basicConfig(
@@ -235,6 +233,8 @@ class ModelDeployer:
 
         try:
             # Use onnx2tf for conversion
+            from onnx2tf import convert
+
             convert(
                 input_onnx_file_path=onnx_path,
                 output_folder_path=tf_path,
@@ -249,6 +249,8 @@ class ModelDeployer:
 
     def _tensorflow_to_tflite(self, tf_path: str, task: str) -> Dict[str, Any]:
         """Convert TensorFlow model to TFLite with quantization."""
+        import tensorflow as tf
+
         converter = tf.lite.TFLiteConverter.from_saved_model(tf_path)
 
         # Apply optimizations
@@ -335,6 +337,8 @@ class ModelDeployer:
 
     def _create_representative_dataset(self, task: str):
         """Create representative dataset for quantization."""
+        import tensorflow as tf
+
         def representative_dataset():
             # Generate representative samples for quantization
             if task == 'detection':
@@ -357,6 +361,8 @@ class ModelDeployer:
 
         # Load model for inference time estimation
         try:
+            import tensorflow as tf
+
             interpreter = tf.lite.Interpreter(model_path=str(model_path))
             interpreter.allocate_tensors()
 
@@ -400,6 +406,8 @@ class ModelDeployer:
         # Calculate model hash for version tracking
         model_hash = self._calculate_model_hash(model_path)
 
+        import tensorflow as tf
+
         metadata = {
             'model_type': model_type,
             'source_format': source_format,
@@ -0,0 +1,408 @@
+"""
+KL Recycling Near-Duplicate Index
+=================================
+
+Perceptual hashing and Hamming-distance search for burst photos, re-downloads
+and other near-identical images.
+
+- dhash: 64-bit difference hash of a 9x8 grayscale thumbnail; small edits,
+  re-encoding and rescaling move it by only a few bits
+- DuplicateIndex: multi-index hashing over 4 x 16-bit chunks. Two hashes
+  within distance k agree to within k // 4 bits on at least one chunk, so a
+  query probes bucketed chunk tables and verifies the few candidates with a
+  vectorized popcount. Additions go to a small buffer that is sealed into
+  immutable segments, merged log-structured style, so adds stay amortized
+  O(log n). Memory is ~24 bytes per image plus its key, and 2 MB of
+  bucket offsets per segment (O(log n) segments).
+- near_duplicate_pairs: the same probing done in bulk over a whole array of
+  hashes, for dataset audits
+- PerceptualHashStore: SQLite cache of hashes by content hash, recording
+  which images were kept and which were dropped as duplicates. New hashes are
+  computed from the shared thumbnail cache when it holds the image.
+- NearDuplicateFilter: ingest-time dedupe on top of the two
+- audit_near_duplicates: pairs and clusters of near-duplicates in a dataset,
+  flagging those that straddle splits
+"""
+
+import logging
+import sqlite3
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from thumbnail_cache import ThumbnailCache
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+CHUNK_BITS = 16
+CHUNKS = HASH_BITS // CHUNK_BITS
+
+# Recent additions, kept in an unsorted buffer that is scanned with a
+# vectorized popcount before it becomes a sorted segment
+PENDING_LIMIT = 1024
+
+
+def dhash(image: np.ndarray) -> int:
+    """64-bit difference hash: each bit is whether a pixel is brighter than its right neighbour."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    thumbnail = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def dhash_file(path: Path) -> int:
+    """dHash of an image file, decoding JPEGs at 1/8 scale since only 9x8 pixels survive."""
+    data = np.fromfile(str(path), dtype=np.uint8)
+    image = None
+    if data[:2].tobytes() == b'\xff\xd8':
+        image = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        image = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"Could not decode {path}")
+    return dhash(image)
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """Set bits per element of a uint64 array (SWAR)."""
+    x = values.astype(np.uint64, copy=True)
+    x -= (x >> np.uint64(1)) & np.uint64(0x5555555555555555)
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((x * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(radius: int) -> np.ndarray:
+    """XOR masks turning a 16-bit value into each value within `radius` bits of it."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            masks.append(sum(1 << bit for bit in bits))
+    return np.array(masks, dtype=np.uint16)
+
+
+class _Segment:
+    """
+    Immutable run of hashes with one table of (chunk number, chunk value)
+    keys, sorted and bucketed: key k's entries are positions[starts[k]:
+    starts[k + 1]], so a probe is two array reads rather than a search.
+    """
+
+    def __init__(self, rows: np.ndarray, hashes: np.ndarray):
+        self.rows = rows
+        self.hashes = hashes
+        keys = np.concatenate([
+            (np.uint32(chunk) << np.uint32(CHUNK_BITS))
+            | ((hashes >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.uint32)
+            for chunk in range(CHUNKS)
+        ])
+        order = np.argsort(keys, kind='stable')
+        # Position in this segment of each sorted key
+        self.positions = (order % len(hashes)).astype(np.int32)
+        self.starts = np.zeros((CHUNKS << CHUNK_BITS) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=CHUNKS << CHUNK_BITS), out=self.starts[1:])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def candidates(self, probes: np.ndarray) -> np.ndarray:
+        """Positions with any chunk key among probes (from _probe_keys)."""
+        lo = self.starts[probes]
+        lengths = self.starts[probes + 1] - lo
+        hit = lengths > 0
+        if not hit.any():
+            return np.empty(0, dtype=np.int64)
+
+        # Expand the [lo, lo + length) ranges without a Python loop
+        lo, lengths = lo[hit], lengths[hit]
+        ends = np.cumsum(lengths)
+        offsets = np.repeat(lo - (ends - lengths), lengths) + np.arange(ends[-1])
+        return np.unique(self.positions[offsets])
+
+
+def _probe_keys(value: int, radius: int) -> np.ndarray:
+    """Chunk keys within `radius` bits of each of value's chunks."""
+    masks = _flip_masks(radius).astype(np.uint32)
+    return np.concatenate([
+        (np.uint32(chunk) << np.uint32(CHUNK_BITS)) | (masks ^ np.uint32((value >> (chunk * CHUNK_BITS)) & 0xFFFF))
+        for chunk in range(CHUNKS)
+    ])
+
+
+class DuplicateIndex:
+    """
+    Multi-index hash table answering "all hashes within Hamming distance k".
+
+    Additions go to a pending buffer; every PENDING_LIMIT of them become a
+    sorted segment, and segments of similar size are merged (a log-structured
+    merge), so an addition costs O(log n) amortized and a query probes
+    O(log n) segments with binary search instead of re-sorting the index.
+    """
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self._segments: List[_Segment] = []
+        self._pending = np.empty(PENDING_LIMIT, dtype=np.uint64)
+        self._pending_count = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: str, value: int):
+        self.keys.append(key)
+        self._pending[self._pending_count] = value
+        self._pending_count += 1
+        if self._pending_count == PENDING_LIMIT:
+            self._seal()
+
+    def _seal(self):
+        """Turn the pending buffer into a segment, merging equal-sized segments."""
+        count = self._pending_count
+        rows = np.arange(len(self.keys) - count, len(self.keys), dtype=np.int64)
+        segment = _Segment(rows, self._pending[:count].copy())
+        self._pending_count = 0
+
+        while self._segments and len(self._segments[-1]) <= len(segment):
+            previous = self._segments.pop()
+            segment = _Segment(np.concatenate([previous.rows, segment.rows]),
+                               np.concatenate([previous.hashes, segment.hashes]))
+        self._segments.append(segment)
+
+    def query(self, value: int, max_distance: int) -> List[Tuple[str, int]]:
+        """(key, distance) of every indexed hash within max_distance bits, nearest first."""
+        probes = _probe_keys(value, max_distance // CHUNKS)
+
+        rows, hashes = [], []
+        for segment in self._segments:
+            positions = segment.candidates(probes)
+            rows.append(segment.rows[positions])
+            hashes.append(segment.hashes[positions])
+
+        # Recent additions not yet in a segment
+        if self._pending_count:
+            rows.append(np.arange(len(self.keys) - self._pending_count, len(self.keys), dtype=np.int64))
+            hashes.append(self._pending[:self._pending_count])
+
+        if not rows:
+            return []
+        rows = np.concatenate(rows)
+        distances = popcount(np.concatenate(hashes) ^ np.uint64(value))
+        close = distances <= max_distance
+        rows, distances = rows[close], distances[close]
+        order = np.argsort(distances, kind='stable')
+        return [(self.keys[row], int(distance)) for row, distance in zip(rows[order], distances[order])]
+
+
+def _to_signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+class PerceptualHashStore:
+    """SQLite cache of perceptual hashes keyed by content hash."""
+
+    def __init__(self, db_path: str, thumbnails: Optional[ThumbnailCache] = None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.thumbnails = thumbnails
+
+        self._conn = sqlite3.connect(str(self.db_path))
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS phash (
+                content_hash TEXT PRIMARY KEY,
+                dhash INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                kept INTEGER,
+                duplicate_of TEXT
+            );
+        """)
+
+    def hash_for(self, file_hash: str, path: Path) -> int:
+        """Cached dHash of an image, computed on first sight."""
+        row = self._conn.execute("SELECT dhash FROM phash WHERE content_hash = ?", (file_hash,)).fetchone()
+        if row is not None:
+            return _to_unsigned(row[0])
+
+        # Any thumbnail will do: only 9x8 pixels survive
+        thumbnail = self.thumbnails.get(file_hash, self.thumbnails.sizes[0]) if self.thumbnails else None
+        value = dhash(thumbnail) if thumbnail is not None else dhash_file(path)
+        self._conn.execute("INSERT INTO phash (content_hash, dhash, path) VALUES (?, ?, ?)",
+                           (file_hash, _to_signed(value), str(path)))
+        return value
+
+    def mark(self, file_hash: str, kept: bool, duplicate_of: Optional[str] = None):
+        self._conn.execute("UPDATE phash SET kept = ?, duplicate_of = ? WHERE content_hash = ?",
+                           (int(kept), duplicate_of, file_hash))
+
+    def kept(self) -> Iterable[Tuple[str, int]]:
+        """(content_hash, dhash) of every image kept by earlier runs."""
+        for file_hash, value in self._conn.execute("SELECT content_hash, dhash FROM phash WHERE kept = 1"):
+            yield file_hash, _to_unsigned(value)
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+class NearDuplicateFilter:
+    """Keeps the first image of each near-duplicate group, across runs."""
+
+    def __init__(self, store: PerceptualHashStore, max_distance: int):
+        self.store = store
+        self.max_distance = max_distance
+        self.duplicates = 0
+        self._checked = set()
+
+        self.index = DuplicateIndex()
+        for file_hash, value in store.kept():
+            self.index.add(file_hash, value)
+
+        logger.info(f"Near-duplicate index loaded with {len(self.index)} images "
+                    f"(max Hamming distance {max_distance})")
+
+    def check(self, file_hash: str, path: Path) -> Optional[str]:
+        """Content hash of an already kept near-duplicate, or None after registering this image."""
+        value = self.store.hash_for(file_hash, path)
+
+        matches = [match for match, _ in self.index.query(value, self.max_distance)]
+
+        if file_hash in matches:
+            if file_hash in self._checked:
+                # Byte-identical copy of an image kept earlier in this run
+                self.duplicates += 1
+                return file_hash
+
+            # Kept by an earlier (possibly interrupted) run
+            self._checked.add(file_hash)
+            return None
+
+        if matches:
+            self.store.mark(file_hash, kept=False, duplicate_of=matches[0])
+            self.duplicates += 1
+            return matches[0]
+
+        self.index.add(file_hash, value)
+        self.store.mark(file_hash, kept=True)
+        self._checked.add(file_hash)
+        return None
+
+
+def near_duplicate_pairs(hashes: np.ndarray, max_distance: int,
+                         block: int = 4096) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every pair of hashes within max_distance bits, as (later, earlier,
+    distance) arrays with later > earlier, ordered by later, then distance.
+
+    The batch counterpart of querying a DuplicateIndex before each add: one
+    sorted chunk table over all hashes is probed for a block of hashes at a
+    time, entirely in numpy.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    empty = np.empty(0, dtype=np.int64)
+    if len(hashes) < 2:
+        return empty, empty, empty
+
+    table = _Segment(np.arange(len(hashes), dtype=np.int64), hashes)
+    masks = _flip_masks(max_distance // CHUNKS).astype(np.uint32)
+    found = []
+    for start in range(0, len(hashes), block):
+        queries = np.arange(start, min(start + block, len(hashes)), dtype=np.int64)
+        # (query, chunk, mask) probe keys, flattened query-major
+        chunks = np.stack([((hashes[queries] >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.uint32)
+                           | np.uint32(chunk << CHUNK_BITS) for chunk in range(CHUNKS)], axis=1)
+        probes = (chunks[:, :, None] ^ masks[None, None, :]).reshape(len(queries), -1)
+
+        lo = table.starts[probes.ravel()]
+        lengths = table.starts[probes.ravel() + 1] - lo
+        if not lengths.any():
+            continue
+        hit = lengths > 0
+        owners = np.repeat(queries, probes.shape[1])[hit]
+        lo, lengths = lo[hit], lengths[hit]
+        ends = np.cumsum(lengths)
+        offsets = np.repeat(lo - (ends - lengths), lengths) + np.arange(ends[-1])
+
+        later = np.repeat(owners, lengths)
+        earlier = table.positions[offsets]
+        keep = earlier < later
+        later, earlier = later[keep], earlier[keep]
+        distances = popcount(hashes[later] ^ hashes[earlier])
+        close = distances <= max_distance
+        # A pair agreeing on several chunks is found once per chunk
+        pairs, first = np.unique(later[close] * len(hashes) + earlier[close], return_index=True)
+        found.append((pairs // len(hashes), pairs % len(hashes), distances[close][first]))
+
+    if not found:
+        return empty, empty, empty
+    later, earlier, distances = (np.concatenate(parts) for parts in zip(*found))
+    order = np.lexsort((earlier, distances, later))
+    return later[order], earlier[order], distances[order]
+
+
+def audit_near_duplicates(items: Iterable[Tuple[str, int, str, str]], max_distance: int) -> Dict[str, Any]:
+    """
+    Find near-duplicate pairs and clusters among (key, dhash, path, split) items.
+
+    Images are told apart by path, not key: byte-identical copies share a
+    content hash and are reported as distance-0 pairs. Pairs whose images sit
+    in different splits leak between training and evaluation and are reported
+    separately.
+    """
+    paths: List[str] = []
+    splits: List[str] = []
+    values: List[int] = []
+    seen = set()
+    for _, value, path, split in items:
+        if path in seen:
+            continue
+        seen.add(path)
+        paths.append(path)
+        splits.append(split)
+        values.append(value)
+
+    later, earlier, distances = near_duplicate_pairs(np.array(values, dtype=np.uint64), max_distance)
+
+    parent = list(range(len(paths)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    pairs = []
+    for i, j, distance in zip(later.tolist(), earlier.tolist(), distances.tolist()):
+        pairs.append({'image': paths[i], 'duplicate_of': paths[j], 'distance': distance,
+                      'cross_split': splits[i] != splits[j]})
+        parent[find(i)] = find(j)
+
+    clusters: Dict[int, List[str]] = {}
+    for i, path in enumerate(paths):
+        clusters.setdefault(find(i), []).append(path)
+    clusters = [sorted(members) for members in clusters.values() if len(members) > 1]
+
+    return {
+        'images': len(paths),
+        'max_distance': max_distance,
+        'duplicate_pairs': len(pairs),
+        'cross_split_pairs': sum(pair['cross_split'] for pair in pairs),
+        'clusters': sorted(clusters, key=len, reverse=True),
+        'pairs': pairs,
+    }
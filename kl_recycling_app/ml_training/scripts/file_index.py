@@ -0,0 +1,252 @@
+"""
+KL Recycling File Index
+=======================
+
+Single-pass directory scanner backed by a persistent SQLite index of every
+file seen: (path, size, mtime_ns, inode) plus each directory's mtime.
+
+A scan walks the tree with os.scandir, listing directories in a thread pool
+so that slow (network) filesystems are read many directories at a time, and
+matches an extension set in the same pass. Adding, removing or renaming a
+file updates its directory's mtime, so on later scans a directory whose
+mtime is unchanged is taken from the index: it costs one stat instead of a
+listing plus a stat per file. Directories modified moments before a scan are
+not trusted next time, since a second change within the same mtime tick
+would be invisible.
+
+Files rewritten in place keep their directory's mtime; their index entries
+refresh when the directory next changes, or on a scan with full=True. Use
+the index to find files, and stat a file before trusting it is unchanged.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILE_INDEX = "data/metrics/file_index.sqlite"
+
+# Directory mtimes this close to the scan are re-listed next time
+RACY_WINDOW_NS = 2_000_000_000
+
+
+class IndexedFile(NamedTuple):
+    path: Path
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+class _Listing(NamedTuple):
+    mtime_ns: int
+    subdirs: List[str]
+    files: List[Tuple[str, int, int, int]]     # (name, size, mtime_ns, inode)
+    cached: bool
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class FileIndex:
+    """Persistent index of directory listings, refreshed only where directories changed."""
+
+    def __init__(self, db_path: str = DEFAULT_FILE_INDEX, workers: int = 0):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Listing is I/O bound; more threads than cores keeps a network mount busy
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+
+        self._conn = sqlite3.connect(str(self.db_path))
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                directory TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+        """)
+        self.last_scan: Dict[str, int] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _load_subtree(self, top: str) -> Dict[str, _Listing]:
+        """Indexed listings of top and everything below it, in two queries."""
+        prefix = _escape_like(top.rstrip(os.sep) + os.sep) + '%'
+        listings: Dict[str, _Listing] = {}
+
+        for path, mtime_ns in self._conn.execute(
+                "SELECT path, mtime_ns FROM directories WHERE path = ? OR path LIKE ? ESCAPE '\\'", (top, prefix)):
+            listings[path] = _Listing(mtime_ns, [], [], cached=True)
+        for path in listings:
+            parent = listings.get(os.path.dirname(path))
+            if parent is not None and path != top:
+                parent.subdirs.append(os.path.basename(path))
+
+        for directory, name, size, mtime_ns, inode in self._conn.execute(
+                "SELECT directory, name, size, mtime_ns, inode FROM files "
+                "WHERE directory = ? OR directory LIKE ? ESCAPE '\\'", (top, prefix)):
+            listing = listings.get(directory)
+            if listing is not None:
+                listing.files.append((name, size, mtime_ns, inode))
+        return listings
+
+    @staticmethod
+    def _list(directory: str) -> Optional[_Listing]:
+        """List one directory from the filesystem (runs in a pool thread)."""
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+            subdirs, files = [], []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            files.append((entry.name, stat.st_size, stat.st_mtime_ns, stat.st_ino))
+                    except OSError:
+                        continue        # Vanished or unreadable mid-scan
+        except OSError as e:
+            logger.warning(f"Cannot list {directory}: {e}")
+            return None
+
+        if time.time_ns() - mtime_ns < RACY_WINDOW_NS:
+            mtime_ns = 0
+        return _Listing(mtime_ns, subdirs, files, cached=False)
+
+    def _refresh(self, directory: str, expected_mtime_ns: Optional[int], full: bool) -> Optional[_Listing]:
+        """Directory listing from the index if its mtime is unchanged, else from the filesystem."""
+        if expected_mtime_ns and not full:
+            try:
+                if os.stat(directory).st_mtime_ns == expected_mtime_ns:
+                    return None     # Caller uses the cached listing
+            except OSError:
+                return _Listing(-1, [], [], cached=False)
+        return self._list(directory) or _Listing(-1, [], [], cached=False)
+
+    def _forget(self, directory: str):
+        """Drop a directory and everything below it from the index."""
+        prefix = _escape_like(directory.rstrip(os.sep) + os.sep) + '%'
+        self._conn.execute("DELETE FROM files WHERE directory = ? OR directory LIKE ? ESCAPE '\\'",
+                           (directory, prefix))
+        self._conn.execute("DELETE FROM directories WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                           (directory, prefix))
+
+    def _store(self, directory: str, listing: _Listing):
+        parent = os.path.dirname(directory)
+        self._conn.execute("INSERT OR REPLACE INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                           (directory, parent, listing.mtime_ns))
+
+        old_subdirs = {r[0] for r in self._conn.execute("SELECT path FROM directories WHERE parent = ?",
+                                                        (directory,))}
+        for gone in old_subdirs - {os.path.join(directory, name) for name in listing.subdirs}:
+            self._forget(gone)
+
+        self._conn.execute("DELETE FROM files WHERE directory = ?", (directory,))
+        self._conn.executemany(
+            "INSERT INTO files (path, directory, name, size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?, ?)",
+            ((os.path.join(directory, name), directory, name, size, mtime, inode)
+             for name, size, mtime, inode in listing.files)
+        )
+
+    def scan(self, root: Path, extensions: Optional[Iterable[str]] = None, full: bool = False) -> List[IndexedFile]:
+        """
+        Files under root whose names end with one of `extensions` (any case;
+        all files if None), in os.walk order: each directory's files sorted
+        by name, then its subdirectories in name order. Paths are joined onto
+        root as given.
+        """
+        root_path = Path(root)
+        top = str(root_path.resolve())
+        suffixes = tuple(e.lower() for e in extensions) if extensions else None
+
+        if not os.path.isdir(top):
+            self._forget(top)
+            self._conn.commit()
+            return []
+
+        indexed = {} if full else self._load_subtree(top)
+        listings: Dict[str, _Listing] = {}
+        listed = reused = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scan") as executor:
+            pending = {}
+
+            def submit(directory: str):
+                cached = indexed.get(directory)
+                future = executor.submit(self._refresh, directory, cached.mtime_ns if cached else None, full)
+                pending[future] = (directory, cached)
+
+            submit(top)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory, cached = pending.pop(future)
+                    listing = future.result() or cached
+                    if listing.mtime_ns == -1:
+                        self._forget(directory)
+                        continue
+
+                    if listing.cached:
+                        reused += 1
+                    else:
+                        listed += 1
+                        self._store(directory, listing)
+
+                    listings[directory] = listing
+                    for name in listing.subdirs:
+                        submit(os.path.join(directory, name))
+
+        self._conn.commit()
+        self.last_scan = {'directories_listed': listed, 'directories_reused': reused}
+
+        results: List[IndexedFile] = []
+        self._emit(top, root_path, listings, suffixes, results)
+        self.last_scan['files'] = len(results)
+        logger.debug(f"Scanned {root}: {listed} directories listed, {reused} from the index, "
+                     f"{len(results)} files")
+        return results
+
+    def _emit(self, directory: str, path: Path, listings: Dict[str, _Listing],
+              suffixes: Optional[Tuple[str, ...]], results: List[IndexedFile]):
+        listing = listings.get(directory)
+        if listing is None:
+            return
+        for name, size, mtime_ns, inode in sorted(listing.files):
+            if suffixes is None or name.lower().endswith(suffixes):
+                results.append(IndexedFile(path / name, size, mtime_ns, inode))
+        for name in sorted(listing.subdirs):
+            self._emit(os.path.join(directory, name), path / name, listings, suffixes, results)
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+def scan_files(root: Path, extensions: Optional[Iterable[str]] = None, index_path: str = DEFAULT_FILE_INDEX,
+               full: bool = False) -> List[IndexedFile]:
+    """One indexed scan of root; see FileIndex.scan."""
+    with FileIndex(index_path) as index:
+        return index.scan(root, extensions, full=full)
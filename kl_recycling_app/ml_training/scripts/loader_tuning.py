@@ -0,0 +1,136 @@
+"""
+KL Recycling DataLoader Tuning
+==============================
+
+Picks num_workers, prefetch_factor and pin_memory for a training DataLoader
+by timing a few batches of the real dataset with each candidate, instead of
+guessing: the best worker count depends on image sizes, decode cost, the
+thumbnail and tensor caches and the storage the data sits on.
+
+The search is staged to stay short: worker counts first (0, 1, 2, 4, ... up
+to the core count, stopping once doubling no longer helps), then
+prefetch_factor for the best count, then pin_memory when training on a GPU.
+Values fixed in the config are taken as given and not searched.
+"""
+
+import logging
+import os
+import time
+from dataclasses import dataclass, replace
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# A candidate must beat the best so far by this much to count as better
+MIN_IMPROVEMENT = 0.05
+
+
+@dataclass(frozen=True)
+class LoaderSettings:
+    """DataLoader options being tuned, and the throughput measured with them."""
+    num_workers: int = 0
+    prefetch_factor: int = 2
+    pin_memory: bool = False
+    persistent_workers: bool = True
+    samples_per_sec: float = 0.0
+
+    def kwargs(self) -> Dict[str, Any]:
+        """Keyword arguments for DataLoader."""
+        kwargs = {'num_workers': self.num_workers, 'pin_memory': self.pin_memory}
+        if self.num_workers > 0:
+            # Only valid with worker processes
+            kwargs['prefetch_factor'] = self.prefetch_factor
+            kwargs['persistent_workers'] = self.persistent_workers
+        return kwargs
+
+    def describe(self) -> str:
+        return (f"num_workers={self.num_workers}, prefetch_factor={self.prefetch_factor}, "
+                f"pin_memory={self.pin_memory}")
+
+
+def worker_candidates(max_workers: int) -> List[int]:
+    """0, 1, 2, 4, ... up to and including max_workers."""
+    counts, n = [0], 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return sorted(set(counts))
+
+
+def measure_throughput(loader: Iterable, consume: Callable[[Any], int], batches: int, warmup: int = 2) -> float:
+    """
+    Samples/sec over `batches` batches, after `warmup` batches that absorb
+    worker start-up. consume(batch) moves a batch where training would and
+    returns its sample count.
+    """
+    iterator = iter(loader)
+    try:
+        for batch in islice(iterator, warmup):
+            consume(batch)
+
+        samples = 0
+        start = time.perf_counter()
+        for batch in islice(iterator, batches):
+            samples += consume(batch)
+        elapsed = time.perf_counter() - start
+    finally:
+        # Stop this candidate's workers before the next one starts its own
+        shutdown = getattr(iterator, '_shutdown_workers', None)
+        if shutdown is not None:
+            shutdown()
+
+    return samples / elapsed if elapsed > 0 else 0.0
+
+
+def autotune_loader(make_loader: Callable[[LoaderSettings], Iterable], consume: Callable[[Any], int],
+                    base: LoaderSettings, batches: int = 20, max_workers: int = 0,
+                    fixed: Optional[Dict[str, Any]] = None, pin_memory_available: bool = False) -> LoaderSettings:
+    """
+    Fastest LoaderSettings for the loaders make_loader builds. `fixed` holds
+    the options set explicitly (num_workers, prefetch_factor, pin_memory);
+    only the others are searched.
+    """
+    fixed = {key: value for key, value in (fixed or {}).items() if value is not None}
+    base = replace(base, **fixed)
+    max_workers = max_workers or os.cpu_count() or 1
+    results: List[LoaderSettings] = []
+
+    def run(settings: LoaderSettings) -> LoaderSettings:
+        rate = measure_throughput(make_loader(settings), consume, batches)
+        measured = replace(settings, samples_per_sec=rate)
+        results.append(measured)
+        logger.info(f"DataLoader {settings.describe()}: {rate:.1f} samples/sec")
+        return measured
+
+    def better(candidate: LoaderSettings, best: LoaderSettings) -> bool:
+        return candidate.samples_per_sec > best.samples_per_sec * (1 + MIN_IMPROVEMENT)
+
+    best = run(base)
+
+    if 'num_workers' not in fixed:
+        for workers in worker_candidates(max_workers):
+            if workers == base.num_workers:
+                continue
+            candidate = run(replace(best, num_workers=workers))
+            if better(candidate, best):
+                best = candidate
+            elif workers > best.num_workers > 0:
+                break       # Doubling again did not help; larger counts will not either
+
+    if 'prefetch_factor' not in fixed and best.num_workers > 0:
+        for prefetch in (4, 8):
+            candidate = run(replace(best, prefetch_factor=prefetch))
+            if not better(candidate, best):
+                break
+            best = candidate
+
+    if 'pin_memory' not in fixed and pin_memory_available:
+        candidate = run(replace(best, pin_memory=not best.pin_memory))
+        if better(candidate, best):
+            best = candidate
+
+    logger.info(f"DataLoader autotune picked {best.describe()} ({best.samples_per_sec:.1f} samples/sec, "
+                f"{len(results)} candidates timed)")
+    return best
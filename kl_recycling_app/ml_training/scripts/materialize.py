@@ -0,0 +1,80 @@
+"""
+KL Recycling File Materialization
+=================================
+
+Ways of placing an existing image at a new path without necessarily copying
+its bytes:
+
+- copy:     shutil.copy2, an independent file
+- hardlink: os.link, a second name for the same inode (in-place edits of
+            either name show up in both)
+- reflink:  FICLONE copy-on-write clone (btrfs, XFS, ...), independent but
+            sharing extents until modified
+- symlink:  absolute symbolic link to the source
+
+Hardlinks and reflinks cannot cross filesystems and reflinks need filesystem
+support; in those cases the file is copied and the fallback is logged once.
+"""
+
+import errno
+import logging
+import os
+import shutil
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MATERIALIZE_MODES = ('copy', 'hardlink', 'reflink', 'symlink')
+
+# ioctl request number of FICLONE (linux/fs.h)
+FICLONE = 0x40049409
+
+# Errors meaning "this mode is not possible here", as opposed to real I/O failures
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY,
+                    errno.EOPNOTSUPP, errno.ENOTSUP, errno.EMLINK}
+
+_warned = set()
+
+
+def _reflink(src: Path, dst: Path):
+    import fcntl
+
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            dst.unlink()
+            raise
+    shutil.copystat(src, dst)
+
+
+def materialize(src: Path, dst: Path, mode: str = 'copy') -> str:
+    """Place src at dst using mode, replacing dst; returns the mode actually used."""
+    if mode not in MATERIALIZE_MODES:
+        raise ValueError(f"Unknown materialization mode: {mode} (choose from {', '.join(MATERIALIZE_MODES)})")
+
+    src, dst = Path(src), Path(dst)
+    if dst.is_symlink() or dst.exists():
+        # Never write through an old link into the file it points at
+        dst.unlink()
+
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+            return mode
+        if mode == 'reflink':
+            _reflink(src, dst)
+            return mode
+        if mode == 'symlink':
+            os.symlink(src.resolve(), dst)
+            return mode
+    except (OSError, ImportError) as e:
+        if isinstance(e, OSError) and e.errno not in _FALLBACK_ERRNOS:
+            raise
+        if mode not in _warned:
+            _warned.add(mode)
+            logger.warning(f"{mode} not possible for {dst.parent} ({e}); falling back to copy")
+
+    shutil.copy2(src, dst)
+    return 'copy'
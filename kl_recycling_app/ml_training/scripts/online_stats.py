@@ -0,0 +1,168 @@
+"""
+KL Recycling Online Statistics
+==============================
+
+Constant-memory summaries for streaming pipelines, updated one value at a
+time so reports never need the full list of values:
+
+- RunningStats: count, mean, variance (Welford), min and max
+- FixedHistogram: counts over fixed-width bins
+- P2Quantile: a single quantile estimated with the P-square algorithm
+  (Jain & Chlamtac, 1985) from five markers
+
+Every summary can be saved with state() and restored with from_state(), so a
+resumed run continues exactly where a checkpoint left off.
+"""
+
+import math
+from typing import Any, Dict, List
+
+
+class RunningStats:
+    """Count, mean, variance (Welford), min and max of a stream of values."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'min': self.min if self.count else 0.0,
+            'max': self.max if self.count else 0.0,
+            'std': self.std,
+        }
+
+    def state(self) -> Dict[str, Any]:
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "RunningStats":
+        stats = cls()
+        stats.count, stats.mean, stats.m2 = state['count'], state['mean'], state['m2']
+        if stats.count:
+            stats.min, stats.max = state['min'], state['max']
+        return stats
+
+
+class FixedHistogram:
+    """Counts over `bins` equal-width bins spanning [low, high]; outliers land in the edge bins."""
+
+    def __init__(self, bins: int = 20, low: float = 0.0, high: float = 1.0):
+        self.low = low
+        self.high = high
+        self.counts = [0] * bins
+
+    def add(self, value: float):
+        bins = len(self.counts)
+        index = int((value - self.low) / (self.high - self.low) * bins)
+        self.counts[min(max(index, 0), bins - 1)] += 1
+
+    @property
+    def edges(self) -> List[float]:
+        width = (self.high - self.low) / len(self.counts)
+        return [self.low + i * width for i in range(len(self.counts) + 1)]
+
+    def state(self) -> Dict[str, Any]:
+        return {'low': self.low, 'high': self.high, 'counts': list(self.counts)}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "FixedHistogram":
+        histogram = cls(len(state['counts']), state['low'], state['high'])
+        histogram.counts = list(state['counts'])
+        return histogram
+
+
+class P2Quantile:
+    """Streaming estimate of the p-quantile using five markers (P-square algorithm)."""
+
+    def __init__(self, p: float):
+        self.p = p
+        self.heights: List[float] = []          # Marker heights q0..q4 (initial observations until 5 seen)
+        self.positions = [0, 1, 2, 3, 4]         # Actual marker positions
+        self.desired = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]
+        self.increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def add(self, value: float):
+        q = self.heights
+        if len(q) < 5:
+            q.append(value)
+            q.sort()
+            return
+
+        # Cell containing the value, extending the extremes if needed
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= value < q[i + 1])
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move interior markers toward their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = self._parabolic(i, d)
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    @property
+    def value(self) -> float:
+        q = self.heights
+        if not q:
+            return 0.0
+        if len(q) < 5:
+            # Exact (nearest rank) until the markers are initialized
+            return q[min(len(q) - 1, max(0, math.ceil(self.p * len(q)) - 1))]
+        return q[2]
+
+    def state(self) -> Dict[str, Any]:
+        return {'p': self.p, 'heights': list(self.heights), 'positions': list(self.positions),
+                'desired': list(self.desired)}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "P2Quantile":
+        quantile = cls(state['p'])
+        quantile.heights = list(state['heights'])
+        quantile.positions = list(state['positions'])
+        quantile.desired = list(state['desired'])
+        return quantile
@@ -0,0 +1,319 @@
+"""
+KL Recycling Pipeline Metrics
+=============================
+
+Lightweight instrumentation for the data pipeline scripts:
+
+- per-stage wall time as a fixed-bucket histogram with count, sum, min and max
+- bytes read and written per stage
+- named counters (accepted, rejected, cache hits, ...)
+- pool worker utilization: time spent on tasks over workers x wall time
+
+PipelineMetrics collects; NULL_METRICS has the same interface and does
+nothing, so instrumented code pays one no-op call per event when metrics are
+off. Pool workers collect into their own PipelineMetrics (see fresh()) and
+send drain() snapshots back with their results for the parent to merge().
+
+Results are written as a JSON run report and, optionally, as a Prometheus
+textfile for the node exporter's textfile collector.
+"""
+
+import os
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from validation_log import write_json_atomic
+
+# Histogram upper bounds in seconds; the last bucket is +Inf
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_PREFIX = "kl_pipeline"
+
+
+class StageHistogram:
+    """Wall-time distribution of one stage."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.buckets = [0] * (len(STAGE_BUCKETS) + 1)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect_left(STAGE_BUCKETS, seconds)] += 1
+
+    def merge(self, state: Dict[str, Any]):
+        self.count += state['count']
+        self.total += state['total']
+        self.min = min(self.min, state['min'])
+        self.max = max(self.max, state['max'])
+        self.buckets = [a + b for a, b in zip(self.buckets, state['buckets'])]
+
+    def state(self) -> Dict[str, Any]:
+        return {'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+                'buckets': list(self.buckets)}
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total, 6),
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'min_ms': round(self.min * 1000, 3) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 3),
+            'histogram': {'le_seconds': list(STAGE_BUCKETS) + ['+Inf'], 'counts': list(self.buckets)},
+        }
+
+
+class _StageTimer:
+    """Context manager observing its own duration into a stage histogram."""
+
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram: StageHistogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class PipelineMetrics:
+    """Stage timings, byte counts, counters and pool utilization of one run."""
+
+    enabled = True
+
+    def __init__(self, run: str = "pipeline"):
+        self.run = run
+        self.started = datetime.now()
+        self._start = time.perf_counter()
+        self.stages: Dict[str, StageHistogram] = {}
+        self.bytes_read: Dict[str, int] = {}
+        self.bytes_written: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self.pools: Dict[str, Dict[str, float]] = {}
+
+    def fresh(self) -> "PipelineMetrics":
+        """Empty collector of the same kind, for a pool worker."""
+        return PipelineMetrics(self.run)
+
+    def _histogram(self, stage: str) -> StageHistogram:
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = StageHistogram()
+        return histogram
+
+    def stage(self, name: str) -> _StageTimer:
+        """Time a block: `with metrics.stage('decode'): ...`"""
+        return _StageTimer(self._histogram(name))
+
+    def observe(self, stage: str, seconds: float):
+        self._histogram(stage).observe(seconds)
+
+    def timed_iter(self, items: Iterable[Any], stage: str) -> Iterator[Any]:
+        """Yield from items, timing each next() as one observation of stage."""
+        histogram = self._histogram(stage)
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            histogram.observe(time.perf_counter() - start)
+            yield item
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_read(self, stage: str, n: int):
+        self.bytes_read[stage] = self.bytes_read.get(stage, 0) + n
+
+    def add_written(self, stage: str, n: int):
+        self.bytes_written[stage] = self.bytes_written.get(stage, 0) + n
+
+    def busy_seconds(self, stage: str) -> float:
+        """Total time observed for a stage so far."""
+        histogram = self.stages.get(stage)
+        return histogram.total if histogram else 0.0
+
+    def record_pool(self, name: str, workers: int, wall_seconds: float, busy_seconds: float):
+        """Utilization of `workers` that spent busy_seconds on tasks over wall_seconds."""
+        capacity = workers * wall_seconds
+        self.pools[name] = {
+            'workers': workers,
+            'wall_seconds': round(wall_seconds, 6),
+            'busy_seconds': round(busy_seconds, 6),
+            'utilization': round(min(1.0, busy_seconds / capacity), 4) if capacity > 0 else 0.0,
+        }
+
+    def drain(self) -> Optional[Dict[str, Any]]:
+        """Snapshot of everything collected since the last drain, then reset (worker side)."""
+        if not (self.stages or self.counters or self.bytes_read or self.bytes_written):
+            return None
+
+        snapshot = {
+            'stages': {name: h.state() for name, h in self.stages.items()},
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'counters': self.counters,
+        }
+        self.stages, self.bytes_read, self.bytes_written, self.counters = {}, {}, {}, {}
+        return snapshot
+
+    def merge(self, snapshot: Optional[Dict[str, Any]]):
+        """Fold a worker's drain() snapshot into this collector."""
+        if not snapshot:
+            return
+        for name, state in snapshot['stages'].items():
+            self._histogram(name).merge(state)
+        for stage, n in snapshot['bytes_read'].items():
+            self.add_read(stage, n)
+        for stage, n in snapshot['bytes_written'].items():
+            self.add_written(stage, n)
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'run': self.run,
+            'started': self.started.isoformat(),
+            'duration_seconds': round(time.perf_counter() - self._start, 6),
+            'stages': {name: h.report() for name, h in self.stages.items()},
+            'bytes': {'read': dict(self.bytes_read), 'written': dict(self.bytes_written)},
+            'counters': dict(self.counters),
+            'pools': dict(self.pools),
+        }
+
+    def write_report(self, path: str) -> Dict[str, Any]:
+        """Write the JSON run report atomically and return it."""
+        report = self.report()
+        write_json_atomic(Path(path), report)
+        return report
+
+    def write_prometheus(self, path: str):
+        """
+        Write the run as a Prometheus textfile.
+
+        The node exporter may read the file at any moment, so it is written to
+        a temporary name and renamed into place.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + '.tmp')
+
+        with open(temp_path, 'w') as f:
+            f.write("\n".join(self._prometheus_lines()) + "\n")
+        os.replace(temp_path, path)
+
+    def _prometheus_lines(self) -> List[str]:
+        p = PROMETHEUS_PREFIX
+        run = _label_value(self.run)
+        lines = [
+            f"# HELP {p}_stage_seconds Wall time per item of each pipeline stage.",
+            f"# TYPE {p}_stage_seconds histogram",
+        ]
+        for name, h in sorted(self.stages.items()):
+            labels = f'run="{run}",stage="{_label_value(name)}"'
+            cumulative = 0
+            for bound, n in zip(list(STAGE_BUCKETS) + ['+Inf'], h.buckets):
+                cumulative += n
+                lines.append(f'{p}_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{p}_stage_seconds_sum{{{labels}}} {h.total:.6f}")
+            lines.append(f"{p}_stage_seconds_count{{{labels}}} {h.count}")
+
+        lines += [f"# HELP {p}_bytes_total Bytes read and written per stage.",
+                  f"# TYPE {p}_bytes_total counter"]
+        for direction, counts in (('read', self.bytes_read), ('written', self.bytes_written)):
+            for stage, n in sorted(counts.items()):
+                lines.append(f'{p}_bytes_total{{run="{run}",stage="{_label_value(stage)}",'
+                             f'direction="{direction}"}} {n}')
+
+        lines += [f"# HELP {p}_items_total Items counted by outcome.",
+                  f"# TYPE {p}_items_total counter"]
+        for name, n in sorted(self.counters.items()):
+            lines.append(f'{p}_items_total{{run="{run}",outcome="{_label_value(name)}"}} {n}')
+
+        lines += [f"# HELP {p}_worker_utilization Fraction of pool capacity spent on tasks.",
+                  f"# TYPE {p}_worker_utilization gauge"]
+        for name, pool in sorted(self.pools.items()):
+            lines.append(f'{p}_worker_utilization{{run="{run}",pool="{_label_value(name)}",'
+                         f'workers="{pool["workers"]}"}} {pool["utilization"]}')
+
+        lines += [f"# HELP {p}_run_duration_seconds Wall time of the last run.",
+                  f"# TYPE {p}_run_duration_seconds gauge",
+                  f'{p}_run_duration_seconds{{run="{run}"}} {time.perf_counter() - self._start:.6f}',
+                  f"# HELP {p}_last_run_timestamp_seconds Start time of the last run.",
+                  f"# TYPE {p}_last_run_timestamp_seconds gauge",
+                  f'{p}_last_run_timestamp_seconds{{run="{run}"}} {self.started.timestamp():.0f}']
+        return lines
+
+
+class NullMetrics:
+    """Drop-in for PipelineMetrics that records nothing."""
+
+    enabled = False
+    _NULL_CONTEXT = nullcontext()
+
+    def fresh(self) -> "NullMetrics":
+        return self
+
+    def stage(self, name: str):
+        return self._NULL_CONTEXT
+
+    def observe(self, stage: str, seconds: float):
+        pass
+
+    def timed_iter(self, items: Iterable[Any], stage: str) -> Iterable[Any]:
+        return items
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+    def add_read(self, stage: str, n: int):
+        pass
+
+    def add_written(self, stage: str, n: int):
+        pass
+
+    def busy_seconds(self, stage: str) -> float:
+        return 0.0
+
+    def record_pool(self, name: str, workers: int, wall_seconds: float, busy_seconds: float):
+        pass
+
+    def drain(self) -> None:
+        return None
+
+    def merge(self, snapshot: Optional[Dict[str, Any]]):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def _label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def save_run_metrics(metrics: PipelineMetrics, report_path: Optional[str],
+                     prometheus_path: Optional[str] = None):
+    """Write whichever outputs were requested; a no-op for NULL_METRICS."""
+    if not metrics.enabled:
+        return
+    if report_path:
+        metrics.write_report(report_path)
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
@@ -0,0 +1,189 @@
+"""
+KL Recycling Processing Manifest
+================================
+
+SQLite record of what `data_processor.py --process` has already done, so
+reruns only pay for new or changed source images and interrupted runs pick up
+where they stopped. Two tables back the manifest:
+
+- sources: source path -> (size, mtime_ns, content_hash), so unchanged
+           sources are recognized from filesystem metadata alone
+- images:  content_hash -> quality score, acceptance, processed path,
+           annotation path and split, written stage by stage
+
+An image is complete once it was rejected, or accepted and placed in a split,
+under the current quality settings. Anything short of that is redone; every
+stage is idempotent because output names derive from the content hash.
+"""
+
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessingManifest:
+    """Content-addressed manifest of processed images."""
+
+    def __init__(self, db_path: str, config_hash: str, commit_every: int = 64):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.config_hash = config_hash
+        self.commit_every = commit_every
+
+        self._pending = 0
+
+        self._conn = sqlite3.connect(str(self.db_path))
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS sources (
+                source_path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sources_hash ON sources (content_hash);
+            CREATE TABLE IF NOT EXISTS images (
+                content_hash TEXT PRIMARY KEY,
+                config_hash TEXT NOT NULL,
+                source_path TEXT NOT NULL,
+                material_type TEXT NOT NULL,
+                quality_score REAL NOT NULL,
+                accepted INTEGER NOT NULL,
+                processed_path TEXT,
+                annotation_path TEXT,
+                split TEXT
+            );
+        """)
+
+    @staticmethod
+    def _complete(row: Optional[sqlite3.Row]) -> bool:
+        if row is None:
+            return False
+        if not row['accepted']:
+            return True
+        return row['split'] is not None and os.path.exists(row['processed_path'])
+
+    def is_complete(self, source_path: Path) -> bool:
+        """True if an unchanged source was fully handled under the current settings."""
+        key = str(Path(source_path).resolve())
+        try:
+            stat = os.stat(key)
+        except OSError:
+            return False
+
+        row = self._conn.execute(
+            "SELECT i.accepted, i.processed_path, i.split FROM sources s "
+            "JOIN images i ON i.content_hash = s.content_hash AND i.config_hash = ? "
+            "WHERE s.source_path = ? AND s.size = ? AND s.mtime_ns = ?",
+            (self.config_hash, key, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        return self._complete(row)
+
+    def is_complete_hash(self, file_hash: str) -> bool:
+        """True if this content (possibly from another source path) is fully handled."""
+        row = self._conn.execute(
+            "SELECT accepted, processed_path, split FROM images WHERE content_hash = ? AND config_hash = ?",
+            (file_hash, self.config_hash)
+        ).fetchone()
+        return self._complete(row)
+
+    def record_source(self, source_path: Path, file_hash: str) -> Optional[str]:
+        """Register a source's current content; returns its previous hash if the content changed."""
+        key = str(Path(source_path).resolve())
+        stat = os.stat(key)
+
+        row = self._conn.execute(
+            "SELECT content_hash FROM sources WHERE source_path = ?", (key,)
+        ).fetchone()
+
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sources (source_path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+            (key, stat.st_size, stat.st_mtime_ns, file_hash)
+        )
+
+        if row is not None and row['content_hash'] != file_hash:
+            return row['content_hash']
+        return None
+
+    def retire(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        """Forget content no source refers to any more, returning its entry so outputs can be removed."""
+        referenced = self._conn.execute(
+            "SELECT 1 FROM sources WHERE content_hash = ? LIMIT 1", (file_hash,)
+        ).fetchone()
+        if referenced is not None:
+            return None
+
+        row = self._conn.execute("SELECT * FROM images WHERE content_hash = ?", (file_hash,)).fetchone()
+        if row is None:
+            return None
+
+        self._conn.execute("DELETE FROM images WHERE content_hash = ?", (file_hash,))
+        return dict(row)
+
+    def record_assessed(self, source_path: Path, file_hash: str, material_type: str,
+                        quality_score: float, accepted: bool):
+        """Start (or restart) an image's entry once its quality is known."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO images (content_hash, config_hash, source_path, material_type, "
+            "quality_score, accepted) VALUES (?, ?, ?, ?, ?, ?)",
+            (file_hash, self.config_hash, str(Path(source_path).resolve()), material_type,
+             float(quality_score), int(accepted))
+        )
+        self._tick()
+
+    def record_processed(self, file_hash: str, processed_path: str, annotation_path: Optional[str]):
+        """Record the processed copy and its annotation."""
+        self._conn.execute(
+            "UPDATE images SET processed_path = ?, annotation_path = ? WHERE content_hash = ?",
+            (processed_path, annotation_path, file_hash)
+        )
+        self._tick()
+
+    def record_split(self, file_hash: str, split: str):
+        """Record the split an image was placed in; this completes the entry."""
+        self._conn.execute("UPDATE images SET split = ? WHERE content_hash = ?", (split, file_hash))
+        self._tick()
+
+    def split_counts(self) -> Dict[str, Dict[str, int]]:
+        """
+        Completed images per material and split, including earlier runs. The
+        processing report uses them to show split sizes for the whole dataset;
+        assignment itself is by content hash and never reads them.
+        """
+        counts: Dict[str, Dict[str, int]] = {}
+        for row in self._conn.execute(
+            "SELECT material_type, split, COUNT(*) AS n FROM images "
+            "WHERE accepted = 1 AND split IS NOT NULL GROUP BY material_type, split"
+        ):
+            counts.setdefault(row['material_type'], {})[row['split']] = row['n']
+        return counts
+
+    def split_members(self) -> Dict[str, List[str]]:
+        """Absolute processed paths of completed images, per split."""
+        members: Dict[str, List[str]] = {}
+        for row in self._conn.execute(
+            "SELECT split, processed_path FROM images "
+            "WHERE accepted = 1 AND split IS NOT NULL AND processed_path IS NOT NULL"
+        ):
+            members.setdefault(row['split'], []).append(str(Path(row['processed_path']).resolve()))
+        return members
+
+    def _tick(self):
+        # Commit in small batches: an interruption loses at most a few idempotent steps
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self._conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
@@ -0,0 +1,110 @@
+"""
+KL Recycling Quality Metrics Cache
+==================================
+
+Persistent on-disk cache of image quality metrics shared by the processing and
+validation pipelines. Two tables back the cache:
+
+- files:   path -> (size, mtime_ns, content_hash), so unchanged files are
+           resolved from filesystem metadata alone
+- metrics: (content_hash, config_hash) -> serialized metrics, so copies of an
+           image share one entry and a quality_control change invalidates all
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data: bytes) -> str:
+    """Stable content hash of an image file's bytes."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    """Hash of every setting that influences the cached metrics."""
+    encoded = json.dumps(config, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+class QualityMetricsCache:
+    """SQLite-backed cache of quality metrics keyed by file identity and config."""
+
+    def __init__(self, db_path: str, config_hash: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.config_hash = config_hash
+
+        self.hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(str(self.db_path))
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS metrics (
+                content_hash TEXT NOT NULL,
+                config_hash TEXT NOT NULL,
+                metrics TEXT NOT NULL,
+                PRIMARY KEY (content_hash, config_hash)
+            );
+        """)
+
+    @staticmethod
+    def _key(path: Path) -> Tuple[str, os.stat_result]:
+        path = Path(path).resolve()
+        return str(path), path.stat()
+
+    def lookup(self, path: Path) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Return (content_hash, metrics) if the file is unchanged and scored under this config."""
+        key, stat = self._key(path)
+
+        row = self._conn.execute(
+            "SELECT m.content_hash, m.metrics FROM files f "
+            "JOIN metrics m ON m.content_hash = f.content_hash AND m.config_hash = ? "
+            "WHERE f.path = ? AND f.size = ? AND f.mtime_ns = ?",
+            (self.config_hash, key, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return row[0], json.loads(row[1])
+
+    def store(self, path: Path, file_hash: str, metrics: Dict[str, Any]):
+        """Record freshly computed metrics for a file."""
+        self.link(path, file_hash)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO metrics (content_hash, config_hash, metrics) VALUES (?, ?, ?)",
+            (file_hash, self.config_hash, json.dumps(metrics))
+        )
+
+    def link(self, path: Path, file_hash: str):
+        """Register a path (e.g. a processed copy) whose content is already known."""
+        key, stat = self._key(path)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+            (key, stat.st_size, stat.st_mtime_ns, file_hash)
+        )
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+        logger.info(f"Quality cache: {self.hits} hits, {self.misses} misses ({self.db_path})")
@@ -0,0 +1,119 @@
+"""
+KL Recycling Quality Metrics Kernel
+===================================
+
+Low-allocation computation of the per-image statistics behind the quality
+score: brightness, RMS contrast, Laplacian variance (blurriness) and mean
+saturation.
+
+Intermediate images (gray, Laplacian, HSV) are written into scratch buffers
+owned by the kernel and reused across calls, and every statistic comes from a
+single OpenCV reduction (integer accumulation for uint8 planes, float32
+Laplacian). One kernel per worker process keeps steady-state allocation at
+zero regardless of how many images it scores.
+
+Images are processed in horizontal strips of `strip_rows` rows. Each strip's
+gray plane carries a one-row halo above and below so the 3x3 Laplacian of the
+strip core is identical to the full-image Laplacian, and per-strip counts,
+means and squared-deviation sums are merged exactly (Chan et al.). Scratch
+memory is therefore bounded by strip_rows x width instead of the image size.
+"""
+
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+
+
+class _Moments:
+    """Count, mean and sum of squared deviations, mergeable across strips."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def merge(self, plane: np.ndarray):
+        mean, std = cv2.meanStdDev(plane)
+        count = plane.size
+        mean, m2 = float(mean[0, 0]), float(std[0, 0]) ** 2 * count
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / self.count if self.count else 0.0
+
+
+class QualityKernel:
+    """Fused, strip-tiled quality statistics with reusable scratch buffers."""
+
+    def __init__(self, strip_rows: int = 256):
+        # 0 processes the whole image as a single strip
+        self.strip_rows = strip_rows
+        self._buffers: Dict[str, np.ndarray] = {}
+
+    def __getstate__(self):
+        # Scratch buffers are per process; never ship them to pool workers
+        return {'strip_rows': self.strip_rows, '_buffers': {}}
+
+    def _scratch(self, name: str, shape: Tuple[int, ...], dtype) -> np.ndarray:
+        """Contiguous view of a named buffer, grown only when an image is larger than any before."""
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype=dtype)
+            self._buffers[name] = buffer
+
+        return buffer[:size].reshape(shape)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes currently held in scratch buffers."""
+        return sum(b.nbytes for b in self._buffers.values())
+
+    def compute(self, image: np.ndarray) -> Tuple[float, float, float, float]:
+        """
+        Return (brightness, contrast, blurriness, saturation) for a BGR image.
+
+        Brightness, contrast and saturation are normalized to [0, 1];
+        blurriness is the raw Laplacian variance.
+        """
+        height, width = image.shape[:2]
+        strip_rows = min(self.strip_rows or height, height)
+
+        gray_moments = _Moments()
+        laplacian_moments = _Moments()
+        saturation_sum = 0.0
+
+        for top in range(0, height, strip_rows):
+            bottom = min(top + strip_rows, height)
+
+            # One halo row on each interior edge; image edges keep OpenCV's reflect border
+            halo_top, halo_bottom = max(top - 1, 0), min(bottom + 1, height)
+            core = slice(top - halo_top, bottom - halo_top)
+
+            gray = self._scratch('gray', (halo_bottom - halo_top, width), np.uint8)
+            cv2.cvtColor(image[halo_top:halo_bottom], cv2.COLOR_BGR2GRAY, dst=gray)
+            gray_moments.merge(gray[core])
+
+            # Laplacian of uint8 input is integral and bounded, so float32 is exact
+            laplacian = self._scratch('laplacian', gray.shape, np.float32)
+            cv2.Laplacian(gray, cv2.CV_32F, dst=laplacian)
+            laplacian_moments.merge(laplacian[core])
+
+            hsv = self._scratch('hsv', (bottom - top, width, 3), np.uint8)
+            cv2.cvtColor(image[top:bottom], cv2.COLOR_BGR2HSV, dst=hsv)
+            saturation_sum += cv2.mean(hsv)[1] * (bottom - top) * width
+
+        return (
+            gray_moments.mean / 255.0,
+            gray_moments.variance ** 0.5 / 255.0,
+            laplacian_moments.variance,
+            saturation_sum / (height * width) / 255.0,
+        )
@@ -0,0 +1,191 @@
+"""
+KL Recycling Quality Metrics Table
+==================================
+
+Columnar storage for per-image quality metrics: one numpy array per metric
+field plus the image path and content hash. Scoring and report statistics run
+as vectorized passes over the columns, and the table round-trips through
+Parquet (data/metrics/quality.parquet) so thresholds can be re-tuned without
+touching the images again. Streaming runs flush fixed-size chunks through
+QualityTableWriter so the table never has to fit in memory. Incremental runs
+only assess new or changed images, so their writer merges the rows of the
+previous table back in, keyed by content hash.
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class QualityTable:
+    """Growable columnar table of quality metrics."""
+
+    def __init__(self, dtypes: Dict[str, Any], capacity: int = 1024):
+        self.dtypes = dtypes
+        self.paths: List[str] = []
+        self.content_hashes: List[str] = []
+        self._arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, path: Path, file_hash: str, row: Dict[str, Any]):
+        """Add one image's metrics; columns grow by doubling."""
+        if self._size == len(next(iter(self._arrays.values()))):
+            for name, array in self._arrays.items():
+                grown = np.empty(max(1, 2 * len(array)), dtype=array.dtype)
+                grown[:self._size] = array[:self._size]
+                self._arrays[name] = grown
+
+        for name, array in self._arrays.items():
+            array[self._size] = row[name]
+
+        self.paths.append(str(path))
+        self.content_hashes.append(file_hash)
+        self._size += 1
+
+    def clear(self):
+        """Drop all rows, keeping the allocated column capacity."""
+        self.paths = []
+        self.content_hashes = []
+        self._size = 0
+
+    def column(self, name: str) -> np.ndarray:
+        """View of one metric column."""
+        return self._arrays[name][:self._size]
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        return {name: self.column(name) for name in self._arrays}
+
+    def summary(self, name: str) -> Dict[str, float]:
+        """Mean/min/max/std of a column in one vectorized pass each."""
+        values = self.column(name)
+        if not len(values):
+            return {'mean': 0.0, 'min': 0.0, 'max': 0.0, 'std': 0.0}
+
+        return {
+            'mean': float(values.mean()),
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'std': float(values.std()),
+        }
+
+    def write_parquet(self, path: str):
+        """Persist the table as Parquet (requires pandas with pyarrow or fastparquet)."""
+        import pandas as pd
+
+        frame = pd.DataFrame({'image_path': self.paths, 'content_hash': self.content_hashes,
+                              **self.columns()})
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            frame.to_parquet(path, index=False)
+        except ImportError as e:
+            logger.warning(f"Parquet engine unavailable, skipping {path}: {e}")
+            return
+
+        logger.info(f"Quality table ({len(frame)} rows) saved to {path}")
+
+    @classmethod
+    def read_parquet(cls, path: str, dtypes: Dict[str, Any]) -> "QualityTable":
+        """Load a table written by write_parquet."""
+        import pandas as pd
+
+        frame = pd.read_parquet(path)
+        table = cls(dtypes, capacity=max(1, len(frame)))
+        table.paths = frame['image_path'].tolist()
+        table.content_hashes = frame['content_hash'].tolist()
+        for name, dtype in dtypes.items():
+            if name not in frame:
+                # Written before this metric existed
+                logger.warning(f"{path} has no '{name}' column; filling with zeros")
+                table._arrays[name][:len(frame)] = 0
+                continue
+            table._arrays[name][:len(frame)] = frame[name].to_numpy(dtype=dtype)
+        table._size = len(frame)
+        return table
+
+
+class QualityTableWriter:
+    """
+    Appends QualityTable chunks to a single Parquet file as row groups.
+
+    With merge=True, rows of the existing file are carried over on close
+    unless this run wrote a row for the same content hash or image path.
+    """
+
+    def __init__(self, path: str, merge: bool = False):
+        self.path = Path(path)
+        self.merge = merge
+        self.rows = 0
+        self._temp_path = self.path.with_suffix('.parquet.tmp')
+        self._writer = None
+        self._disabled = False
+        self._written_hashes = set()
+        self._written_paths = set()
+
+    def write(self, table: QualityTable):
+        """Append the table's rows; the caller may clear() the table afterwards."""
+        if not len(table) or self._disabled:
+            return
+
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            logger.warning(f"pyarrow unavailable, not writing {self.path}: {e}")
+            self._disabled = True
+            return
+
+        chunk = pa.table({'image_path': table.paths, 'content_hash': table.content_hashes,
+                          **table.columns()})
+
+        if self._writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = pq.ParquetWriter(str(self._temp_path), chunk.schema)
+
+        self._writer.write_table(chunk)
+        self.rows += len(table)
+        if self.merge:
+            self._written_hashes.update(h for h in table.content_hashes if h)
+            self._written_paths.update(table.paths)
+
+    def _carry_over(self):
+        """Append the previous file's rows that this run did not replace."""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        schema = self._writer.schema
+        hashes = pa.array(list(self._written_hashes), type=pa.string())
+        paths = pa.array(list(self._written_paths), type=pa.string())
+        kept = 0
+        try:
+            for batch in pq.ParquetFile(str(self.path)).iter_batches():
+                chunk = pa.Table.from_batches([batch])
+                replaced = pc.or_(pc.is_in(chunk['content_hash'], value_set=hashes),
+                                  pc.is_in(chunk['image_path'], value_set=paths))
+                chunk = chunk.filter(pc.invert(replaced)).select(schema.names).cast(schema)
+                self._writer.write_table(chunk)
+                kept += len(chunk)
+        except (KeyError, ValueError, pa.ArrowException) as e:
+            # Written with other columns; rows assessed before are dropped rather than mangled
+            logger.warning(f"Could not merge previous rows of {self.path}: {e}")
+        self.rows += kept
+
+    def close(self):
+        """Finish the file, merging in earlier rows if asked to, and move it into place."""
+        if self._writer is None:
+            return
+
+        if self.merge and self.path.exists():
+            self._carry_over()
+        self._writer.close()
+        os.replace(self._temp_path, self.path)
+        logger.info(f"Quality table ({self.rows} rows) saved to {self.path}")
@@ -0,0 +1,121 @@
+"""
+KL Recycling Reference Coin Detector
+====================================
+
+Classical detector for the reference coin photographed next to the scrap, used
+for the quality score's has_reference_object term and for pixel-to-inch
+calibration.
+
+Images are downscaled to a fixed working width, converted to gray and
+median-blurred, then searched with a Hough gradient circle transform limited
+to coin-sized radii (a fraction of the short image side, so large round scrap
+such as pipe ends is ignored). A low accumulator threshold keeps faint coins,
+so on textured scrap it also fires on arcs of rust, gravel and scratches;
+each candidate, strongest first, is therefore verified against the coin's rim:
+the face just inside the circle must differ from the surround just outside it,
+with the same sign, nearly all the way round. The first verified circle is
+returned in full-resolution coordinates together with the pixels-per-inch
+scale implied by the coin's physical diameter. At the default 320 px working
+width this takes about a millisecond per image.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+# US quarter
+DEFAULT_COIN_DIAMETER_INCHES = 0.955
+
+# Rim check: radii (as a fraction of the candidate's) sampled for the coin face
+# and its surround, at RIM_SAMPLES angles
+FACE_RADIUS = 0.75
+SURROUND_RADIUS = 1.3
+RIM_SAMPLES = 64
+_RIM_ANGLES = np.linspace(0.0, 2.0 * np.pi, RIM_SAMPLES, endpoint=False)
+_RIM_COS, _RIM_SIN = np.cos(_RIM_ANGLES), np.sin(_RIM_ANGLES)
+
+
+@dataclass
+class ReferenceDetection:
+    """Detected reference coin in full-resolution pixel coordinates."""
+    center_x: float
+    center_y: float
+    radius: float
+    pixels_per_inch: float
+
+
+class ReferenceCoinDetector:
+    """Hough-circle reference coin detector on a downscaled gray image, with a rim check per candidate."""
+
+    def __init__(self, diameter_inches: float = DEFAULT_COIN_DIAMETER_INCHES, detect_width: int = 320,
+                 min_radius_fraction: float = 0.015, max_radius_fraction: float = 0.06,
+                 accumulator_threshold: int = 20, rim_contrast: float = 12.0, rim_support: float = 0.7,
+                 max_candidates: int = 10):
+        self.diameter_inches = diameter_inches
+        self.detect_width = detect_width
+        self.min_radius_fraction = min_radius_fraction
+        self.max_radius_fraction = max_radius_fraction
+        self.accumulator_threshold = accumulator_threshold
+        self.rim_contrast = rim_contrast
+        self.rim_support = rim_support
+        self.max_candidates = max_candidates
+
+    def detect(self, image: np.ndarray, full_width: Optional[int] = None) -> Optional[ReferenceDetection]:
+        """
+        Find the reference coin in a BGR (or gray) image.
+
+        `image` may be a reduced-resolution decode; full_width is the width of
+        the original image, and the result is scaled back to it.
+        """
+        height, width = image.shape[:2]
+        full_scale = (full_width or width) / width
+
+        # Work at detect_width; never upscale
+        scale = min(1.0, self.detect_width / width)
+        if scale < 1.0:
+            image = cv2.resize(image, (self.detect_width, max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        gray = cv2.medianBlur(gray, 5)
+
+        short_side = min(gray.shape)
+        min_radius = max(3, int(self.min_radius_fraction * short_side))
+        max_radius = max(min_radius + 1, int(round(self.max_radius_fraction * short_side)))
+
+        circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, dp=1, minDist=2 * min_radius,
+                                   param1=100, param2=self.accumulator_threshold,
+                                   minRadius=min_radius, maxRadius=max_radius)
+        if circles is None:
+            return None
+
+        # Circles come back strongest first
+        candidates = circles[0, :self.max_candidates]
+        verified = next((c for c in candidates if self._rim_support(gray, *c) >= self.rim_support), None)
+        if verified is None:
+            return None
+
+        x, y, radius = (float(v) * full_scale / scale for v in verified)
+        return ReferenceDetection(
+            center_x=x,
+            center_y=y,
+            radius=radius,
+            pixels_per_inch=2.0 * radius / self.diameter_inches,
+        )
+
+    def _rim_support(self, gray: np.ndarray, x: float, y: float, radius: float) -> float:
+        """Fraction of rim angles where face and surround differ by rim_contrast in the dominant direction."""
+        height, width = gray.shape
+
+        def ring(fraction: float) -> np.ndarray:
+            xs = np.clip(np.rint(x + fraction * radius * _RIM_COS).astype(np.intp), 0, width - 1)
+            ys = np.clip(np.rint(y + fraction * radius * _RIM_SIN).astype(np.intp), 0, height - 1)
+            return gray[ys, xs].astype(np.float32)
+
+        # A coin may be lighter or darker than what it lies on, but not both
+        contrast = ring(FACE_RADIUS) - ring(SURROUND_RADIUS)
+        if np.median(contrast) < 0:
+            contrast = -contrast
+        return float(np.mean(contrast >= self.rim_contrast))
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+KL Recycling Sharded Dataset
+============================
+
+A split packed into tar shards of about 256 MB, so training reads large
+sequential blocks instead of opening a JSON file and an image per sample:
+
+- shard-00000.tar, ...: per sample, <key>.jpg (the original encoded bytes)
+  followed by <key>.json (its annotation). Plain tar, so shards can be
+  inspected or unpacked with standard tools.
+- index.json: sample count and, per shard, the byte offset and size of every
+  sample's image and annotation, so any sample can be read with one seek.
+
+Samples are shuffled once when written, so a shard mixes materials.
+ShardedDataset is an IterableDataset. Each epoch it shuffles the shard order
+and gives every DataLoader worker its own shards. Each worker reads its
+shards front to back through a large buffer and mixes samples through a small
+shuffle buffer. When there are fewer shards than workers, every worker reads
+only its share of each shard's samples, using the index.
+
+Writing only needs the annotation store and the split directory; torch is
+only needed to train from the shards.
+
+Usage:
+    python scripts/shard_dataset.py data/scrap_dataset/train
+    python scripts/shard_dataset.py data/scrap_dataset/val --output data/scrap_dataset/shards/val --shard-mb 128
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import tarfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from annotation_store import DEFAULT_ANNOTATION_STORE, load_annotations
+from validation_log import write_json_atomic
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    IterableDataset = object
+
+    def get_worker_info():
+        return None
+
+logger = logging.getLogger(__name__)
+
+SHARD_FORMAT_VERSION = 1
+DEFAULT_SHARD_BYTES = 256 << 20
+INDEX_NAME = "index.json"
+
+# Read buffer per open shard; seeks between a sample's members stay inside it
+READ_BUFFER_BYTES = 8 << 20
+
+
+def default_shard_directory(split_dir: Path) -> Path:
+    """<dataset>/shards/<split> for a split directory <dataset>/<split>."""
+    split_dir = Path(split_dir)
+    return split_dir.parent / "shards" / split_dir.name
+
+
+class ShardWriter:
+    """Appends samples to tar shards, starting a new shard once one reaches shard_bytes."""
+
+    def __init__(self, output_dir: Path, shard_bytes: int = DEFAULT_SHARD_BYTES):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_bytes = shard_bytes
+        self.shards: List[Dict[str, Any]] = []
+        self._tar: Optional[tarfile.TarFile] = None
+        self._current: Optional[Dict[str, Any]] = None
+        self._count = 0
+        self.index: Optional[Dict[str, Any]] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            if self.index is None:
+                self.close()
+        elif self._tar is not None:
+            self._tar.close()
+            os.remove(self._temp_path(self._current['name']))
+        return False
+
+    def _temp_path(self, name: str) -> Path:
+        return self.output_dir / (name + '.tmp')
+
+    def _add_member(self, name: str, data: bytes) -> Tuple[int, int]:
+        """Append one member and return (data offset, size) within the shard."""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        # addfile leaves the offset after the data, padded to a 512-byte block
+        padded = -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        return self._tar.offset - padded, len(data)
+
+    def add(self, image_bytes: bytes, suffix: str, annotation: Dict[str, Any]):
+        if self._tar is not None and self._tar.offset + len(image_bytes) > self.shard_bytes:
+            self._finish_shard()
+        if self._tar is None:
+            name = f"shard-{len(self.shards):05d}.tar"
+            self._current = {'name': name, 'samples': []}
+            self._tar = tarfile.open(self._temp_path(name), 'w', format=tarfile.USTAR_FORMAT)
+
+        key = f"{self._count:08d}"
+        image_offset, image_size = self._add_member(key + suffix, image_bytes)
+        json_offset, json_size = self._add_member(key + '.json', json.dumps(annotation, default=str).encode())
+        self._current['samples'].append([image_offset, image_size, json_offset, json_size])
+        self._count += 1
+
+    def _finish_shard(self):
+        name = self._current['name']
+        self._tar.close()
+        self._tar = None
+        os.replace(self._temp_path(name), self.output_dir / name)
+        self._current['bytes'] = (self.output_dir / name).stat().st_size
+        self.shards.append(self._current)
+        logger.info(f"Wrote {name}: {len(self._current['samples'])} samples, "
+                    f"{self._current['bytes'] / (1 << 20):.1f} MB")
+        self._current = None
+
+    def close(self) -> Dict[str, Any]:
+        """Finish the last shard, write the index and remove shards left from an earlier write."""
+        if self._tar is not None:
+            self._finish_shard()
+
+        self.index = index = {
+            'version': SHARD_FORMAT_VERSION,
+            'samples': self._count,
+            'shard_bytes': self.shard_bytes,
+            'created': time.time(),
+            'shards': self.shards,
+        }
+        write_json_atomic(self.output_dir / INDEX_NAME, index, indent=None)
+
+        current = {shard['name'] for shard in self.shards}
+        for stale in self.output_dir.glob("shard-*.tar"):
+            if stale.name not in current:
+                stale.unlink()
+        return index
+
+
+def write_shards(split_dir: Path, output_dir: Optional[Path] = None, shard_bytes: int = DEFAULT_SHARD_BYTES,
+                 annotation_store: str = DEFAULT_ANNOTATION_STORE, seed: int = 0) -> Dict[str, Any]:
+    """Pack every annotated image of a split directory into shards; returns the index."""
+    split_dir = Path(split_dir)
+    output_dir = Path(output_dir) if output_dir else default_shard_directory(split_dir)
+
+    annotations = load_annotations(split_dir, annotation_store)
+    if not annotations:
+        raise ValueError(f"No annotations found for {split_dir}")
+    # Mixed materials in every shard, so shard-level shuffling is enough at read time
+    random.Random(seed).shuffle(annotations)
+
+    start = time.perf_counter()
+    skipped = 0
+    with ShardWriter(output_dir, shard_bytes) as writer:
+        for annotation in annotations:
+            image_path = Path(annotation.pop('image_path'))
+            try:
+                image_bytes = image_path.read_bytes()
+            except OSError as e:
+                logger.warning(f"Skipping {image_path}: {e}")
+                skipped += 1
+                continue
+            annotation.setdefault('filename', image_path.name)
+            writer.add(image_bytes, image_path.suffix.lower(), annotation)
+        index = writer.close()
+
+    total_bytes = sum(shard['bytes'] for shard in index['shards'])
+    logger.info(f"Packed {index['samples']} samples ({skipped} skipped) into {len(index['shards'])} shards, "
+                f"{total_bytes / (1 << 20):.1f} MB in {time.perf_counter() - start:.1f}s -> {output_dir}")
+    return index
+
+
+def read_index(shard_dir: Path) -> Dict[str, Any]:
+    with open(Path(shard_dir) / INDEX_NAME) as f:
+        index = json.load(f)
+    if index.get('version') != SHARD_FORMAT_VERSION:
+        raise ValueError(f"Unsupported shard format version {index.get('version')} in {shard_dir}")
+    return index
+
+
+class ShardedDataset(IterableDataset):
+    """
+    Streams samples from a shard directory.
+
+    task="weight_prediction" yields (transform(image), tensor([weight]))
+    like ScrapMetalDataset; task="annotations" yields (image, annotation)
+    for evaluation code. Call set_epoch before each epoch to reshuffle.
+    """
+
+    def __init__(self, shard_dir: Path, transform=None, task: str = "weight_prediction",
+                 shuffle: bool = True, shuffle_buffer: int = 256, seed: int = 0):
+        if task not in ("weight_prediction", "annotations"):
+            raise ValueError(f"Unsupported task for sharded data: {task}")
+        self.shard_dir = Path(shard_dir)
+        self.transform = transform
+        self.task = task
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer if shuffle else 0
+        self.seed = seed
+        self.epoch = 0
+
+        self.index = read_index(self.shard_dir)
+        logger.info(f"Loaded shard index for {self.index['samples']} samples in "
+                    f"{len(self.index['shards'])} shards from {self.shard_dir}")
+
+    def __len__(self):
+        return self.index['samples']
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _assignment(self, worker_id: int, num_workers: int) -> List[Tuple[Dict[str, Any], List[int]]]:
+        """(shard, sample positions) this worker reads this epoch, in read order."""
+        shards = list(self.index['shards'])
+        if self.shuffle:
+            # Same seed in every worker, so the workers agree on the permutation
+            random.Random(self.seed + self.epoch).shuffle(shards)
+
+        if len(shards) >= num_workers:
+            return [(shard, list(range(len(shard['samples'])))) for shard in shards[worker_id::num_workers]]
+
+        # Fewer shards than workers: split each shard's samples instead
+        return [(shard, list(range(worker_id, len(shard['samples']), num_workers))) for shard in shards]
+
+    def _read(self, assignment: List[Tuple[Dict[str, Any], List[int]]]) -> Iterator[Tuple[bytes, bytes]]:
+        for shard, positions in assignment:
+            with open(self.shard_dir / shard['name'], 'rb', buffering=READ_BUFFER_BYTES) as f:
+                for position in positions:
+                    image_offset, image_size, json_offset, json_size = shard['samples'][position]
+                    # Members are consecutive, so these seeks stay within the read buffer
+                    f.seek(image_offset)
+                    image_bytes = f.read(image_size)
+                    f.seek(json_offset)
+                    yield image_bytes, f.read(json_size)
+
+    def _shuffled(self, samples: Iterator[Tuple[bytes, bytes]],
+                  rng: random.Random) -> Iterator[Tuple[bytes, bytes]]:
+        """Approximate shuffle through a buffer of shuffle_buffer encoded samples."""
+        if not self.shuffle_buffer:
+            yield from samples
+            return
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        rng = random.Random((self.seed + self.epoch) * 1000003 + worker_id)
+
+        for image_bytes, json_bytes in self._shuffled(self._read(self._assignment(worker_id, num_workers)), rng):
+            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            annotation = json.loads(json_bytes)
+
+            if self.task == "annotations":
+                yield (self.transform(image) if self.transform else image), annotation
+                continue
+
+            import torch
+
+            if self.transform:
+                image = self.transform(image)
+            yield image, torch.tensor([annotation['weight_pounds']], dtype=torch.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KL Recycling Dataset Sharder")
+    parser.add_argument("split_dir", help="Processed split directory, e.g. data/scrap_dataset/train")
+    parser.add_argument("--output", help="Shard directory (default: <dataset>/shards/<split>)")
+    parser.add_argument("--shard-mb", type=int, default=DEFAULT_SHARD_BYTES >> 20, help="Target shard size in MB")
+    parser.add_argument("--annotation-store", default=DEFAULT_ANNOTATION_STORE, help="Annotation store path")
+    parser.add_argument("--seed", type=int, default=0, help="Sample order shuffle seed")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    index = write_shards(Path(args.split_dir), Path(args.output) if args.output else None,
+                         args.shard_mb << 20, args.annotation_store, args.seed)
+    print(f"{index['samples']} samples in {len(index['shards'])} shards")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+KL Recycling Tensor Cache
+=========================
+
+Training splits preprocessed once into memory-mapped uint8 arrays, so weight
+prediction epochs read slices instead of decoding and resizing every JPEG
+again:
+
+- images.u8:    N x height x width x 3 RGB pixels, already resized and cropped
+- targets.f4:   N x 1 float32 weights
+- meta.json:    key, shape and the transform the pixels were produced with
+
+A cached split is keyed by its contents (image path, content hash and
+weight of every sample) and the transform config, so adding an image,
+relabelling a weight or changing input_size builds a new entry; older entries
+of the same split are removed. Entries are built in a temporary directory and
+renamed into place, so an interrupted build is never read.
+
+Normalization is not baked in: batches stay uint8 until they reach the
+device, where normalize_batch converts, permutes and normalizes the whole
+batch at once. That keeps the cache four times smaller than float32 and the
+host-to-device copy four times cheaper.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Installed in each pool worker by _init_preprocess_worker
+_worker_load_image: Optional[Callable[[int], Image.Image]] = None
+_worker_images: Optional[np.memmap] = None
+_worker_input_size: Union[int, Tuple[int, int]] = 224
+
+
+def output_shape(input_size: Union[int, Sequence[int]]) -> Tuple[int, int]:
+    """(height, width) of a preprocessed image."""
+    if isinstance(input_size, (list, tuple)):
+        return int(input_size[0]), int(input_size[1])
+    return int(input_size), int(input_size)
+
+
+def resize_and_crop(image: Image.Image, input_size: Union[int, Sequence[int]]) -> np.ndarray:
+    """
+    uint8 RGB pixels as transforms.Resize(input_size) followed by
+    transforms.CenterCrop(input_size) would produce them: an int scales the
+    short side and crops the center square, a (height, width) pair resizes
+    to exactly that.
+    """
+    height, width = output_shape(input_size)
+    if isinstance(input_size, (list, tuple)):
+        resized = image.resize((width, height), Image.BILINEAR)
+    else:
+        w, h = image.size
+        size = int(input_size)
+        if w <= h:
+            new_w, new_h = size, int(size * h / w)
+        else:
+            new_w, new_h = int(size * w / h), size
+        resized = image.resize((new_w, new_h), Image.BILINEAR)
+        top = int(round((new_h - height) / 2.0))
+        left = int(round((new_w - width) / 2.0))
+        resized = resized.crop((left, top, left + width, top + height))
+    return np.asarray(resized.convert('RGB'), dtype=np.uint8)
+
+
+def normalize_batch(images, device, mean: Sequence[float] = IMAGENET_MEAN,
+                    std: Sequence[float] = IMAGENET_STD):
+    """
+    uint8 NHWC batch from the cache -> normalized float NCHW batch on device.
+    The copy happens while the batch is still uint8; conversion runs there.
+    """
+    import torch
+
+    images = images.to(device, non_blocking=True).permute(0, 3, 1, 2).float().div_(255.0)
+    mean = torch.tensor(mean, dtype=images.dtype, device=device).view(1, -1, 1, 1)
+    std = torch.tensor(std, dtype=images.dtype, device=device).view(1, -1, 1, 1)
+    return images.sub_(mean).div_(std)
+
+
+def _preprocess_into(images: np.ndarray, indices: Iterable[int], load_image: Callable[[int], Image.Image],
+                     input_size: Union[int, Tuple[int, int]]):
+    """Decode, resize and crop samples straight into their rows of the array."""
+    for index in indices:
+        images[index] = resize_and_crop(load_image(index), input_size)
+
+
+def _init_preprocess_worker(load_image: Callable[[int], Image.Image], images_path: str,
+                            shape: Tuple[int, ...], input_size: Union[int, Tuple[int, int]]):
+    """Install the image loader and open the entry being built in this pool worker."""
+    global _worker_load_image, _worker_images, _worker_input_size
+    _worker_load_image = load_image
+    _worker_images = np.memmap(images_path, dtype=np.uint8, mode='r+', shape=shape)
+    _worker_input_size = input_size
+
+
+def _preprocess_worker(indices: List[int]) -> int:
+    _preprocess_into(_worker_images, indices, _worker_load_image, _worker_input_size)
+    _worker_images.flush()
+    return len(indices)
+
+
+class CachedSplit:
+    """
+    Map-style dataset over one cache entry. An index returns one
+    (image uint8 HWC, target float32[1]) pair; a list of indices returns the
+    whole batch from one sorted slice of the maps, for use with a
+    BatchSampler and DataLoader(batch_size=None).
+    """
+
+    def __init__(self, directory: Path, meta: Dict[str, Any]):
+        self.directory = Path(directory)
+        self.meta = meta
+        self.shape = tuple(meta['shape'])
+        self._pid = None
+        self._images: Optional[np.memmap] = None
+        self._targets: Optional[np.memmap] = None
+
+    def __getstate__(self):
+        # Maps are per process; DataLoader workers reopen them on first use
+        state = self.__dict__.copy()
+        state.update(_pid=None, _images=None, _targets=None)
+        return state
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._images = np.memmap(self.directory / "images.u8", dtype=np.uint8, mode='r', shape=self.shape)
+        self._targets = np.memmap(self.directory / "targets.f4", dtype=np.float32, mode='r',
+                                  shape=(self.shape[0], 1))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        if self._pid != os.getpid():
+            self._open()
+        if isinstance(idx, (list, tuple, np.ndarray)):
+            # Sorted reads walk the file forwards; order within a batch does not matter
+            idx = np.sort(np.asarray(idx, dtype=np.int64))
+        return np.array(self._images[idx]), np.array(self._targets[idx])
+
+
+class TensorCache:
+    """Preprocessed training splits under root, one directory per (split, key)."""
+
+    def __init__(self, root: str = "data/cache/tensors", workers: int = 0):
+        self.root = Path(root)
+        self.workers = workers or os.cpu_count() or 1
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(samples: Iterable[Tuple[str, Optional[str], float]], transform: Dict[str, Any]) -> str:
+        """Digest of (image_path, content_hash, weight) for every sample plus the transform config."""
+        digest = hashlib.sha256(json.dumps({'version': CACHE_VERSION, 'transform': transform},
+                                           sort_keys=True).encode())
+        for image_path, content_hash, weight in samples:
+            if not content_hash:
+                # No hash recorded: fall back to size and mtime
+                try:
+                    stat = os.stat(image_path)
+                    content_hash = f"{stat.st_size}:{stat.st_mtime_ns}"
+                except OSError:
+                    content_hash = "missing"
+            digest.update(f"{image_path}\0{content_hash}\0{float(weight)!r}\n".encode())
+        return digest.hexdigest()[:20]
+
+    def load_or_build(self, name: str, samples: List[Tuple[str, Optional[str], float]],
+                      load_image: Callable[[int], Image.Image],
+                      input_size: Union[int, Sequence[int]]) -> CachedSplit:
+        """
+        The cached split for these samples, building it first if needed.
+        load_image(i) must return sample i as a PIL image; it runs in pool
+        workers, so it has to be picklable (a bound method of a dataset is).
+        """
+        input_size = list(input_size) if isinstance(input_size, (list, tuple)) else int(input_size)
+        transform = {'resize': 'bilinear', 'center_crop': True, 'input_size': input_size}
+        key = self.key(samples, transform)
+        directory = self.root / f"{name}-{key}"
+
+        meta = self._read_meta(directory)
+        if meta is None:
+            meta = self._build(directory, key, samples, load_image, input_size, transform)
+            self._remove_stale(name, keep=directory)
+        else:
+            logger.info(f"Tensor cache hit for {name}: {meta['shape'][0]} samples in {directory}")
+        return CachedSplit(directory, meta)
+
+    @staticmethod
+    def _read_meta(directory: Path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(directory / "meta.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _build(self, directory: Path, key: str, samples: List[Tuple[str, Optional[str], float]],
+               load_image: Callable[[int], Image.Image], input_size: Union[int, List[int]],
+               transform: Dict[str, Any]) -> Dict[str, Any]:
+        height, width = output_shape(input_size)
+        shape = (len(samples), height, width, 3)
+        building = directory.with_name(f"{directory.name}.tmp-{os.getpid()}")
+        shutil.rmtree(building, ignore_errors=True)
+        building.mkdir(parents=True)
+
+        logger.info(f"Building tensor cache for {len(samples)} samples at {height}x{width} in {directory}")
+        start = time.perf_counter()
+
+        images_path = building / "images.u8"
+        with open(images_path, 'wb') as f:
+            f.truncate(int(np.prod(shape)))
+        targets = np.memmap(building / "targets.f4", dtype=np.float32, mode='w+', shape=(len(samples), 1))
+        targets[:, 0] = [weight for _, _, weight in samples]
+        targets.flush()
+        del targets
+
+        indices = list(range(len(samples)))
+        workers = min(self.workers, max(1, len(samples) // 64))
+        size = input_size if isinstance(input_size, int) else tuple(input_size)
+        if workers > 1:
+            chunk = max(1, len(samples) // (workers * 8))
+            chunks = [indices[i:i + chunk] for i in range(0, len(indices), chunk)]
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_preprocess_worker,
+                                     initargs=(load_image, str(images_path), shape, size)) as executor:
+                for _ in executor.map(_preprocess_worker, chunks):
+                    pass
+        else:
+            images = np.memmap(images_path, dtype=np.uint8, mode='r+', shape=shape)
+            _preprocess_into(images, indices, load_image, size)
+            images.flush()
+            del images
+
+        meta = {'key': key, 'shape': list(shape), 'transform': transform, 'dtype': 'uint8',
+                'created': time.time()}
+        with open(building / "meta.json", 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        try:
+            os.replace(building, directory)
+        except OSError:
+            # Another process finished the same entry first; use theirs
+            shutil.rmtree(building, ignore_errors=True)
+
+        elapsed = time.perf_counter() - start
+        rate = len(samples) / elapsed if elapsed else 0.0
+        logger.info(f"Tensor cache built in {elapsed:.1f}s ({rate:.0f} samples/sec, "
+                    f"{np.prod(shape) / (1 << 20):.0f} MB)")
+        return self._read_meta(directory) or meta
+
+    def _remove_stale(self, name: str, keep: Path):
+        """Drop older entries of the same split; they can never match again."""
+        for directory in self.root.glob(f"{name}-*"):
+            if directory != keep and directory.is_dir() and '.tmp-' not in directory.name:
+                shutil.rmtree(directory, ignore_errors=True)
+                logger.info(f"Removed stale tensor cache {directory.name}")
+
+
+def tensor_cache_from_config(dataset_config: Dict[str, Any]) -> Optional[TensorCache]:
+    """TensorCache from the dataset.tensor_cache config block, or None if disabled."""
+    settings = dataset_config.get('tensor_cache', {})
+    if not settings.get('enabled', False):
+        return None
+    return TensorCache(settings.get('path', "data/cache/tensors"), int(settings.get('workers', 0)))
@@ -0,0 +1,349 @@
+"""
+KL Recycling Thumbnail Cache
+============================
+
+Downscaled uint8 copies of every decoded image at a few canonical sizes (by
+default 224 and 640 px on the long side), shared by quality assessment,
+near-duplicate hashing and training so an image is decoded from JPEG once.
+
+Storage is one memory-mapped slot file per size plus a SQLite index:
+
+- thumbs_<size>.u8: `capacity` fixed-size slots, each a 32-byte header
+  (16-byte content hash digest, height, width) followed by size x size x 3
+  pixels. Slot n of every size file belongs to the same image, so a lookup is
+  one index query and a slice at n * slot_bytes.
+- index.sqlite: content_hash -> slot and last use time, plus hit, miss,
+  store and eviction counters summed over every process using the cache.
+
+The cache is bounded by max_bytes: once every slot is taken the least
+recently used image is evicted and its slot reused. Any number of processes
+(pool workers, DataLoader workers) can read and write concurrently: slot
+allocation is a SQLite transaction, and a slot's header is cleared before
+its pixels are overwritten and written back last, so a reader that copied
+pixels while they changed sees a header mismatch and treats it as a miss.
+
+Writes are batched per process so workers do not queue on the index lock:
+new thumbnails are held until PUT_BATCH of them are waiting, then slots for
+all of them are allocated in one transaction, together with the batched
+recency updates and counters. Those are flushed every FLUSH_EVERY lookups,
+when the put batch is written, on close and at worker exit. Until then a
+held thumbnail is visible only to the process that put it.
+
+Sizes bound the long side, so a thumbnail's short side is smaller by the
+image's aspect ratio: a 224 px thumbnail of a 4:3 photo is 224x168. A
+consumer that needs min_side pixels on the short side has to read a size of
+at least min_side x long / short (640 for 224 on most photos).
+"""
+
+import logging
+import multiprocessing.util
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HEADER_BYTES = 32
+DIGEST_BYTES = 16
+FLUSH_EVERY = 256
+PUT_BATCH = 16
+COUNTERS = ('hits', 'misses', 'stores', 'evictions')
+
+
+def fit_thumbnail(image: np.ndarray, size: int) -> np.ndarray:
+    """Downscale so the long side is at most `size`; smaller images are returned as is."""
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+class ThumbnailCache:
+    """Size-bounded, multi-process thumbnail store keyed by content hash."""
+
+    def __init__(self, root: str = "data/cache/thumbnails", sizes: Iterable[int] = (224, 640),
+                 max_bytes: int = 4 << 30):
+        self.root = Path(root)
+        self.sizes = tuple(sorted(int(s) for s in sizes))
+        self.slot_bytes = {size: HEADER_BYTES + size * size * 3 for size in self.sizes}
+        self.capacity = max(1, max_bytes // sum(self.slot_bytes.values()))
+
+        # This process's unflushed counters and recency updates
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self._pending = dict.fromkeys(COUNTERS, 0)
+        self._touched: Dict[str, int] = {}
+        self._lookups = 0
+        # Thumbnails put but not yet written: content hash -> {size: pixels}
+        self._queued: Dict[str, Dict[int, np.ndarray]] = {}
+
+        self._pid = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._maps: Dict[int, np.memmap] = {}
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._open()
+        logger.info(f"Thumbnail cache at {self.root}: sizes {list(self.sizes)}, {self.capacity} images")
+
+    def __getstate__(self):
+        # Connections and maps are per process; they reopen on first use after unpickling
+        state = self.__dict__.copy()
+        state.update(_pid=None, _conn=None, _maps={}, _touched={}, _lookups=0, _queued={},
+                     counts=dict.fromkeys(COUNTERS, 0), _pending=dict.fromkeys(COUNTERS, 0))
+        return state
+
+    def _open(self):
+        """(Re)open the index and slot files in the current process."""
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(str(self.root / "index.sqlite"), timeout=30, isolation_level=None)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                content_hash TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL UNIQUE,
+                last_used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_thumbnails_last_used ON thumbnails (last_used);
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+
+        layout = f"{','.join(map(str, self.sizes))}x{self.capacity}"
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+            if row is None or row[0] != layout:
+                # New cache, or sizes/capacity changed: slots no longer line up, start over
+                if row is not None:
+                    logger.info(f"Thumbnail cache layout changed ({row[0]} -> {layout}); clearing it")
+                self._conn.execute("DELETE FROM thumbnails")
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('layout', ?)", (layout,))
+                for size in self.sizes:
+                    with open(self._slot_file(size), 'wb') as f:
+                        f.truncate(self.capacity * self.slot_bytes[size])   # Sparse until written
+            self._conn.executemany("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)",
+                                   [(name,) for name in COUNTERS])
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+        self._maps = {size: np.memmap(self._slot_file(size), dtype=np.uint8, mode='r+',
+                                      shape=(self.capacity, self.slot_bytes[size]))
+                      for size in self.sizes}
+
+        # Pool and DataLoader workers exit without closing; flush their counters then
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def _slot_file(self, size: int) -> Path:
+        return self.root / f"thumbs_{size}.u8"
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._open()
+        return self._conn
+
+    def get(self, file_hash: str, size: int, rgb: bool = False) -> Optional[np.ndarray]:
+        """Thumbnail (BGR, or RGB with rgb=True) whose long side is at most `size`, or None."""
+        if size not in self.slot_bytes:
+            raise ValueError(f"Thumbnail size {size} is not cached (sizes: {self.sizes})")
+
+        queued = self._queued.get(file_hash)
+        if queued is not None:
+            image = queued.get(size)
+        else:
+            row = self._connection().execute("SELECT slot FROM thumbnails WHERE content_hash = ?",
+                                             (file_hash,)).fetchone()
+            image = self._read_slot(row[0], size, file_hash) if row else None
+
+        self._count('hits' if image is not None else 'misses')
+        if image is not None and queued is None:
+            self._touched[file_hash] = time.time_ns()
+
+        self._lookups += 1
+        if self._lookups % FLUSH_EVERY == 0:
+            self.flush()
+
+        if image is not None and rgb:
+            image = np.ascontiguousarray(image[..., ::-1])
+        return image
+
+    def _read_slot(self, slot: int, size: int, file_hash: str) -> Optional[np.ndarray]:
+        record = self._maps[size][slot]
+        digest = bytes.fromhex(file_hash)[:DIGEST_BYTES]
+
+        header = record[:HEADER_BYTES].tobytes()
+        if header[:DIGEST_BYTES] != digest:
+            return None     # Size not stored for this image, or slot being rewritten
+
+        height, width = np.frombuffer(header, dtype='<u2', count=2, offset=DIGEST_BYTES)
+        pixels = record[HEADER_BYTES:HEADER_BYTES + int(height) * int(width) * 3]
+        image = pixels.reshape(int(height), int(width), 3).copy()
+
+        # Re-check: the slot may have been evicted and rewritten while copying
+        if record[:DIGEST_BYTES].tobytes() != digest:
+            return None
+        return image
+
+    def contains(self, file_hash: str) -> bool:
+        if file_hash in self._queued:
+            return True
+        return self._connection().execute("SELECT 1 FROM thumbnails WHERE content_hash = ?",
+                                          (file_hash,)).fetchone() is not None
+
+    def put(self, file_hash: str, image: np.ndarray, full_resolution: bool = True, rgb: bool = False):
+        """
+        Store thumbnails of a decoded uint8 image (BGR, or RGB with rgb=True).
+
+        A size is stored only if the image has at least that many pixels on its
+        long side or is the full-resolution image; a reduced decode smaller than
+        a size would otherwise be cached as a blurry stand-in for it. The
+        thumbnails are written with the next batch (see flush).
+        """
+        if self.contains(file_hash):
+            return
+
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif rgb:
+            image = image[..., ::-1]
+
+        long_side = max(image.shape[:2])
+        # Copies, since they are held until the batch is written
+        thumbnails = {size: np.array(fit_thumbnail(image, size), order='C') for size in self.sizes
+                      if full_resolution or long_side >= size}
+        if not thumbnails:
+            return
+
+        self._queued[file_hash] = thumbnails
+        if len(self._queued) >= PUT_BATCH:
+            self.flush()
+
+    def _allocate(self, conn: sqlite3.Connection, file_hashes: Iterable[str]) -> Dict[str, int]:
+        """
+        Claim slots for new images inside the caller's transaction, evicting
+        the least recently used ones once the cache is full. Images another
+        process stored meanwhile are left out.
+        """
+        new = [h for h in file_hashes
+               if conn.execute("SELECT 1 FROM thumbnails WHERE content_hash = ?", (h,)).fetchone() is None]
+        new = new[-self.capacity:]
+
+        used = conn.execute("SELECT COUNT(*) FROM thumbnails").fetchone()[0]
+        # Slots are only ever reused, never freed, so 0..used-1 are taken
+        free = list(range(used, min(self.capacity, used + len(new))))
+        victims = conn.execute("SELECT content_hash, slot FROM thumbnails ORDER BY last_used LIMIT ?",
+                               (len(new) - len(free),)).fetchall()
+        conn.executemany("DELETE FROM thumbnails WHERE content_hash = ?", [(victim,) for victim, _ in victims])
+        for _ in victims:
+            self._count('evictions')
+
+        slots = dict(zip(new, free + [slot for _, slot in victims]))
+        now = time.time_ns()
+        conn.executemany("INSERT INTO thumbnails (content_hash, slot, last_used) VALUES (?, ?, ?)",
+                         [(h, slot, now) for h, slot in slots.items()])
+
+        # Invalidate every size before any pixels change
+        for slot in slots.values():
+            for size in self.sizes:
+                self._maps[size][slot, :DIGEST_BYTES] = 0
+        return slots
+
+    def _write(self, file_hash: str, slot: int, thumbnails: Dict[int, np.ndarray]):
+        """Pixels first, header last, so readers never match a half-written slot."""
+        digest = bytes.fromhex(file_hash)[:DIGEST_BYTES]
+        for size, thumbnail in thumbnails.items():
+            record = self._maps[size][slot]
+            height, width = thumbnail.shape[:2]
+            record[HEADER_BYTES:HEADER_BYTES + thumbnail.size] = thumbnail.reshape(-1)
+            header = digest + np.array([height, width], dtype='<u2').tobytes()
+            record[:len(header)] = np.frombuffer(header, dtype=np.uint8)
+
+    def _count(self, name: str):
+        self.counts[name] += 1
+        self._pending[name] += 1
+
+    def flush(self):
+        """Write held thumbnails, batched recency updates and counters to the shared index."""
+        if self._pid != os.getpid() or self._conn is None:
+            return
+        if not self._queued and not self._touched and not any(self._pending.values()):
+            return
+
+        queued, self._queued = self._queued, {}
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            slots = self._allocate(conn, queued) if queued else {}
+            for _ in slots:
+                self._count('stores')
+            conn.executemany("UPDATE thumbnails SET last_used = ? WHERE content_hash = ?",
+                             [(ts, h) for h, ts in self._touched.items()])
+            conn.executemany("UPDATE counters SET value = value + ? WHERE name = ?",
+                             [(n, name) for name, n in self._pending.items() if n])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._touched = {}
+        self._pending = dict.fromkeys(COUNTERS, 0)
+
+        for file_hash, slot in slots.items():
+            self._write(file_hash, slot, queued[file_hash])
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters summed over every process that has flushed, plus occupancy."""
+        self.flush()
+        conn = self._connection()
+        totals = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        lookups = totals.get('hits', 0) + totals.get('misses', 0)
+        return {
+            **{name: totals.get(name, 0) for name in COUNTERS},
+            'hit_rate': round(totals.get('hits', 0) / lookups, 4) if lookups else 0.0,
+            'entries': conn.execute("SELECT COUNT(*) FROM thumbnails").fetchone()[0],
+            'capacity': self.capacity,
+            'sizes': list(self.sizes),
+        }
+
+    @staticmethod
+    def delta(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+        """Counters accumulated between two stats() snapshots, e.g. over one run."""
+        delta = {name: after[name] - before[name] for name in COUNTERS}
+        lookups = delta['hits'] + delta['misses']
+        delta['hit_rate'] = round(delta['hits'] / lookups, 4) if lookups else 0.0
+        delta['entries'] = after['entries']
+        delta['capacity'] = after['capacity']
+        return delta
+
+    def close(self):
+        if self._pid == os.getpid() and self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+            for mapping in self._maps.values():
+                mapping.flush()
+            self._maps = {}
+            self._pid = None
+
+
+def thumbnail_cache_from_config(dataset_config: Dict[str, Any]) -> Optional[ThumbnailCache]:
+    """ThumbnailCache from the dataset.thumbnail_cache config block, or None if disabled."""
+    settings = dataset_config.get('thumbnail_cache', {})
+    if not settings.get('enabled', False):
+        return None
+    return ThumbnailCache(settings.get('path', "data/cache/thumbnails"),
+                          settings.get('sizes', (224, 640)),
+                          int(float(settings.get('max_gb', 4)) * (1 << 30)))
+
+
+def smallest_size_at_least(sizes: Tuple[int, ...], target: int) -> Optional[int]:
+    """Smallest cached size that can be downscaled to `target`, if any."""
+    return next((size for size in sorted(sizes) if size >= target), None)
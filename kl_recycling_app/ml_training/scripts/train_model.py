@@ -12,30 +12,35 @@ Usage:
     python train_model.py --model resnet50 --task weight_prediction --dataset data/scrap_dataset/
 """
 
+from __future__ import annotations
+
 import argparse
-import json
 import os
 import sys
 from pathlib import Path
-from typing import Dict, List, Optional, Any, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Any, Tuple, Union
 import logging
+from dataclasses import replace
 from datetime import datetime
 
-import torch
-import torch.nn as nn
-import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
-import torchvision.transforms as transforms
-from torch.optim.lr_scheduler import CosineAnnealingLR
-
 import numpy as np
-import pandas as pd
 import yaml
+from PIL import Image
 from tqdm import tqdm
-import wandb
-from ultralytics import YOLO
-import mlflow
-import mlflow.pytorch
+
+from annotation_store import DEFAULT_ANNOTATION_STORE, annotation_store_from_config, load_annotations
+from loader_tuning import LoaderSettings, autotune_loader
+from tensor_cache import IMAGENET_MEAN, IMAGENET_STD, CachedSplit, normalize_batch, tensor_cache_from_config
+from thumbnail_cache import ThumbnailCache, thumbnail_cache_from_config
+
+# torch, torchvision, ultralytics and wandb take seconds to import; they are
+# imported by the methods that use them so --help and config errors are fast.
+if TYPE_CHECKING:
+    import torch
+    from torch import nn, optim
+    from torch.utils.data import DataLoader
+
+    from shard_dataset import ShardedDataset
 
 # Configure logging
 logging.basicConfig(
@@ -49,85 +54,190 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-class ScrapMetalDataset(Dataset):
-    """Custom dataset for scrap metal detection and weight prediction."""
+# Class index of each material, as in create_data_config
+MATERIALS = ('steel', 'aluminum', 'copper', 'brass', 'mixed_scrap')
+
+# One fixed-size record per sample. Image paths live in one shared bytes
+# buffer at path_offset, so the whole index is a handful of objects.
+ANNOTATION_DTYPE = np.dtype([
+    ('path_offset', np.int64),
+    ('path_length', np.int32),
+    ('material', np.int8),
+    ('bbox', np.float32, (4,)),
+    ('weight', np.float32),
+    ('content_hash', 'S64'),
+])
 
-    def __init__(self, data_dir: str, transform=None, task: str = "detection"):
+
+class ScrapMetalDataset:
+    """
+    Custom dataset for scrap metal detection and weight prediction.
+
+    Map-style (__len__ and __getitem__), which is all DataLoader needs, so
+    the class can be defined without importing torch.
+
+    For weight prediction, images are read from the shared thumbnail cache
+    when it holds one at least min_side pixels on its short side, and cached
+    after the first decode otherwise. JPEGs that do have to be decoded are
+    decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that still leaves
+    both sides at least min_side, since Resize would discard the rest. With
+    the cache on, the decode is also kept large enough to fill the smallest
+    cached size that can serve min_side, so later epochs hit the cache.
+    Detection keeps full-resolution images since its boxes are in original
+    pixel coordinates.
+
+    Annotations come from the annotation store in one query; a directory
+    the store has not seen yet has its .json sidecars imported first. They
+    are kept as a numpy structured array (ANNOTATION_DTYPE) plus one bytes
+    buffer of paths rather than a list of dicts: forked DataLoader workers
+    reading a list of dicts update every object's refcount and so copy the
+    whole index, while reading an array touches no Python objects.
+
+    image_at and weight_samples expose the decoded images and their weights
+    to the tensor cache, which preprocesses a split once for all epochs.
+    """
+
+    def __init__(self, data_dir: str, transform=None, task: str = "detection",
+                 thumbnail_cache: Optional[ThumbnailCache] = None, min_side: int = 0,
+                 annotation_store: str = DEFAULT_ANNOTATION_STORE, reduced_decode: bool = True):
         self.data_dir = Path(data_dir)
         self.transform = transform
         self.task = task
+        self.thumbnail_cache = thumbnail_cache if task == "weight_prediction" else None
+        self.min_side = min_side
+        self.reduced_decode = reduced_decode and task == "weight_prediction" and min_side > 0
+        self.annotation_store = annotation_store
 
         # Load annotations
-        self.annotations = self._load_annotations()
+        self.records, self._paths = self._load_annotations()
 
-    def _load_annotations(self) -> List[Dict[str, Any]]:
-        """Load JSON annotations from data directory."""
-        annotations = []
+    def _load_annotations(self) -> Tuple[np.ndarray, bytes]:
+        """Bulk-read the data directory's annotations from the annotation store into arrays."""
+        annotations = load_annotations(self.data_dir, self.annotation_store)
 
-        for json_file in self.data_dir.glob("*.json"):
-            try:
-                with open(json_file, 'r') as f:
-                    annotation = json.load(f)
-                    annotations.append(annotation)
-            except Exception as e:
-                logger.warning(f"Failed to load annotation {json_file}: {e}")
+        paths = [os.fsencode(a['image_path']) for a in annotations]
+        lengths = np.array([len(p) for p in paths], dtype=np.int64)
+
+        records = np.zeros(len(annotations), dtype=ANNOTATION_DTYPE)
+        records['path_length'] = lengths
+        records['path_offset'][1:] = np.cumsum(lengths)[:-1]
+        records['material'] = [self._material_to_idx(a.get('material_type')) for a in annotations]
+        records['bbox'] = np.array([a.get('bounding_box') or (0.0, 0.0, 0.0, 0.0) for a in annotations],
+                                   dtype=np.float32).reshape(-1, 4)
+        records['weight'] = [a.get('weight_pounds', np.nan) for a in annotations]
+        records['content_hash'] = [(a.get('content_hash') or '').encode() for a in annotations]
 
         logger.info(f"Loaded {len(annotations)} annotations from {self.data_dir}")
-        return annotations
+        return records, b''.join(paths)
 
     def __len__(self):
-        return len(self.annotations)
+        return len(self.records)
 
-    def __getitem__(self, idx):
-        annotation = self.annotations[idx]
+    def image_path(self, idx: int) -> Path:
+        offset, length = int(self.records['path_offset'][idx]), int(self.records['path_length'][idx])
+        return Path(os.fsdecode(self._paths[offset:offset + length]))
+
+    def image_at(self, idx: int) -> Image.Image:
+        """Decoded RGB image of sample idx, before any transform."""
+        return self._load_image(idx)
 
-        # Load image
-        image_path = Path(annotation['image_path'])
-        if not image_path.exists():
-            # Try different path variations
-            image_path = self.data_dir / annotation.get('filename', annotation['image_path'].split('/')[-1])
+    def weight_samples(self) -> List[Tuple[str, Optional[str], float]]:
+        """(image_path, content_hash, weight_pounds) of every sample, in index order."""
+        return [(str(self.image_path(i)), record['content_hash'].decode() or None, float(record['weight']))
+                for i, record in enumerate(self.records)]
 
-        if not image_path.exists():
-            raise FileNotFoundError(f"Image not found: {image_path}")
+    def __getitem__(self, idx):
+        record = self.records[idx]
+        image = self._load_image(idx)
 
-        image = Image.open(image_path).convert('RGB')
+        import torch
 
         if self.task == "detection":
             # Return object detection format (YOLO format)
-            targets = self._prepare_detection_targets(annotation)
+            targets = self._prepare_detection_targets(record)
             if self.transform:
                 image, targets = self._apply_transform(image, targets)
             return image, targets
 
         elif self.task == "weight_prediction":
             # Return weight prediction format
-            weight = annotation['weight_pounds']
             if self.transform:
                 image = self.transform(image)
-            return image, torch.tensor([weight], dtype=torch.float32)
-
-    def _prepare_detection_targets(self, annotation: Dict[str, Any]) -> Dict[str, Any]:
+            return image, torch.tensor([record['weight']], dtype=torch.float32)
+
+    def _load_image(self, idx: int) -> Image.Image:
+        """RGB image of sample idx, from the thumbnail cache when possible."""
+        file_hash = self.records['content_hash'][idx].decode() if self.thumbnail_cache else None
+        if file_hash:
+            pixels = self._cached_thumbnail(file_hash)
+            if pixels is not None:
+                return Image.fromarray(pixels)
+
+        # Open directly; only a missing file costs a second attempt
+        image_path = self.image_path(idx)
+        try:
+            image = Image.open(image_path)
+        except FileNotFoundError:
+            # Same file name in the data directory
+            image_path = self.data_dir / image_path.name
+            try:
+                image = Image.open(image_path)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Image not found: {image_path}") from None
+
+        full_size = image.size
+        if self.reduced_decode:
+            # Only JPEG supports this; other formats ignore the request
+            side = self._draft_side(full_size)
+            image.draft('RGB', (side, side))
+
+        image = image.convert('RGB')
+        if file_hash:
+            # A reduced decode must not be cached as a stand-in for larger thumbnails
+            self.thumbnail_cache.put(file_hash, np.asarray(image), full_resolution=image.size == full_size, rgb=True)
+        return image
+
+    def _draft_side(self, full_size: Tuple[int, int]) -> int:
+        """
+        Short side to ask a reduced decode for: min_side, or with the thumbnail
+        cache on, enough for the decode to fill the smallest cached size whose
+        thumbnail keeps min_side on its short side (640 for 224 on a 4:3 photo).
+        """
+        if not self.thumbnail_cache:
+            return self.min_side
+        short, long = min(full_size), max(full_size)
+        for size in self.thumbnail_cache.sizes:
+            if round(short * size / long) >= self.min_side:
+                return max(self.min_side, -(-size * short // long))
+        return self.min_side
+
+    def _cached_thumbnail(self, file_hash: str) -> Optional[np.ndarray]:
+        """Smallest cached thumbnail that Resize(min_side) would not have to upscale."""
+        for size in self.thumbnail_cache.sizes:
+            if size < self.min_side:
+                continue
+            pixels = self.thumbnail_cache.get(file_hash, size, rgb=True)
+            if pixels is None:
+                return None
+            # Large enough, or the whole image (smaller than this size)
+            if min(pixels.shape[:2]) >= self.min_side or max(pixels.shape[:2]) < size:
+                return pixels
+        return None
+
+    def _prepare_detection_targets(self, record: np.void) -> Dict[str, Any]:
         """Prepare targets for object detection."""
-        # Convert from pascal_voc format to YOLO format
-        bbox = annotation['bounding_box']  # [x, y, w, h]
-        material_idx = self._material_to_idx(annotation['material_type'])
+        import torch
 
+        # Convert from pascal_voc format to YOLO format
         return {
-            'boxes': torch.tensor([bbox], dtype=torch.float32),
-            'labels': torch.tensor([material_idx], dtype=torch.int64),
-            'weights': torch.tensor([annotation['weight_pounds']], dtype=torch.float32)
+            'boxes': torch.tensor(record['bbox'][None], dtype=torch.float32),  # [x, y, w, h]
+            'labels': torch.tensor([record['material']], dtype=torch.int64),
+            'weights': torch.tensor([record['weight']], dtype=torch.float32)
         }
 
-    def _material_to_idx(self, material: str) -> int:
+    def _material_to_idx(self, material: Optional[str]) -> int:
         """Convert material name to class index."""
-        material_map = {
-            'steel': 0,
-            'aluminum': 1,
-            'copper': 2,
-            'brass': 3,
-            'mixed_scrap': 4
-        }
-        return material_map.get(material, 0)
+        return MATERIALS.index(material) if material in MATERIALS else 0
 
 
 class ModelTrainer:
@@ -141,6 +251,12 @@ class ModelTrainer:
         # Device configuration
         self.device = self._setup_device()
 
+        # Decoded thumbnails shared with the data processor (dataset.thumbnail_cache)
+        self.thumbnail_cache = thumbnail_cache_from_config(self.config['dataset'])
+        self.annotation_store, _ = annotation_store_from_config(self.config['dataset'])
+        # Splits preprocessed once into uint8 arrays for weight prediction (dataset.tensor_cache)
+        self.tensor_cache = tensor_cache_from_config(self.config['dataset'])
+
         # Setup monitoring
         if self.config['monitoring']['wandb'].get('enabled', False):
             self._setup_wandb()
@@ -155,6 +271,8 @@ class ModelTrainer:
 
     def _setup_device(self) -> torch.device:
         """Setup training device (GPU/CPU)."""
+        import torch
+
         if torch.cuda.is_available() and self.config['training']['device'] != 'cpu':
             device = torch.device('cuda')
             logger.info(f"Using GPU: {torch.cuda.get_device_name()}")
@@ -167,6 +285,8 @@ class ModelTrainer:
 
     def _setup_wandb(self):
         """Setup Weights & Biases monitoring."""
+        import wandb
+
         wandb_config = self.config['monitoring']['wandb']
         wandb.init(
             project=wandb_config['project'],
@@ -174,10 +294,13 @@ class ModelTrainer:
             name=f"scrap_metal_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         )
 
-    def train_yolo_v8(self, dataset_path: str, model_size: str = "medium", epochs: int = 100):
+    def train_yolo_v8(self, dataset_path: str, model_size: str = "medium", epochs: int = 100,
+                      batch_size: Optional[int] = None):
         """
         Train YOLOv8 model for scrap metal object detection.
         """
+        from ultralytics import YOLO
+
         logger.info(f"Training YOLOv8 ({model_size}) model for {epochs} epochs")
 
         # Load model
@@ -187,7 +310,7 @@ class ModelTrainer:
         training_config = {
             'data': str(Path(dataset_path) / 'data.yaml'),  # Create data config
             'epochs': epochs,
-            'batch': self.config['models']['object_detection']['yolo_v8']['batch_size'],
+            'batch': batch_size or self.config['models']['object_detection']['yolo_v8']['batch_size'],
             'imgsz': self.config['models']['object_detection']['yolo_v8']['input_size'],
             'optimizer': 'adam',
             'lr0': self.config['models']['object_detection']['yolo_v8']['learning_rate'],
@@ -227,18 +350,25 @@ class ModelTrainer:
         # For now, this is a placeholder for the conversion process
         pass
 
-    def train_weight_predictor(self, dataset_path: str, architecture: str = "resnet50", epochs: int = 50):
+    def train_weight_predictor(self, dataset_path: str, architecture: str = "resnet50", epochs: int = 50,
+                               batch_size: Optional[int] = None):
         """
         Train CNN model for weight prediction.
         """
+        import torch
+        from torch import nn, optim
+        from torch.optim.lr_scheduler import CosineAnnealingLR
+
         logger.info(f"Training weight predictor with {architecture} for {epochs} epochs")
 
         # Create datasets
         train_dataset = self._create_weight_dataset(dataset_path, 'train')
         val_dataset = self._create_weight_dataset(dataset_path, 'val')
 
-        train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-        val_loader = DataLoader(val_dataset, batch_size=32, shuffle=False)
+        batch_size = batch_size or self.config['models']['weight_prediction']['cnn_regressor']['batch_size']
+        settings = self._loader_settings(train_dataset, batch_size)
+        train_loader = self._weight_loader(train_dataset, shuffle=True, batch_size=batch_size, settings=settings)
+        val_loader = self._weight_loader(val_dataset, shuffle=False, batch_size=batch_size, settings=settings)
 
         # Create model
         model = self._build_weight_predictor(architecture)
@@ -254,6 +384,10 @@ class ModelTrainer:
         patience_counter = 0
 
         for epoch in range(epochs):
+            # Sharded datasets reshuffle their shard order per epoch
+            if hasattr(train_loader.dataset, 'set_epoch'):
+                train_loader.dataset.set_epoch(epoch)
+
             # Train
             train_loss = self._train_epoch(model, train_loader, optimizer, criterion)
 
@@ -290,20 +424,126 @@ class ModelTrainer:
             'final_val_loss': best_val_loss
         }
 
-    def _create_weight_dataset(self, dataset_path: str, split: str) -> ScrapMetalDataset:
-        """Create weight prediction dataset."""
+    def _create_weight_dataset(self, dataset_path: str, split: str) -> Union[ScrapMetalDataset, CachedSplit,
+                                                                              ShardedDataset]:
+        """
+        Create weight prediction dataset. With dataset.shards enabled and the
+        split packed, samples stream from its shards; otherwise, with the
+        tensor cache enabled, this is the split's cached uint8 arrays,
+        preprocessed on first use.
+        """
+        import torchvision.transforms as transforms
+
         split_path = Path(dataset_path) / split
+        input_size = self.config['models']['weight_prediction']['cnn_regressor']['input_size']
 
+        # CenterCrop makes every sample input_size square so mixed aspect ratios batch together
         transform = transforms.Compose([
-            transforms.Resize(self.config['models']['weight_prediction']['cnn_regressor']['input_size']),
+            transforms.Resize(input_size),
+            transforms.CenterCrop(input_size),
             transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
         ])
 
-        return ScrapMetalDataset(split_path, transform=transform, task="weight_prediction")
+        shard_dir = self._shard_directory(dataset_path, split)
+        if shard_dir is not None:
+            from shard_dataset import ShardedDataset
+
+            settings = self.config['dataset']['shards']
+            return ShardedDataset(shard_dir, transform=transform, task="weight_prediction",
+                                  shuffle=(split == 'train'), shuffle_buffer=settings.get('shuffle_buffer', 256))
+
+        # Resize(int) scales the short side to input_size; Resize((h, w)) needs both
+        min_side = max(input_size) if isinstance(input_size, (list, tuple)) else input_size
+
+        dataset = ScrapMetalDataset(split_path, transform=transform, task="weight_prediction",
+                                    thumbnail_cache=self.thumbnail_cache, min_side=min_side,
+                                    annotation_store=self.annotation_store)
+        if self.tensor_cache is None:
+            return dataset
+
+        # Same Resize + CenterCrop, applied once; normalization happens per batch on the device
+        return self.tensor_cache.load_or_build(f"{Path(dataset_path).name}_{split}", dataset.weight_samples(),
+                                               dataset.image_at, input_size)
+
+    def _shard_directory(self, dataset_path: str, split: str) -> Optional[Path]:
+        """The split's shard directory when dataset.shards is enabled and it has been written."""
+        from shard_dataset import INDEX_NAME, default_shard_directory
+
+        settings = self.config['dataset'].get('shards', {})
+        if not settings.get('enabled', False):
+            return None
+
+        if settings.get('path'):
+            shard_dir = Path(settings['path']) / split
+        else:
+            shard_dir = default_shard_directory(Path(dataset_path) / split)
+        if not (shard_dir / INDEX_NAME).exists():
+            logger.warning(f"No shards for {split} at {shard_dir}; reading image files "
+                           f"(pack them with scripts/shard_dataset.py)")
+            return None
+        return shard_dir
+
+    def _weight_loader(self, dataset: Union[ScrapMetalDataset, CachedSplit, ShardedDataset], shuffle: bool,
+                       batch_size: int = 32, settings: Optional[LoaderSettings] = None) -> DataLoader:
+        """
+        DataLoader for a weight dataset. Cached splits are read a whole batch
+        per slice; sharded datasets shuffle themselves.
+        """
+        from torch.utils.data import BatchSampler, DataLoader, RandomSampler, SequentialSampler
+        from shard_dataset import ShardedDataset
+
+        kwargs = (settings or LoaderSettings()).kwargs()
+        if isinstance(dataset, ShardedDataset):
+            return DataLoader(dataset, batch_size=batch_size, **kwargs)
+        if isinstance(dataset, CachedSplit):
+            sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+            return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last=False), batch_size=None,
+                              **kwargs)
+        return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **kwargs)
+
+    def _loader_settings(self, dataset: Union[ScrapMetalDataset, CachedSplit, ShardedDataset],
+                         batch_size: int) -> LoaderSettings:
+        """
+        DataLoader workers, prefetching and pinning from training.dataloader;
+        with autotune, whatever is left unset there is timed on the dataset.
+        """
+        from shard_dataset import ShardedDataset
+
+        settings = self.config['training'].get('dataloader', {})
+        fixed = {key: settings.get(key) for key in ('num_workers', 'prefetch_factor', 'pin_memory')}
+        # Persistent workers would keep the shard order of the epoch they started in
+        base = LoaderSettings(persistent_workers=not isinstance(dataset, ShardedDataset),
+                              pin_memory=self.device.type == 'cuda')
+
+        if not settings.get('autotune', True) or all(value is not None for value in fixed.values()):
+            chosen = replace(base, **{key: value for key, value in fixed.items() if value is not None})
+            logger.info(f"DataLoader settings from config: {chosen.describe()}")
+            return chosen
+
+        def consume(batch) -> int:
+            images, targets = self._batch_to_device(*batch)
+            return len(targets)
+
+        logger.info(f"Autotuning DataLoader for {type(dataset).__name__} (batch size {batch_size})")
+        return autotune_loader(
+            lambda candidate: self._weight_loader(dataset, shuffle=True, batch_size=batch_size, settings=candidate),
+            consume, base, batches=settings.get('autotune_batches', 20), max_workers=settings.get('max_workers', 0),
+            fixed=fixed, pin_memory_available=self.device.type == 'cuda')
+
+    def _batch_to_device(self, images: torch.Tensor, targets: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Move a batch to the device; uint8 batches from the tensor cache are normalized there."""
+        if images.is_floating_point():
+            images = images.to(self.device, non_blocking=True)
+        else:
+            images = normalize_batch(images, self.device)
+        return images, targets.to(self.device, non_blocking=True)
 
     def _build_weight_predictor(self, architecture: str) -> nn.Module:
         """Build weight prediction model."""
+        import torch
+        from torch import nn
+
         if architecture == "resnet50":
             model = torch.hub.load('pytorch/vision:v0.10.0', 'resnet50', pretrained=True)
 
@@ -331,7 +571,7 @@ class ModelTrainer:
         total_loss = 0.0
 
         for images, targets in tqdm(train_loader, desc="Training"):
-            images, targets = images.to(self.device), targets.to(self.device)
+            images, targets = self._batch_to_device(images, targets)
 
             optimizer.zero_grad()
             outputs = model(images)
@@ -346,12 +586,14 @@ class ModelTrainer:
     def _validate_epoch(self, model: nn.Module, val_loader: DataLoader,
                        criterion: nn.Module) -> float:
         """Validate for one epoch."""
+        import torch
+
         model.eval()
         total_loss = 0.0
 
         with torch.no_grad():
             for images, targets in tqdm(val_loader, desc="Validating"):
-                images, targets = images.to(self.device), targets.to(self.device)
+                images, targets = self._batch_to_device(images, targets)
 
                 outputs = model(images)
                 loss = criterion(outputs, targets)
@@ -364,7 +606,9 @@ class ModelTrainer:
         """Log training progress."""
         logger.info(f"Epoch {epoch+1}: Train Loss = {train_loss:.4f}, Val Loss = {val_loss:.4f}")
 
-        if wandb.run:
+        # Only loaded (and so only logging) when _setup_wandb ran
+        wandb = sys.modules.get('wandb')
+        if wandb is not None and wandb.run:
             wandb.log({
                 "epoch": epoch,
                 "train_loss": train_loss,
@@ -373,6 +617,8 @@ class ModelTrainer:
 
     def _save_checkpoint(self, model: nn.Module, path: str):
         """Save model checkpoint."""
+        import torch
+
         Path(path).parent.mkdir(parents=True, exist_ok=True)
         torch.save(model.state_dict(), path)
 
@@ -420,11 +666,15 @@ def main():
     parser.add_argument("--batch_size", type=int, default=None, help="Batch size")
     parser.add_argument("--config", default="config/training_config.yaml",
                        help="Path to training configuration file")
+    parser.add_argument("--no_tensor_cache", action="store_true",
+                       help="Decode and resize every image each epoch instead of using the tensor cache")
 
     args = parser.parse_args()
 
     # Initialize trainer
     trainer = ModelTrainer(args.config)
+    if args.no_tensor_cache:
+        trainer.tensor_cache = None
 
     # Generate model name if not provided
     model_name = args.name or f"{args.model}_{args.task}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
@@ -439,12 +689,13 @@ def main():
 
             # Train YOLO model
             epochs = args.epochs or trainer.config['models']['object_detection']['yolo_v8']['epochs']
-            result = trainer.train_yolo_v8(args.dataset, epochs=epochs)
+            result = trainer.train_yolo_v8(args.dataset, epochs=epochs, batch_size=args.batch_size)
 
         elif args.model in ["resnet50", "vgg16"] and args.task == "weight_prediction":
             # Train weight predictor
             epochs = args.epochs or trainer.config['models']['weight_prediction']['cnn_regressor']['epochs']
-            result = trainer.train_weight_predictor(args.dataset, args.model, epochs=epochs)
+            result = trainer.train_weight_predictor(args.dataset, args.model, epochs=epochs,
+                                                    batch_size=args.batch_size)
 
         else:
             raise ValueError(f"Unsupported model/task combination: {args.model}/{args.task}")
@@ -0,0 +1,134 @@
+"""
+KL Recycling Validation Log
+===========================
+
+Streaming output for dataset validation:
+
+- IssueLog: one JSON object per line in validation_issues.jsonl, written as
+  issues are found. Its byte offset is recorded in checkpoints; a resumed run
+  truncates the file back to that offset so no issue is duplicated or lost.
+- ValidationSummary: counters, material distribution and online quality score
+  statistics (Welford moments, fixed-bin histogram, P-square quantiles),
+  serializable for checkpoints.
+- write_json_atomic: write-to-temp then rename, so reports and checkpoints
+  are never left half written.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from online_stats import FixedHistogram, P2Quantile, RunningStats
+
+SCORE_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def write_json_atomic(path: Path, data: Dict[str, Any], indent: Optional[int] = 2):
+    """Replace path with data in one rename."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + '.tmp')
+
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=indent, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class IssueLog:
+    """Append-only JSONL issue log, resumable from a byte offset."""
+
+    def __init__(self, path: Path, resume_offset: Optional[int] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        if resume_offset is None:
+            self._file = open(self.path, 'wb')
+        else:
+            # Drop anything written after the checkpoint being resumed
+            self._file = open(self.path, 'r+b' if self.path.exists() else 'wb')
+            self._file.truncate(resume_offset)
+            self._file.seek(resume_offset)
+
+    def write(self, issue: Dict[str, Any]):
+        self._file.write(json.dumps(issue, default=str).encode() + b'\n')
+
+    def sync(self) -> int:
+        """Make everything written so far durable and return the file offset."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+
+class ValidationSummary:
+    """Constant-memory validation counters and quality score statistics."""
+
+    def __init__(self):
+        self.total_images = 0
+        self.valid_images = 0
+        self.invalid_images = 0
+        self.material_distribution: Dict[str, int] = {}
+        self.issue_counts: Dict[str, int] = {}
+        self.scores = RunningStats()
+        self.histogram = FixedHistogram(bins=20, low=0.0, high=1.0)
+        self.quantiles = [P2Quantile(p) for p in SCORE_QUANTILES]
+
+    def add_score(self, score: float):
+        self.scores.add(score)
+        self.histogram.add(score)
+        for quantile in self.quantiles:
+            quantile.add(score)
+
+    def add_valid(self, material: str):
+        self.valid_images += 1
+        self.material_distribution[material] = self.material_distribution.get(material, 0) + 1
+
+    def add_issue(self, kind: str):
+        self.invalid_images += 1
+        self.issue_counts[kind] = self.issue_counts.get(kind, 0) + 1
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            'total_images': self.total_images,
+            'valid_images': self.valid_images,
+            'invalid_images': self.invalid_images,
+            'material_distribution': dict(self.material_distribution),
+            'issue_counts': dict(self.issue_counts),
+            'scores': self.scores.state(),
+            'histogram': self.histogram.state(),
+            'quantiles': [q.state() for q in self.quantiles],
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "ValidationSummary":
+        summary = cls()
+        summary.total_images = state['total_images']
+        summary.valid_images = state['valid_images']
+        summary.invalid_images = state['invalid_images']
+        summary.material_distribution = dict(state['material_distribution'])
+        summary.issue_counts = dict(state['issue_counts'])
+        summary.scores = RunningStats.from_state(state['scores'])
+        summary.histogram = FixedHistogram.from_state(state['histogram'])
+        summary.quantiles = [P2Quantile.from_state(q) for q in state['quantiles']]
+        return summary
+
+    def report(self) -> Dict[str, Any]:
+        """Compact summary for validation_report.json."""
+        return {
+            'total_images': self.total_images,
+            'valid_images': self.valid_images,
+            'invalid_images': self.invalid_images,
+            'material_distribution': self.material_distribution,
+            'issue_counts': self.issue_counts,
+            'quality_stats': {
+                **self.scores.summary(),
+                'quantiles': {f"p{round(q.p * 100)}": q.value for q in self.quantiles},
+                'histogram': {'edges': self.histogram.edges, 'counts': self.histogram.counts},
+            },
+        }
@@ -0,0 +1,47 @@
+import json
+import os
+from pathlib import Path
+
+from annotation_store import AnnotationStore, load_annotations
+
+
+def _write(directory: Path, stem: str, weight: float, mtime: float):
+    (directory / f"{stem}.jpg").write_bytes(b"")
+    sidecar = directory / f"{stem}.json"
+    sidecar.write_text(json.dumps({'material_type': 'steel', 'weight_pounds': weight}))
+    os.utime(sidecar, (mtime, mtime))
+
+
+def test_new_and_edited_sidecars_are_imported(tmp_path):
+    split_dir = tmp_path / "train"
+    split_dir.mkdir()
+    store_path = str(tmp_path / "annotations.sqlite")
+    past = 1_000_000_000
+
+    _write(split_dir, "a", 1.0, past)
+    assert [a['weight_pounds'] for a in load_annotations(split_dir, store_path)] == [1.0]
+
+    # Added after the directory was first loaded
+    _write(split_dir, "b", 2.0, past)
+    assert [a['weight_pounds'] for a in load_annotations(split_dir, store_path)] == [1.0, 2.0]
+
+    # Edited after its row was written
+    _write(split_dir, "a", 3.0, past + 10**9)
+    assert [a['weight_pounds'] for a in load_annotations(split_dir, store_path)] == [3.0, 2.0]
+
+    with AnnotationStore(store_path) as store:
+        assert store.counts('split') == {'train': 2}
+        assert store.weight_stats(split_dir)['max'] == 3.0
+
+
+def test_sidecars_older_than_their_row_are_not_read(tmp_path):
+    store_path = str(tmp_path / "annotations.sqlite")
+    _write(tmp_path, "a", 1.0, 1_000_000_000)
+
+    with AnnotationStore(store_path) as store:
+        store.put(tmp_path / "a.jpg", {'material_type': 'copper', 'weight_pounds': 5.0}, source='data_processor')
+
+    annotations = load_annotations(tmp_path, store_path)
+    assert [(a['material_type'], a['weight_pounds']) for a in annotations] == [('copper', 5.0)]
+    with AnnotationStore(store_path) as store:
+        assert store.counts('source') == {'data_processor': 1}
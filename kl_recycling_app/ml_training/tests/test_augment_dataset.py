@@ -0,0 +1,44 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from annotation_store import AnnotationStore
+from data_processor import ScrapMetalDataProcessor
+
+CONFIG_DIR = Path(__file__).resolve().parent.parent / "config"
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    shutil.copytree(CONFIG_DIR, tmp_path / "config")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_variants_use_the_store_without_sidecars(workdir):
+    pytest.importorskip("albumentations")
+    split_dir = workdir / "data/scrap_dataset/train"
+    split_dir.mkdir(parents=True)
+    image = split_dir / "steel_0001.jpg"
+    Image.fromarray(np.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype=np.uint8)).save(image)
+
+    processor = ScrapMetalDataProcessor(use_cache=False)
+    processor.write_sidecars = False
+    # Annotated only in the store
+    with AnnotationStore(processor.annotation_store_path) as store:
+        store.put(image, {'material_type': 'steel', 'bounding_box': [40, 40, 200, 120], 'weight_pounds': 2.5},
+                  source='data_processor')
+
+    assert processor.augment_dataset(2)['written'] == 2
+    output_dir = workdir / "data/augmented_images"
+    assert not list(output_dir.glob("*.json"))
+    with AnnotationStore(processor.annotation_store_path) as store:
+        variants = store.query(output_dir, source='augmentation')
+    assert sorted(Path(a['image_path']).name for a in variants) == ["steel_0001_aug0.jpg", "steel_0001_aug1.jpg"]
+    assert all(Path(a['augmented_from']).resolve() == image.resolve() for a in variants)
+    assert all(a['weight_pounds'] == 2.5 for a in variants)
+
+    assert processor.augment_dataset(2)['skipped_existing'] == 2
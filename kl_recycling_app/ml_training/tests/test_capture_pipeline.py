@@ -0,0 +1,71 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from capture_pipeline import CapturePipeline, FrameSource
+
+
+class EndlessSource(FrameSource):
+    """Frames as fast as the queue takes them, forever."""
+
+    def frames(self, material):
+        while True:
+            yield np.zeros((8, 8, 3), dtype=np.uint8)
+
+
+def _run_in_thread(pipeline, **kwargs):
+    outcome = {}
+
+    def target():
+        try:
+            outcome['stats'] = pipeline.run("steel", **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=15)
+    return thread, outcome
+
+
+def test_failing_gate_does_not_hang_capture():
+    def gate(image, worker_index):
+        time.sleep(0.05)
+        raise RuntimeError("gate failed")
+
+    pipeline = CapturePipeline(EndlessSource(), gate, write=lambda image, n: None, gate_workers=2, queue_size=4)
+    thread, outcome = _run_in_thread(pipeline, target=10)
+
+    assert not thread.is_alive(), "run() hung after every gate worker failed"
+    assert isinstance(outcome.get('error'), RuntimeError)
+
+
+def test_failing_writer_does_not_hang_capture():
+    def write(image, n):
+        raise OSError("disk full")
+
+    pipeline = CapturePipeline(EndlessSource(), lambda image, worker_index: (True, 1.0), write,
+                               gate_workers=2, queue_size=2)
+    thread, outcome = _run_in_thread(pipeline, target=10)
+
+    assert not thread.is_alive()
+    assert isinstance(outcome.get('error'), OSError)
+
+
+@pytest.mark.parametrize("gate_workers", [1, 3])
+def test_stops_at_target(tmp_path, gate_workers):
+    written = []
+
+    def write(image, n):
+        written.append(n)
+        return tmp_path / f"{n}.jpg"
+
+    pipeline = CapturePipeline(EndlessSource(), lambda image, worker_index: (True, 1.0), write,
+                               gate_workers=gate_workers, queue_size=2)
+    thread, outcome = _run_in_thread(pipeline, target=5)
+
+    assert not thread.is_alive()
+    assert outcome['stats'].written == 5
+    assert written == list(range(5))
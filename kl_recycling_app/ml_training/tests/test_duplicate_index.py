@@ -0,0 +1,36 @@
+from duplicate_index import DuplicateIndex, audit_near_duplicates
+
+
+def test_identical_copies_in_different_splits_are_reported():
+    items = [
+        ("hash-a", 0x0F0F0F0F0F0F0F0F, "train/a.jpg", "train"),
+        ("hash-a", 0x0F0F0F0F0F0F0F0F, "test/a.jpg", "test"),
+        ("hash-b", 0xF0F0F0F0F0F0F0F0, "train/b.jpg", "train"),
+    ]
+
+    audit = audit_near_duplicates(items, max_distance=6)
+
+    assert audit['images'] == 3
+    assert audit['duplicate_pairs'] == 1
+    assert audit['cross_split_pairs'] == 1
+    assert audit['pairs'] == [{'image': "test/a.jpg", 'duplicate_of': "train/a.jpg", 'distance': 0,
+                               'cross_split': True}]
+    assert audit['clusters'] == [["test/a.jpg", "train/a.jpg"]]
+
+
+def test_same_path_is_counted_once():
+    items = [("hash-a", 1, "train/a.jpg", "train"), ("hash-a", 1, "train/a.jpg", "train")]
+
+    audit = audit_near_duplicates(items, max_distance=6)
+
+    assert audit['images'] == 1
+    assert audit['duplicate_pairs'] == 0
+
+
+def test_query_finds_hashes_within_distance():
+    index = DuplicateIndex()
+    index.add("a", 0)
+    index.add("b", 0b111)
+    index.add("c", (1 << 64) - 1)
+
+    assert index.query(0b1, max_distance=2) == [("a", 1), ("b", 2)]
@@ -0,0 +1,92 @@
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from data_processor import ScrapMetalDataProcessor
+
+CONFIG_DIR = Path(__file__).resolve().parent.parent / "config"
+MANIFEST = "data/metrics/processing_manifest.sqlite"
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    shutil.copytree(CONFIG_DIR, tmp_path / "config")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _write_image(path: Path, seed: int):
+    pixels = np.random.default_rng(seed).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, quality=90)
+
+
+def _source_hash(path: Path) -> str:
+    with sqlite3.connect(MANIFEST) as conn:
+        return conn.execute("SELECT content_hash FROM sources WHERE source_path = ?",
+                            (str(path.resolve()),)).fetchone()[0]
+
+
+def _process(dedupe: bool = False):
+    ScrapMetalDataProcessor(use_cache=False).process_dataset("data/raw_images", "data/processed_images",
+                                                             dedupe=dedupe)
+
+
+def _config_hashes():
+    with sqlite3.connect(MANIFEST) as conn:
+        return {row[0] for row in conn.execute("SELECT config_hash FROM images")}
+
+
+def test_file_rewritten_in_place_is_reprocessed(workdir):
+    source_dir = workdir / "data/raw_images/steel"
+    source_dir.mkdir(parents=True)
+    image = source_dir / "steel_0001.jpg"
+    _write_image(image, seed=1)
+    # Keep the directory out of the file index's racy window, so its listing is reused
+    os.utime(source_dir, ns=(10**18, 10**18))
+
+    _process()
+    first_hash = _source_hash(image)
+
+    _write_image(image, seed=2)
+    stat = image.stat()
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**10))
+    os.utime(source_dir, ns=(10**18, 10**18))
+
+    _process()
+    assert _source_hash(image) != first_hash
+
+
+def test_enabling_dedupe_reprocesses_sources(workdir):
+    source_dir = workdir / "data/raw_images/steel"
+    source_dir.mkdir(parents=True)
+    _write_image(source_dir / "steel_0001.jpg", seed=1)
+
+    _process()
+    without_dedupe = _config_hashes()
+    _process(dedupe=True)
+
+    assert len(without_dedupe) == 1
+    assert _config_hashes().isdisjoint(without_dedupe)
+
+
+def test_quality_table_keeps_rows_of_skipped_sources(workdir):
+    pq = pytest.importorskip("pyarrow.parquet")
+    source_dir = workdir / "data/raw_images/steel"
+    source_dir.mkdir(parents=True)
+    for seed in (1, 2):
+        _write_image(source_dir / f"steel_{seed:04d}.jpg", seed=seed)
+
+    _process()
+    assert pq.read_table("data/metrics/quality.parquet").num_rows == 2
+
+    _write_image(source_dir / "steel_0003.jpg", seed=3)
+    _process()
+
+    table = pq.read_table("data/metrics/quality.parquet")
+    assert table.num_rows == 3
+    assert len(set(table.column('content_hash').to_pylist())) == 3
@@ -0,0 +1,56 @@
+import numpy as np
+
+import thumbnail_cache
+from thumbnail_cache import ThumbnailCache
+
+
+def _image(seed: int, shape=(300, 400, 3)) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+def _hash(n: int) -> str:
+    return f"{n:064x}"
+
+
+def test_puts_are_batched_until_flush(tmp_path):
+    writer = ThumbnailCache(str(tmp_path), sizes=(64, 128), max_bytes=1 << 20)
+    reader = ThumbnailCache(str(tmp_path), sizes=(64, 128), max_bytes=1 << 20)
+
+    writer.put(_hash(1), _image(1))
+    assert writer.get(_hash(1), 128).shape == (96, 128, 3)
+    assert reader.get(_hash(1), 128) is None
+
+    writer.flush()
+    assert np.array_equal(reader.get(_hash(1), 128), writer.get(_hash(1), 128))
+    assert reader.stats()['stores'] == 1
+
+
+def test_full_batch_is_written_in_one_go(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnail_cache, 'PUT_BATCH', 4)
+    cache = ThumbnailCache(str(tmp_path), sizes=(64,), max_bytes=1 << 20)
+    reader = ThumbnailCache(str(tmp_path), sizes=(64,), max_bytes=1 << 20)
+
+    for n in range(4):
+        cache.put(_hash(n), _image(n))
+
+    assert all(reader.get(_hash(n), 64) is not None for n in range(4))
+
+
+def test_least_recently_used_images_are_evicted(tmp_path):
+    sizes = (32,)
+    capacity = 3
+    cache = ThumbnailCache(str(tmp_path), sizes=sizes, max_bytes=capacity * (32 + 32 * 32 * 3))
+    assert cache.capacity == capacity
+
+    for n in range(3):
+        cache.put(_hash(n), _image(n))
+    cache.flush()
+    cache.get(_hash(0), 32)
+    cache.flush()
+
+    cache.put(_hash(3), _image(3))
+    cache.flush()
+
+    assert cache.get(_hash(1), 32) is None
+    assert all(cache.get(_hash(n), 32) is not None for n in (0, 2, 3))
+    assert cache.stats()['evictions'] == 1